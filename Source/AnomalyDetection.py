@@ -14,6 +14,7 @@ from Source.ConfigFile import ConfigFile
 from Source.HDFRoot import HDFRoot
 from Source.HDFDataset import HDFDataset
 from Source.Utilities import Utilities
+from Source.DeglitchSweep import DeglitchSweep
 from Source.FieldPhotos import FieldPhotos
 from Source.CalibrationFileReader import CalibrationFileReader
 
@@ -480,6 +481,11 @@ class AnomAnalWindow(QtWidgets.QDialog):
         self.fileName = fileName.replace(".hdf",'')
         self.setWindowTitle(self.fileName)
         self.root = root # Undeglitched L1AQC
+        # Deglitching results are cached per file and sensor as parameters are tried, starting from
+        # those saved next to the L1AQC file, e.g. by a headless sweep (see DeglitchSweep)
+        DeglitchSweep.clearFile(self.fileName)
+        self.sweepDirectory = pathOutLevel
+        self.sweeps = {}
 
         # If a parameterization has been saved in the AnomAnalFile, set the properties in the local object
         # for all sensors
@@ -717,6 +723,13 @@ class AnomAnalWindow(QtWidgets.QDialog):
                 lightData = gp.getDataset(sensorType)
                 lightDateTime = Utilities.getDateTime(gp)
 
+        # All wavebands of the sensor are deglitched at once and cached for each parameter set
+        self.sweeps = {}
+        if darkData is not None:
+            self.sweeps['Dark'] = DeglitchSweep.forFile(self.fileName, darkData, sensorType, 'Dark', self.sweepDirectory)
+        if lightData is not None:
+            self.sweeps['Light'] = DeglitchSweep.forFile(self.fileName, lightData, sensorType, 'Light', self.sweepDirectory)
+
         # Deglitch and plot Dark from selected band
         if darkData is None:
             print("Error: No dark data to deglitch")
@@ -772,56 +785,29 @@ class AnomAnalWindow(QtWidgets.QDialog):
 
         # Now run the deglitcher for all wavebands light and dark to calculate the % loss to the data from this sensor
         # Darks
-        columns = darkData.columns
-        globalBadIndex = []
-        for dark1D in columns.items():
-            band = float(dark1D[0])
-            if band > self.minBand and band < self.maxBand:
-                radiometry1D = dark1D[1]
-                window = int(self.WindowDarkLineEdit.text())
-                sigma = float(self.SigmaDarkLineEdit.text())
-                minDark = None if self.MinDarkLineEdit.text()=='None' else float(self.MinDarkLineEdit.text())
-                maxDark = None if self.MaxDarkLineEdit.text()=='None' else float(self.MaxDarkLineEdit.text())
-                MinMaxDarkBand = getattr(self,f'{self.sensor}MinMaxBandDark')
-                lightDark = 'Dark'
-                badIndex, badIndex2, badIndex3 = Utilities.deglitchBand(band,radiometry1D, window, sigma, lightDark, minDark, maxDark,MinMaxDarkBand)
-                globalBadIndex.append(badIndex)
-                globalBadIndex.append(badIndex2)
-                globalBadIndex.append(badIndex3)
+        window = int(self.WindowDarkLineEdit.text())
+        sigma = float(self.SigmaDarkLineEdit.text())
+        minDark = None if self.MinDarkLineEdit.text()=='None' else float(self.MinDarkLineEdit.text())
+        maxDark = None if self.MaxDarkLineEdit.text()=='None' else float(self.MaxDarkLineEdit.text())
+        MinMaxDarkBand = getattr(self,f'{self.sensor}MinMaxBandDark')
 
         # Collapse the badIndexes from all wavebands into one timeseries
         # Must be done seperately for dark and light as they are different length time series
-        # Convert to an array and test along the columns (i.e. each timestamp)
-        gIndex = np.any(np.array(globalBadIndex), 0)
-        percentLoss = 100*(sum(gIndex)/len(gIndex))
-        pLabel = f'Data reduced by {sum(gIndex)} ({percentLoss:.1f}%)'
+        lost, percentLoss = self.sweeps['Dark'].percentLoss(window, sigma, minDark, maxDark, MinMaxDarkBand)
+        pLabel = f'Data reduced by {lost} ({percentLoss:.1f}%)'
         print(pLabel)
         # self.plotWidgetLight.TextItem(pLabel,anchor=(0.2,0.2))
         self.pLossDarkLineEdit.setText(f'{percentLoss:.1f}')
 
         # Lights
-        columns = lightData.columns
-        globalBadIndex = []
-        for light1D in columns.items():
-            band = float(light1D[0])
-            if band > self.minBand and band < self.maxBand:
-                radiometry1D = light1D[1]
-                window = int(self.WindowLightLineEdit.text())
-                sigma = float(self.SigmaLightLineEdit.text())
-                minLight = None if self.MinLightLineEdit.text()=='None' else float(self.MinLightLineEdit.text())
-                maxLight = None if self.MaxLightLineEdit.text()=='None' else float(self.MaxLightLineEdit.text())
-                MinMaxLightBand = getattr(self,f'{self.sensor}MinMaxBandLight')
-                lightDark = 'Light'
-                badIndex, badIndex2, badIndex3 = Utilities.deglitchBand(band,radiometry1D, window, sigma, lightDark, minLight, maxLight,MinMaxLightBand)
-                globalBadIndex.append(badIndex)
-                globalBadIndex.append(badIndex2)
-                globalBadIndex.append(badIndex3)
-
-        # Collapse the badIndexes from all wavebands into one timeseries
-        # Convert to an array and test along the columns (i.e. each timestamp)
-        gIndex = np.any(np.array(globalBadIndex), 0)
-        percentLoss = 100*(sum(gIndex)/len(gIndex))
-        pLabel = f'Data reduced by {sum(gIndex)} ({percentLoss:.1f}%)'
+        window = int(self.WindowLightLineEdit.text())
+        sigma = float(self.SigmaLightLineEdit.text())
+        minLight = None if self.MinLightLineEdit.text()=='None' else float(self.MinLightLineEdit.text())
+        maxLight = None if self.MaxLightLineEdit.text()=='None' else float(self.MaxLightLineEdit.text())
+        MinMaxLightBand = getattr(self,f'{self.sensor}MinMaxBandLight')
+
+        lost, percentLoss = self.sweeps['Light'].percentLoss(window, sigma, minLight, maxLight, MinMaxLightBand)
+        pLabel = f'Data reduced by {lost} ({percentLoss:.1f}%)'
         print(pLabel)
         self.pLossLightLineEdit.setText(f'{percentLoss:.1f}')
 
@@ -869,6 +855,10 @@ class AnomAnalWindow(QtWidgets.QDialog):
         fp = os.path.join(PATH_TO_CONFIG,self.anomAnalFileName)
         self.writeAnomAnalFile(fp)
 
+        # Keep the deglitching results tried on this file for the next time it is opened
+        for sweep in DeglitchSweep.fileSweeps(self.fileName):
+            sweep.save(self.sweepDirectory)
+
     def writeAnomAnalFile(self, filePath):
         header = ['filename','ESWindowDark','ESWindowLight','ESSigmaDark','ESSigmaLight','ESMinDark','ESMaxDark',\
             'ESMinMaxBandDark','ESMinLight','ESMaxLight','ESMinMaxBandLight',
@@ -923,25 +913,10 @@ class AnomAnalWindow(QtWidgets.QDialog):
                 maxDark = getattr(self,f'{sensorType}MaxDark')
                 minMaxDarkBand = getattr(self,f'{sensorType}MinMaxBandDark')
 
-                index = 0
-                # Loop over bands to populate globBads
-                for timeSeries in columns.items():
-                    if index==0:
-                        # Initialize boolean lists for capturing global badIndex conditions across all wavebands
-                        globBad = [False]*len(timeSeries[1])
-                        globBad2 = [False]*len(timeSeries[1])
-                        globBad3 = [False]*len(timeSeries[1])
-                    band = float(timeSeries[0])
-                    if band > self.minBand and band < self.maxBand:
-                        # if index % step == 0:
-                        radiometry1D = timeSeries[1]
-                        badIndex, badIndex2, badIndex3 = Utilities.deglitchBand(band,radiometry1D, window, sigma, lightDark, minDark, maxDark,minMaxDarkBand)
-                        globBad[:] = (True if val2 else val1 for (val1,val2) in zip(globBad,badIndex))
-                        globBad2[:] = (True if val2 else val1 for (val1,val2) in zip(globBad2,badIndex2))
-                        globBad3[:] = (True if val2 else val1 for (val1,val2) in zip(globBad3,badIndex3))
-                            ##It would be good to use an aggregated badIndex on these plots for all bands combined...
-                            # self.savePlots(self.fileName,plotdir,timeSeries,sensorType,lightDark,window,sigma,badIndex,badIndex2,badIndex3)
-                    index +=1
+                # Records flagged in any waveband, from the cached deglitching of all wavebands
+                sweep = DeglitchSweep.forFile(self.fileName, darkData, sensorType, lightDark, self.sweepDirectory)
+                globBad, globBad2, globBad3 = sweep.globalMasks(window, sigma, minDark, maxDark, minMaxDarkBand)
+
                 # Now plot a selection of these USING UNIVERSALLY EXCLUDED INDEXES
                 index =0
                 for timeSeries in columns.items():
@@ -965,35 +940,10 @@ class AnomAnalWindow(QtWidgets.QDialog):
                 maxLight = getattr(self,f'{sensorType}MaxLight')
                 minMaxLightBand = getattr(self,f'{sensorType}MinMaxBandLight')
 
-                globalBadIndex = []
-
-                index = 0
-                for timeSeries in columns.items():
-                    if index==0:
-                        # Initialize boolean lists for capturing global badIndex conditions across all wavebands
-                        globBad = [False]*len(timeSeries[1])
-                        globBad2 = [False]*len(timeSeries[1])
-                        globBad3 = [False]*len(timeSeries[1])
-                    band = float(timeSeries[0])
-                    if band > self.minBand and band < self.maxBand:
-                        radiometry1D = timeSeries[1]
-                        badIndex, badIndex2, badIndex3 = Utilities.deglitchBand(band,radiometry1D, window, sigma, lightDark, minLight, maxLight,minMaxLightBand)
-
-                        # For plotting:
-                        globBad[:] = (True if val2 else val1 for (val1,val2) in zip(globBad,badIndex))
-                        globBad2[:] = (True if val2 else val1 for (val1,val2) in zip(globBad2,badIndex2))
-                        globBad3[:] = (True if val2 else val1 for (val1,val2) in zip(globBad3,badIndex3))
-
-                        # For deletion:
-                        globalBadIndex.append(badIndex)
-                        globalBadIndex.append(badIndex2)
-                        globalBadIndex.append(badIndex3)
-                    index += 1
-
-                # Collapse the badIndexes from all wavebands into one timeseries
-                # Convert to an array and test along the columns (i.e. each timestamp)
-                gIndex = np.any(np.array(globalBadIndex), 0)
-                # NOTE: if you similarly collapse globBads 1-3, you should get the same result as gIndex
+                # Records flagged in any waveband, from the cached deglitching of all wavebands
+                sweep = DeglitchSweep.forFile(self.fileName, lightData, sensorType, lightDark, self.sweepDirectory)
+                globBad, globBad2, globBad3 = sweep.globalMasks(window, sigma, minLight, maxLight, minMaxLightBand)
+                # NOTE: if you collapse globBads 1-3, you get the records deleted in L1AQC (sweep.badRecords)
 
                 # Now plot a selection of these USING UNIVERSALLY EXCLUDED INDEXES
                 index =0
@@ -1165,7 +1115,7 @@ class AnomAnalWindow(QtWidgets.QDialog):
             self.plotWidgetLight.showGrid(x=True, y=True)
             # self.plotWidgetLight.addLegend()
 
-        badIndex, badIndex2, badIndex3 = Utilities.deglitchBand(self.waveBand,radiometry1D, window, sigma, lightDark, minRad, maxRad,minMaxBand)
+        badIndex, badIndex2, badIndex3 = self.sweeps[lightDark].bandMasks(self.waveBand, window, sigma, minRad, maxRad, minMaxBand)
         avg = Utilities.movingAverage(radiometry1D, window).tolist()
 
         # Convert to timestamp
@@ -3,6 +3,8 @@ import binascii
 import os
 import sys
 
+import numpy as np
+
 from Source.CalibrationData import CalibrationData
 from Source.Utilities import Utilities
 
@@ -10,6 +12,20 @@ from Source.Utilities import Utilities
 # CalibrationFile class stores information about an instrument
 # obtained from reading a calibration file
 class CalibrationFile:
+    # Instruments whose frames end with DATETAG (3 bytes) and TIMETAG2 (4 bytes)
+    TIMETAG_INSTRUMENTS = ("SATHED", "SATHLD", "SATHSE", "SATHSL", "SATPYR",
+                           "SATNAV", "$GPRMC", "SATTHS", "UMTWR")
+    # Raw data types whose conversion can never raise
+    SAFE_TYPES = ("BU", "BULE", "BS", "BSLE", "AS")
+    # NumPy equivalents of the binary conversions in CalibrationData.convertRaw
+    # by field length (struct.unpack uses native byte order for BF and BD)
+    NUMPY_TYPES = {"BU": {1: ">u1", 2: ">u2", 4: ">u4", 8: ">u8"},
+                   "BULE": {1: "<u1", 2: "<u2", 4: "<u4", 8: "<u8"},
+                   "BS": {1: ">i1", 2: ">i2", 4: ">i4", 8: ">i8"},
+                   "BSLE": {1: "<i1", 2: "<i2", 4: "<i4", 8: "<i8"},
+                   "BF": {4: "=f4"},
+                   "BD": {8: "=f8"}}
+
     def __init__(self):
         self.id = ""
         self.name = ""
@@ -21,6 +37,15 @@ class CalibrationFile:
         self.frameType = ""
         self.sensorType = ""
 
+        # Set by compileLayout
+        self.fixedFrameLength = None
+        self.checkedFields = []
+        self.hasTimeTags = False
+        self.frameDtype = None
+        self.frameFields = []
+
+        # Set by ProcessL1b_FactoryCal.calibrationPlan
+        self.calibrationPlans = {}
 
     def printd(self):
         if len(self.id) != 0:
@@ -132,9 +157,155 @@ class CalibrationFile:
         return False
 
 
+    # Returns the number of bytes convertRaw will consume for this message frame
+    # without storing anything, or -1 if verifyRaw fails. Raises where convertRaw
+    # would raise, so RawFileReader can index a file ahead of decoding it and
+    # then skip verifyRaw in convertRaw.
+    def frameLength(self, msg):
+        if self.fixedFrameLength is None:
+            self.compileLayout()
+
+        # Fixed layouts only need the fields that can fail to convert
+        if self.fixedFrameLength >= 0:
+            for (offset, cd) in self.checkedFields:
+                cd.convertRaw(msg[offset:offset+cd.fieldLength])
+            return self.fixedFrameLength
+
+        # Same pass as verifyRaw, also converting the empty fields verifyRaw skips
+        try:
+            nRead = 0
+            for i in range(0, len(self.data)):
+                cd = self.data[i]
+                if cd.fieldLength == -1:
+                    delimiter = self.data[i+1].units
+                    delimiter = delimiter.encode("utf-8").decode("unicode_escape").encode("utf-8")
+                    end = msg[nRead:].find(delimiter)
+                    cd.convertRaw(msg[nRead:nRead+end])
+                    nRead += end
+                else:
+                    if cd.fitType.upper() != "DELIMITER":
+                        if cd.fieldLength != 0:
+                            cd.convertRaw(msg[nRead:nRead+cd.fieldLength])
+                    nRead  += cd.fieldLength
+        except KeyError:
+            return -1
+
+        if self.hasTimeTags:
+            nRead += 7
+
+        return nRead
+
+    # Precomputes the frame layout used by frameLength and convertRawFrames.
+    # Frames without variable length fields always have the same length; of
+    # their fields, only those that are not raw binary integers or strings can
+    # fail to convert. Fixed layouts are also compiled into a NumPy structured
+    # dtype over the whole frame.
+    def compileLayout(self):
+        instrumentId = ""
+        fixed = True
+        nRead = 0
+        self.checkedFields = []
+        names = []
+        formats = []
+        offsets = []
+        self.frameFields = []
+        for i in range(0, len(self.data)):
+            cd = self.data[i]
+            if cd.type.upper() == "INSTRUMENT" or cd.type.upper() == "VLF_INSTRUMENT":
+                instrumentId = cd.id
+            if cd.fieldLength == -1:
+                fixed = False
+                continue
+            if cd.fitType.upper() != "DELIMITER" and cd.fieldLength != 0:
+                if cd.dataType.upper() not in CalibrationFile.SAFE_TYPES:
+                    self.checkedFields.append((nRead, cd))
+                # Binary numbers of NumPy sizes are decoded by the dtype itself,
+                # anything else is handed over as bytes to CalibrationData.convertRaw
+                name = f'f{i}'
+                numpyType = CalibrationFile.NUMPY_TYPES.get(cd.dataType.upper(), {}).get(cd.fieldLength)
+                if numpyType is not None:
+                    formats.append(numpyType)
+                    self.frameFields.append((name, cd, False))
+                else:
+                    formats.append("V" + str(cd.fieldLength))
+                    self.frameFields.append((name, cd, True))
+                names.append(name)
+                offsets.append(nRead)
+            else:
+                self.frameFields.append((None, cd, False))
+            nRead += cd.fieldLength
+
+        self.hasTimeTags = instrumentId.startswith(CalibrationFile.TIMETAG_INSTRUMENTS)
+        if self.hasTimeTags:
+            names += ["DATETAG", "TIMETAG2"]
+            formats += ["3u1", ">u4"]
+            offsets += [nRead, nRead+3]
+            nRead += 7
+        self.fixedFrameLength = nRead if fixed else -1
+
+        # Columns appended twice per frame would interleave differently in bulk
+        stored = [(cd.type, cd.id) for (_, cd, _) in self.frameFields if self.isStoredAsColumn(cd)]
+        if fixed and nRead > 0 and len(stored) == len(set(stored)):
+            self.frameDtype = np.dtype({"names": names, "formats": formats,
+                                        "offsets": offsets, "itemsize": nRead})
+        else:
+            self.frameDtype = None
+
+    # Whether convertRaw stores the values of this field in a dataset column
+    @staticmethod
+    def isStoredAsColumn(cd):
+        cdtype = cd.type.upper()
+        return cd.fitType.upper() != "NONE" and cd.fitType.upper() != "DELIMITER" and \
+            cdtype != "INSTRUMENT" and cdtype != "VLF_INSTRUMENT" and \
+            cdtype != "SN" and cdtype != "VLF_SN"
+
+    # Decodes many complete frames of a fixed layout at once (see compileLayout),
+    # storing the same datasets and attributes as calling convertRaw on each.
+    # frames is the concatenation of the frames, which must already have been
+    # checked with frameLength.
+    def convertRawFrames(self, frames, gp):
+        records = np.frombuffer(frames, dtype=self.frameDtype)
+        nFrames = len(records)
+
+        for (name, cd, raw) in self.frameFields:
+            cdtype = cd.type.upper()
+            if cd.fitType.upper() == "DELIMITER":
+                continue
+
+            if CalibrationFile.isStoredAsColumn(cd):
+                if name is None:
+                    values = np.zeros(nFrames, dtype=np.int64)
+                elif raw:
+                    values = [cd.convertRaw(b) for b in records[name].tolist()]
+                else:
+                    values = records[name]
+                ds = gp.getDataset(cd.type)
+                if ds is None:
+                    ds = gp.addDataset(cd.type)
+                ds.extendColumn(cd.id, values)
+            elif cd.fitType.upper() != "NONE":
+                gp.attributes[cdtype] = cd.id
+            elif cdtype == "SN" or cdtype == "DATARATE" or cdtype == "RATE":
+                gp.attributes[cdtype] = cd.id
+
+        if self.hasTimeTags:
+            ds1 = gp.getDataset("DATETAG")
+            if ds1 is None:
+                ds1 = gp.addDataset("DATETAG")
+            dateTag = records["DATETAG"].astype(np.int64)
+            ds1.extendColumn(u"NONE", (dateTag[:,0] << 16) | (dateTag[:,1] << 8) | dateTag[:,2])
+            ds1 = gp.getDataset("TIMETAG2")
+            if ds1 is None:
+                ds1 = gp.addDataset("TIMETAG2")
+            ds1.extendColumn(u"NONE", records["TIMETAG2"])
+
+        return nFrames
+
+
     # Reads a message frame from the raw file and generates hdf groups/datasets
     # Returns nRead (number of bytes read) or -1 on error
-    def convertRaw(self, msg, gp):
+    # verified skips verifyRaw for frames already checked with frameLength
+    def convertRaw(self, msg, gp, verified=False):
         nRead = 0
         instrumentId = ""
 
@@ -142,7 +313,7 @@ class CalibrationFile:
         #    self.data[i].printd()
         #print("file:", msg)
 
-        if self.verifyRaw(msg) == False:
+        if not verified and self.verifyRaw(msg) == False:
             print("Message not read successfully:\n" + str(msg))
             self.verifyRaw(msg)
             return -1
@@ -217,16 +388,8 @@ class CalibrationFile:
         # DATETAG (3 bytes), and TIMETAG2 (4 bytes)        
         #       apparently SATMSG does not .... comes out jibberish
         #       $GPGGA also does not work and timetags will be added later from NMEA strings 
-        if instrumentId.startswith("SATHED") or \
-            instrumentId.startswith("SATHLD") or \
-            instrumentId.startswith("SATHSE") or \
-            instrumentId.startswith("SATHSL") or \
-            instrumentId.startswith("SATPYR") or \
-            instrumentId.startswith("SATNAV") or \
-            instrumentId.startswith("$GPRMC") or \
-            instrumentId.startswith("SATTHS") or \
-            instrumentId.startswith("UMTWR"):
-            #    instrumentId.startswith("SATMSG") or \
+        #       (SATMSG is not in CalibrationFile.TIMETAG_INSTRUMENTS for that reason)
+        if instrumentId.startswith(CalibrationFile.TIMETAG_INSTRUMENTS):
             #print("not gps")
             # Read DATETAG
             b = msg[nRead:nRead+3]
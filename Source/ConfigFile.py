@@ -294,6 +294,7 @@ class ConfigFile:
         ConfigFile.settings["fL2TimeInterval"] = 300
         ConfigFile.settings["bL2EnablePercentLt"] = 1
         ConfigFile.settings["fL2PercentLt"] = 10 # 5% Hooker et al. 2002, Hooker and Morel 2003; <10% IOCCG Protocols
+        ConfigFile.settings["fL2EnsembleWorkers"] = 0 # Worker processes for L2 ensembles; 0 serial, -1 one per CPU
 
         ConfigFile.settings["fL2RhoSky"] = 0.0256 # Mobley 1999
         ConfigFile.settings["bL23CRho"] = 0
@@ -362,6 +363,12 @@ class ConfigFile:
         ConfigFile.settings["bL2SaveSeaBASS"] = 1
         ConfigFile.settings["bL2WriteReport"] = 1
 
+        # HDF5 output compression for all levels: "none", "gzip", or "lzf"
+        ConfigFile.settings["HDFCompression"] = "none"
+        ConfigFile.settings["fHDFCompressionLevel"] = 4 # gzip only, 0-9
+        ConfigFile.settings["bHDFShuffle"] = 1
+        ConfigFile.settings["fHDFChunkRows"] = 0 # Rows per chunk; 0 sizes chunks to ~256 KiB
+
         # If this is a new config file, save it
         if new==1:
             ConfigFile.saveConfig(fileName)
@@ -30,6 +30,8 @@ class Controller:
 
     @staticmethod
     def writeReport(fileName, pathOut, outFilePath, level, inFilePath):
+        # The report includes the plots, some of which may still be rendering
+        Utilities.waitForPlots()
         print('Writing PDF Report...')
         numLevelDict = {'L1A':1,'L1AQC':2,'L1B':3,'L1BQC':4,'L2':5}
         numLevel = numLevelDict[level]
@@ -41,7 +43,8 @@ class Controller:
         #   from the attributes up to that level, then use the ConfigFile.settings for the current level parameters.
         try:
             # Processing successful at this level
-            root = HDFRoot.readHDF5(outFilePath)
+            # The report only needs attributes, so datasets are left unread
+            root = HDFRoot.readHDF5(outFilePath, lazy=True)
             fail = 0
             root.attributes['Fail'] = 0
         except:
@@ -52,7 +55,7 @@ class Controller:
                 try:
                     # Processing successful at the next lower level
                     # Shift from the output to the input directory
-                    root = HDFRoot.readHDF5(inFilePath)
+                    root = HDFRoot.readHDF5(inFilePath, lazy=True)
                 except:
                     msg = "Controller.writeReport: Unable to open HDF file. May be open in another application."
                     # if MainConfig.settings["popQuery"] == 0 and os.getenv('HYPERINSPACE_CMD') != 'TRUE':
@@ -71,74 +74,78 @@ class Controller:
             root.attributes['Fail'] = 1
 
 
-        timeStamp = root.attributes['TIME-STAMP']
-        title = f'File: {fileName} Collected: {timeStamp}'
-
-        # Reports
-        reportPath = os.path.join(pathOut, 'Reports')
-        if os.path.isdir(reportPath) is False:
-            os.mkdir(reportPath)
-        dirPath = os.getcwd()
-        inLogPath = os.path.join(dirPath, 'Logs')
-
-        inPlotPath = os.path.join(pathOut,'Plots')
-        # The inPlotPath is going to be different for L1A-L1E than L2 for many cruises...
-        # In that case, move up one directory
-        if os.path.isdir(os.path.join(inPlotPath, 'L1AQC_Anoms')) is False:
-            inPlotPath = os.path.join(pathOut,'..','Plots')
-
-        outHDF = os.path.split(outFilePath)[1]
-
-        if fail:
-            outPDF = os.path.join(reportPath, f'{os.path.splitext(outHDF)[0]}_fail.pdf')
-        else:
-            outPDF = os.path.join(reportPath, f'{os.path.splitext(outHDF)[0]}.pdf')
+        # The lazily read root holds its HDF file open until closed, whatever happens to the report
+        try:
+            timeStamp = root.attributes['TIME-STAMP']
+            title = f'File: {fileName} Collected: {timeStamp}'
 
-        pdf = PDF()
-        pdf.set_title(title)
-        pdf.set_author(f'HyperCP_{MainConfig.settings["version"]}')
+            # Reports
+            reportPath = os.path.join(pathOut, 'Reports')
+            if os.path.isdir(reportPath) is False:
+                os.mkdir(reportPath)
+            dirPath = os.getcwd()
+            inLogPath = os.path.join(dirPath, 'Logs')
 
-        inLog = os.path.join(inLogPath,f'{fileName}_L1A.log')
-        if os.path.isfile(inLog):
-            print('Level 1A')
-            pdf.print_chapter('L1A', 'Process RAW to L1A', inLog, inPlotPath, fileName, root)
+            inPlotPath = os.path.join(pathOut,'Plots')
+            # The inPlotPath is going to be different for L1A-L1E than L2 for many cruises...
+            # In that case, move up one directory
+            if os.path.isdir(os.path.join(inPlotPath, 'L1AQC_Anoms')) is False:
+                inPlotPath = os.path.join(pathOut,'..','Plots')
 
-        if numLevel > 1:
-            print('Level 1AQC')
-            inLog = os.path.join(inLogPath,f'{fileName}_L1A_L1AQC.log')
-            if os.path.isfile(inLog):
-                pdf.print_chapter('L1AQC', 'Process L1A to L1AQC', inLog, inPlotPath, fileName, root)
+            outHDF = os.path.split(outFilePath)[1]
 
-        if numLevel > 2:
-            print('Level 1B')
-            inLog = os.path.join(inLogPath,f'{fileName}_L1AQC_L1B.log')
-            if os.path.isfile(inLog):
-                pdf.print_chapter('L1B', 'Process L1AQC to L1B', inLog, inPlotPath, fileName, root)
+            if fail:
+                outPDF = os.path.join(reportPath, f'{os.path.splitext(outHDF)[0]}_fail.pdf')
+            else:
+                outPDF = os.path.join(reportPath, f'{os.path.splitext(outHDF)[0]}.pdf')
 
-        if numLevel > 3:
-            print('Level 1BQC')
-            inLog = os.path.join(inLogPath,f'{fileName}_L1B_L1BQC.log')
-            if os.path.isfile(inLog):
-                pdf.print_chapter('L1BQC', 'Process L1B to L1BQC', inLog, inPlotPath, fileName, root)
+            pdf = PDF()
+            pdf.set_title(title)
+            pdf.set_author(f'HyperCP_{MainConfig.settings["version"]}')
 
-        if numLevel > 4:
-            print('Level 2')
-            # For L2, reset Plot directory
-            inPlotPath = os.path.join(pathOut,'Plots')
-            if 'STATION' in outFilePath:
-                inLog = os.path.join(inLogPath,f'Stations_{fileName}_L1BQC_L2.log')
-            else:
-                inLog = os.path.join(inLogPath,f'{fileName}_L1BQC_L2.log')
+            inLog = os.path.join(inLogPath,f'{fileName}_L1A.log')
             if os.path.isfile(inLog):
-                pdf.print_chapter('L2', 'Process L1BQC to L2', inLog, inPlotPath, fileName, root)
+                print('Level 1A')
+                pdf.print_chapter('L1A', 'Process RAW to L1A', inLog, inPlotPath, fileName, root)
+
+            if numLevel > 1:
+                print('Level 1AQC')
+                inLog = os.path.join(inLogPath,f'{fileName}_L1A_L1AQC.log')
+                if os.path.isfile(inLog):
+                    pdf.print_chapter('L1AQC', 'Process L1A to L1AQC', inLog, inPlotPath, fileName, root)
+
+            if numLevel > 2:
+                print('Level 1B')
+                inLog = os.path.join(inLogPath,f'{fileName}_L1AQC_L1B.log')
+                if os.path.isfile(inLog):
+                    pdf.print_chapter('L1B', 'Process L1AQC to L1B', inLog, inPlotPath, fileName, root)
+
+            if numLevel > 3:
+                print('Level 1BQC')
+                inLog = os.path.join(inLogPath,f'{fileName}_L1B_L1BQC.log')
+                if os.path.isfile(inLog):
+                    pdf.print_chapter('L1BQC', 'Process L1B to L1BQC', inLog, inPlotPath, fileName, root)
+
+            if numLevel > 4:
+                print('Level 2')
+                # For L2, reset Plot directory
+                inPlotPath = os.path.join(pathOut,'Plots')
+                if 'STATION' in outFilePath:
+                    inLog = os.path.join(inLogPath,f'Stations_{fileName}_L1BQC_L2.log')
+                else:
+                    inLog = os.path.join(inLogPath,f'{fileName}_L1BQC_L2.log')
+                if os.path.isfile(inLog):
+                    pdf.print_chapter('L2', 'Process L1BQC to L2', inLog, inPlotPath, fileName, root)
 
-        try:
-            pdf.output(outPDF, 'F')
-        except:
-            msg = 'Unable to write the PDF file. It may be open in another program.'
-            Utilities.errorWindow("File Error", msg)
-            print(msg)
-            Utilities.writeLogFile(msg)
+            try:
+                pdf.output(outPDF, 'F')
+            except:
+                msg = 'Unable to write the PDF file. It may be open in another program.'
+                Utilities.errorWindow("File Error", msg)
+                print(msg)
+                Utilities.writeLogFile(msg)
+        finally:
+            root.close()
 
     @staticmethod
     def generateContext(calibrationMap):
@@ -814,6 +821,7 @@ class Controller:
                             fileName = os.path.join('L1BQC',f"{os.path.splitext(inFileName)[0].rsplit('_',1)[0]}"+'_L1BQC.hdf')
                             fp = os.path.join(os.path.abspath(pathOut),fileName)
                             Controller.processSingleLevel(pathOut, fp, calibrationMap, 'L2', flag_Trios)
+        Utilities.waitForPlots()
         print("processFilesMultiLevel - DONE")
 
 
@@ -852,6 +860,7 @@ class Controller:
             #Pass entire list L0 files
             # print("Processing: " + fp)
             Controller.processSingleLevel(pathOut, inFiles, calibrationMap, level, flag_Trios)
+            Utilities.waitForPlots()
             print("processFilesSingleLevel, all files - DONE")
 
         else:
@@ -869,5 +878,6 @@ class Controller:
                 print("Processing: " + fp)
                 # Pass singleton file
                 Controller.processSingleLevel(pathOut, fp, calibrationMap, level, flag_Trios)
+                Utilities.waitForPlots()
 
                 print("processFilesSingleLevel, single file - DONE")
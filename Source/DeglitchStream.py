@@ -0,0 +1,312 @@
+
+import warnings
+import numpy as np
+
+from Source.ConfigFile import ConfigFile
+from Source.Utilities import Utilities
+
+class DeglitchStream:
+    ''' Incremental deglitching of light or dark data as records arrive, with the same two-pass
+        moving-average criteria as ProcessL1aqc_deglitch (Utilities.deglitchBands).
+
+        Records are fed with update() (one or more rows of a (time x band) array) and finish()
+        at the end of the file. A record's decision is final once the records up to two half
+        windows after it have arrived (the second pass averages first-pass results over a
+        centered window); the first and last records of the file are always rejected, as in
+        the batch code. Per band, only the last few windows of records are kept.
+
+        The batch criteria also use file-wide statistics: the residual std (dark), and the
+        median/std used to clamp the rolling std (light). These can be supplied (stats, e.g.
+        DeglitchStream.referenceStats of an earlier file or a calibration run); with the
+        referenceStats of the same file, the decisions match the batch deglitcher record for
+        record. Otherwise they are estimated once from the first warmup records (or the whole
+        file, if shorter) and then kept fixed, so the first decisions wait for warmup records and
+        agree with the batch ones as far as those records are representative of the file.
+
+        Either way, the decisions do not depend on how the records are split between update()
+        calls. '''
+
+    def __init__(self, bands, windowSize, sigma, lightDark, minRad=None, maxRad=None, minMaxBand=None,
+                 stats=None, warmup=None):
+        windowSize = int(windowSize)
+        if windowSize < 3 or windowSize % 2 == 0:
+            raise ValueError('Deglitching windows must be odd integers of at least 3')
+
+        self.bands = [float(band) for band in bands]
+        self.window = windowSize
+        self.half = windowSize // 2
+        self.sigma = float(sigma)
+        self.lightDark = lightDark
+        self.minRad = minRad
+        self.maxRad = maxRad
+        self.minMaxBand = minMaxBand
+        self.fixedStats = stats
+        # Records from which the statistics are estimated (when not supplied)
+        self.warmup = 10*windowSize if warmup is None else int(warmup)
+        if self.warmup < 1:
+            raise ValueError('DeglitchStream warmup must be at least 1 record')
+        self.stats = dict(stats) if stats is not None else {}
+
+        # Per-record state, as lists of (band,) arrays starting at absolute record self.start[name]
+        self.buffers = {name: [] for name in ('x', 'avg1', 'r1', 'y1raw', 'y1', 'flag1', 'flag3', 'x2', 'avg2', 'r2', 'y2raw', 'y2')}
+        self.start = {name: 0 for name in self.buffers}
+        # Values (at most warmup) of the series the statistics are estimated from, until they are
+        self.history = {} if stats is not None else \
+            {name: [] for name in (('r1', 'r2') if lightDark == 'Dark' else ('y1', 'y2'))}
+        # First full rolling std window of each pass, which the light criteria use for the leading records
+        self.y1first = None
+        self.y2first = None
+
+        self.n = 0          # records received
+        self.final = False  # end of file reached
+        self.nAvg1 = 0      # next record for the first-pass moving average
+        self.nY1 = 0        # next record for the (filled, rounded) first-pass rolling std
+        self.nFlag1 = 0     # next record for the first-pass test
+        self.nAvg2 = 0      # next record for the second-pass moving average
+        self.nY2 = 0        # next record for the second-pass rolling std
+        self.nOut = 0       # next record to decide
+
+    @staticmethod
+    def fromSettings(sensorType, lightDark, bands, stats=None, warmup=None):
+        ''' DeglitchStream with the L1AQC deglitching parameters of ConfigFile.settings '''
+        settings = ConfigFile.settings
+        def value(name):
+            v = settings[f'fL1aqc{sensorType}{name}{lightDark}']
+            return None if v == 'None' else v
+        return DeglitchStream(bands, int(value('Window')), float(value('Sigma')), lightDark,
+                              value('Min'), value('Max'), value('MinMaxBand'), stats, warmup)
+
+    @staticmethod
+    def referenceStats(radiometry, windowSize, sigma, lightDark):
+        ''' File-wide statistics of the batch deglitcher for a (time x band) array, to run a
+            DeglitchStream with the same criteria (see Utilities.deglitchPasses) '''
+        data = np.ascontiguousarray(np.asarray(radiometry, dtype=np.float64).T)
+        avg = Utilities.movingAverageBands(data, windowSize)
+        residual = data - avg
+        stats = {}
+        if lightDark == 'Dark':
+            stats['std1'] = np.std(residual, axis=1)
+            std = stats['std1'][:, None]
+        else:
+            y = Utilities.rollingStdBands(residual, windowSize)
+            stats['median1'] = np.median(y, axis=1)
+            stats['std1'] = np.std(y, axis=1)
+            std = np.where(y > (stats['median1'] + 3*stats['std1'])[:, None], stats['median1'][:, None], y)
+
+        data2 = data.copy()
+        data2[Utilities.convolutionBad(data, avg, std, sigma)] = np.nan
+        residual2 = data2 - Utilities.movingAverageBands(data2, windowSize)
+        if lightDark == 'Dark':
+            stats['std2'] = np.nanstd(residual2, axis=1)
+        else:
+            y = Utilities.rollingStdBands(residual2, windowSize)
+            stats['fill2'] = np.nanmedian(y, axis=1)
+            y = np.where(np.isnan(y), stats['fill2'][:, None], y)
+            stats['median2'] = np.nanmedian(y, axis=1)
+            stats['std2'] = np.nanstd(y, axis=1)
+        return stats
+
+    # Per-record buffers
+
+    def get(self, name, k):
+        return self.buffers[name][k - self.start[name]]
+
+    def put(self, name, k, value):
+        assert k == self.start[name] + len(self.buffers[name])
+        self.buffers[name].append(value)
+
+    def trim(self):
+        ''' Drops records no longer needed by any pending window '''
+        keep = max(0, min(self.nOut, self.nAvg2) - 2*self.window - 2*self.half)
+        for name, buffer in self.buffers.items():
+            drop = keep - self.start[name]
+            if drop > 0:
+                del buffer[:drop]
+                self.start[name] = keep
+
+    def windowMean(self, name, k):
+        ''' movingAverage at record k: NaN-tolerant mean over the centered window, clipped at
+            the start and end of the file and summed in record order like movingAverageBands '''
+        total = np.zeros(len(self.bands))
+        count = np.zeros(len(self.bands), dtype=int)
+        for j in range(max(0, k - self.half), min(self.n - 1, k + self.half) + 1):
+            x = self.get(name, j)
+            valid = ~np.isnan(x)
+            total += np.where(valid, x, 0)
+            count += valid
+        return total/np.where(count != 0, count, 1)
+
+    def windowStd(self, name, k):
+        ''' Rolling (trailing window) sample std at record k; NaN for leading or NaN windows '''
+        if k < self.window - 1:
+            return np.full(len(self.bands), np.nan)
+        values = np.array([self.get(name, j) for j in range(k - self.window + 1, k + 1)])
+        return np.std(values, axis=0, ddof=1)
+
+    def lastRecord(self, k):
+        return self.final and k == self.n - 1
+
+    def remember(self, name, value):
+        ''' Keeps a value of a series until its statistics are estimated '''
+        history = self.history.get(name)
+        if history is not None and len(history) < self.warmup:
+            history.append(value)
+
+    def warm(self, name):
+        ''' True once the statistics from this series are known '''
+        return name not in self.history
+
+    def estimateStats(self, name):
+        ''' File-wide statistics from the first warmup values of a series (or all of them, at the
+            end of the file), estimated once and then fixed '''
+        history = self.history.get(name)
+        if history is None or (len(history) < self.warmup and not self.final):
+            return
+        del self.history[name]
+        if len(history) == 0:
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                values = np.ascontiguousarray(np.array(history).T)
+                if name == 'r1':
+                    self.stats['std1'] = np.std(values, axis=1)
+                elif name == 'r2':
+                    self.stats['std2'] = np.nanstd(values, axis=1)
+                elif name == 'y1':
+                    self.stats['median1'] = np.median(values, axis=1)
+                    self.stats['std1'] = np.std(values, axis=1)
+                elif name == 'y2':
+                    self.stats['fill2'] = np.nanmedian(values, axis=1)
+                    values = np.where(np.isnan(values), self.stats['fill2'][:, None], values)
+                    self.stats['median2'] = np.nanmedian(values, axis=1)
+                    self.stats['std2'] = np.nanstd(values, axis=1)
+
+    def statistic(self, name):
+        return self.stats.get(name, np.full(len(self.bands), np.nan))
+
+    def test(self, x, avg, std, k):
+        ''' darkConvolution/lightConvolution for one record '''
+        if k == 0 or self.lastRecord(k):
+            # First and last avg values from convolution are not to be trusted
+            return np.ones(len(self.bands), dtype=bool)
+        return (x > avg + (self.sigma*std)) | (x < avg - (self.sigma*std))
+
+    def thresholds(self, x):
+        ''' deglitchThresholds for one record '''
+        bad = np.zeros(len(self.bands), dtype=bool)
+        if ConfigFile.settings["bL1aqcThreshold"]:
+            for j, band in enumerate(self.bands):
+                if band == self.minMaxBand:
+                    bad[j] = Utilities.deglitchThresholds(band, [x[j]], self.minRad, self.maxRad, self.minMaxBand)[0]
+        return bad
+
+    def advance(self):
+        ''' Computes everything that the records received so far make final '''
+        light = self.lightDark != 'Dark'
+
+        # First pass moving average and residual
+        while self.nAvg1 < self.n and (self.nAvg1 + self.half < self.n or self.final):
+            k = self.nAvg1
+            avg1 = self.windowMean('x', k)
+            r1 = self.get('x', k) - avg1
+            self.put('avg1', k, avg1)
+            self.put('r1', k, r1)
+            self.remember('r1', r1)
+            if light:
+                self.put('y1raw', k, self.windowStd('r1', k))
+                if k == self.window - 1:
+                    self.y1first = self.get('y1raw', k)
+            self.nAvg1 += 1
+
+        # Light: rolling std with leading (and NaN) windows filled from the first full window
+        if light:
+            while self.nY1 < self.nAvg1 and (self.y1first is not None or self.final):
+                y = self.get('y1raw', self.nY1)
+                fill = self.y1first if self.y1first is not None else np.full(len(self.bands), np.nan)
+                y = np.round(np.where(np.isnan(y), fill, y), 3)
+                self.put('y1', self.nY1, y)
+                self.remember('y1', y)
+                self.nY1 += 1
+        self.estimateStats('y1' if light else 'r1')
+
+        # First pass test
+        ready1 = self.nY1 if light else self.nAvg1
+        if not self.warm('y1' if light else 'r1'):
+            ready1 = self.nFlag1
+        while self.nFlag1 < ready1:
+            k = self.nFlag1
+            x = self.get('x', k)
+            if light:
+                y = self.get('y1', k)
+                median = self.statistic('median1')
+                std = np.where(y > median + 3*self.statistic('std1'), median, y)
+            else:
+                std = self.statistic('std1')
+            flag1 = self.test(x, self.get('avg1', k), std, k)
+            self.put('flag1', k, flag1)
+            self.put('x2', k, np.where(flag1, np.nan, x))
+            self.put('flag3', k, self.thresholds(x))
+            self.nFlag1 += 1
+
+        # Second pass moving average and residual
+        while self.nAvg2 < self.nFlag1 and (self.nAvg2 + self.half < self.nFlag1 or (self.final and self.nFlag1 == self.n)):
+            k = self.nAvg2
+            avg2 = self.windowMean('x2', k)
+            r2 = self.get('x2', k) - avg2
+            self.put('avg2', k, avg2)
+            self.put('r2', k, r2)
+            self.remember('r2', r2)
+            if light:
+                self.put('y2raw', k, self.windowStd('r2', k))
+                if k == self.window - 1:
+                    self.y2first = self.get('y2raw', k)
+            self.nAvg2 += 1
+
+        if light:
+            while self.nY2 < self.nAvg2 and (self.y2first is not None or self.final):
+                y = self.get('y2raw', self.nY2)
+                fill = self.y2first if self.y2first is not None else np.full(len(self.bands), np.nan)
+                y = np.round(np.where(np.isnan(y), fill, y), 3)
+                self.put('y2', self.nY2, y)
+                self.remember('y2', y)
+                self.nY2 += 1
+        self.estimateStats('y2' if light else 'r2')
+
+        # Second pass test and decisions
+        ready2 = self.nY2 if light else self.nAvg2
+        if not self.warm('y2' if light else 'r2'):
+            ready2 = self.nOut
+        decisions = []
+        while self.nOut < ready2:
+            k = self.nOut
+            x2 = self.get('x2', k)
+            if light:
+                y = self.get('y2', k)
+                y = np.where(np.isnan(y), self.statistic('fill2'), y)
+                median = self.statistic('median2')
+                std = np.where(y > median + 3*self.statistic('std2'), median, y)
+            else:
+                std = self.statistic('std2')
+            flag2 = self.test(x2, self.get('avg2', k), std, k)
+            decisions.append(bool(np.any(self.get('flag1', k) | flag2 | self.get('flag3', k))))
+            self.nOut += 1
+
+        self.trim()
+        return np.array(decisions, dtype=bool)
+
+    def update(self, records):
+        ''' Adds one record (band,) or several (time x band) and returns the badIndex of the
+            records that became final, starting at record self.nOut before the call '''
+        if self.final:
+            raise ValueError('DeglitchStream already finished')
+        records = np.atleast_2d(np.asarray(records, dtype=np.float64))
+        for x in records:
+            self.put('x', self.n, x)
+            self.n += 1
+        return self.advance()
+
+    def finish(self):
+        ''' Marks the end of the file and returns the badIndex of the remaining records '''
+        self.final = True
+        return self.advance()
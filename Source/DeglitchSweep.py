@@ -0,0 +1,233 @@
+
+import os
+import sys
+import json
+import argparse
+import itertools
+import numpy as np
+
+from Source.HDFRoot import HDFRoot
+from Source.ConfigFile import ConfigFile
+from Source.Utilities import Utilities
+
+class DeglitchSweep:
+    ''' Deglitching (Utilities.deglitchBands) of one light or dark dataset for a grid of
+        window sizes, sigmas and thresholds.
+
+        The moving average and residual std of the first pass depend only on the window,
+        so they are computed once per window and shared by every sigma; the sigmas of a
+        window are then run together as one stacked (sigma*band x time) batch. Thresholds
+        are independent of both and cached on their own. Every result is cached, so the
+        Anomaly Analysis window re-plots instantly for any parameters already evaluated.
+
+        Results can also be saved to, and loaded from, a __cache__ directory next to the
+        L1AQC file, in one .npz file per dataset named after a digest of its wavebands and
+        data. A sweep run ahead of time (see main below) is thus picked up by the Anomaly
+        Analysis window when it opens the same (undeglitched) data. '''
+
+    # Upper limit on the elements of one stacked sigma batch (~32 MB per float64 array)
+    BATCH_ELEMENTS = 4*1024*1024
+
+    # DeglitchSweep instances of recently opened files, keyed by (file, sensor, lightDark)
+    fileCache = {}
+    FILE_CACHE_SIZE = 6
+
+    def __init__(self, bands, radiometry, lightDark):
+        self.bands = [float(band) for band in bands]
+        self.lightDark = lightDark
+        # Band-major copy, as in Utilities.deglitchBands
+        self.data = np.ascontiguousarray(np.asarray(radiometry, dtype=np.float64).T)
+        self.digest = Utilities.arrayDigest(np.array(self.bands), self.data, prefix=lightDark).hex()
+        self.stats = {}
+        self.passes = {}
+        self.thresholds = {}
+
+    @staticmethod
+    def fromDataset(ds, lightDark):
+        ''' DeglitchSweep over all wavebands of an HDFDataset (e.g. ES of the ShutterDark group) '''
+        names = ds.spectralNames()
+        return DeglitchSweep([float(k) for k in names], ds.matrix(names), lightDark)
+
+    @staticmethod
+    def forFile(fileName, ds, sensorType, lightDark, directory=None):
+        ''' Cached DeglitchSweep of a sensor's light or dark data in an L1A/L1AQC file, starting
+            from the results saved in directory (that of the file), if any '''
+        def build():
+            sweep = DeglitchSweep.fromDataset(ds, lightDark)
+            if directory is not None:
+                sweep.load(directory)
+            return sweep
+        return Utilities.cached(DeglitchSweep.fileCache, DeglitchSweep.FILE_CACHE_SIZE, (fileName, sensorType, lightDark), build)
+
+    @staticmethod
+    def fileSweeps(fileName):
+        ''' The cached sweeps of a file '''
+        return [sweep for key, sweep in DeglitchSweep.fileCache.items() if key[0] == fileName]
+
+    @staticmethod
+    def clearFile(fileName):
+        ''' Drops the cached sweeps of a file (e.g. when it is reloaded) '''
+        for key in [key for key in DeglitchSweep.fileCache if key[0] == fileName]:
+            del DeglitchSweep.fileCache[key]
+
+    def cachePath(self, directory):
+        return os.path.join(directory, '__cache__', f'DeglitchSweep_{self.digest}.npz')
+
+    def load(self, directory):
+        ''' Adds the results saved (see save) for the same data in directory. Returns whether
+            there were any. '''
+        path = self.cachePath(directory)
+        if not os.path.isfile(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if not np.array_equal(saved['bands'], self.bands):
+                    return False
+                for i, (windowSize, sigma) in enumerate(saved['passKeys'].tolist()):
+                    self.passes.setdefault((int(windowSize), float(sigma)), (saved[f'pass1_{i}'], saved[f'pass2_{i}']))
+                for i, key in enumerate(saved['thresholdKeys'].tolist()):
+                    self.thresholds.setdefault(tuple(json.loads(key)), saved[f'threshold_{i}'])
+        except (OSError, KeyError, ValueError):
+            # Also run headless (see main), without a log file
+            print(f'DeglitchSweep: could not read {path}')
+            return False
+        return True
+
+    def save(self, directory):
+        ''' Saves the results evaluated so far next to the L1AQC file, for load '''
+        arrays = {'bands': np.array(self.bands),
+                  'passKeys': np.array(list(self.passes.keys()), dtype=np.float64).reshape(-1, 2),
+                  'thresholdKeys': np.array([json.dumps(key) for key in self.thresholds], dtype=str)}
+        for i, (badIndex, badIndex2) in enumerate(self.passes.values()):
+            arrays[f'pass1_{i}'] = badIndex
+            arrays[f'pass2_{i}'] = badIndex2
+        for i, badIndex3 in enumerate(self.thresholds.values()):
+            arrays[f'threshold_{i}'] = badIndex3
+        path = self.cachePath(directory)
+        try:
+            Utilities.replaceFile(path, lambda f: np.savez_compressed(f, **arrays))
+        except OSError:
+            # Also run headless (see main), without a log file
+            print(f'DeglitchSweep: could not write {path}')
+
+    def firstPassStats(self, windowSize):
+        windowSize = int(windowSize)
+        if windowSize not in self.stats:
+            self.stats[windowSize] = Utilities.deglitchFirstPassStats(self.data, windowSize, self.lightDark)
+        return self.stats[windowSize]
+
+    def sweep(self, windowSizes, sigmas):
+        ''' Runs the first and second passes for every (window, sigma) combination not yet cached '''
+        nBands, n = self.data.shape
+        for windowSize in windowSizes:
+            windowSize = int(windowSize)
+            todo = [float(sigma) for sigma in sigmas if (windowSize, float(sigma)) not in self.passes]
+            if len(todo) == 0:
+                continue
+            avg, std = self.firstPassStats(windowSize)
+
+            batch = max(1, DeglitchSweep.BATCH_ELEMENTS // max(1, nBands*n))
+            for start in range(0, len(todo), batch):
+                batchSigmas = todo[start:start + batch]
+                k = len(batchSigmas)
+                # Stack the bands once per sigma: row i*nBands + j is band j with sigma i
+                badIndex, badIndex2 = Utilities.deglitchPasses(
+                    np.tile(self.data, (k, 1)), np.tile(avg, (k, 1)), np.tile(std, (k, 1)),
+                    windowSize, np.repeat(batchSigmas, nBands), self.lightDark)
+                for i, sigma in enumerate(batchSigmas):
+                    rows = slice(i*nBands, (i + 1)*nBands)
+                    self.passes[(windowSize, sigma)] = (badIndex[rows], badIndex2[rows])
+
+    def thresholdPass(self, minRad, maxRad, minMaxBand):
+        key = (minRad, maxRad, minMaxBand, bool(ConfigFile.settings["bL1aqcThreshold"]))
+        if key not in self.thresholds:
+            self.thresholds[key] = Utilities.deglitchThresholdBands(self.bands, self.data, minRad, maxRad, minMaxBand)
+        return self.thresholds[key]
+
+    def masks(self, windowSize, sigma, minRad=None, maxRad=None, minMaxBand=None):
+        ''' First pass, second pass and threshold badIndex as (time x band) arrays, identical
+            to Utilities.deglitchBands for the same parameters '''
+        key = (int(windowSize), float(sigma))
+        if key not in self.passes:
+            self.sweep([windowSize], [sigma])
+        badIndex, badIndex2 = self.passes[key]
+        badIndex3 = self.thresholdPass(minRad, maxRad, minMaxBand)
+        return badIndex.T, badIndex2.T, badIndex3.T
+
+    def bandMasks(self, band, windowSize, sigma, minRad=None, maxRad=None, minMaxBand=None):
+        ''' The masks of a single waveband as lists, like Utilities.deglitchBand '''
+        j = self.bands.index(float(band))
+        return [mask[:, j].tolist() for mask in self.masks(windowSize, sigma, minRad, maxRad, minMaxBand)]
+
+    def inRange(self):
+        ''' Wavebands within the deglitching range (ConfigFile.minDeglitchBand to maxDeglitchBand) '''
+        return np.array([band > ConfigFile.minDeglitchBand and band < ConfigFile.maxDeglitchBand for band in self.bands], dtype=bool)
+
+    def globalMasks(self, windowSize, sigma, minRad=None, maxRad=None, minMaxBand=None):
+        ''' Records flagged by each pass in any waveband within the deglitching range, as lists
+            (the globBad lists of the deglitching plots) '''
+        inRange = self.inRange()
+        return [np.any(mask[:, inRange], axis=1).tolist() for mask in self.masks(windowSize, sigma, minRad, maxRad, minMaxBand)]
+
+    def badRecords(self, windowSize, sigma, minRad=None, maxRad=None, minMaxBand=None):
+        ''' Records flagged in any waveband within the deglitching range, as deleted by
+            ProcessL1aqc_deglitch '''
+        badIndex, badIndex2, badIndex3 = self.masks(windowSize, sigma, minRad, maxRad, minMaxBand)
+        return np.any((badIndex | badIndex2 | badIndex3)[:, self.inRange()], axis=1)
+
+    def percentLoss(self, windowSize, sigma, minRad=None, maxRad=None, minMaxBand=None):
+        gIndex = self.badRecords(windowSize, sigma, minRad, maxRad, minMaxBand)
+        return int(gIndex.sum()), 100*(gIndex.sum()/len(gIndex))
+
+
+def main():
+    ''' Headless sweep: tabulates the data loss of each window/sigma/threshold combination for the
+        light and dark data of each sensor in an undeglitched L1AQC file. The results are saved
+        next to the file for the Anomaly Analysis window (see DeglitchSweep.load), and the record
+        masks can also be saved to an .npz file of their own. '''
+    parser = argparse.ArgumentParser(description='Sweep deglitching parameters over an undeglitched L1AQC file')
+    parser.add_argument('file', help='L1AQC HDF5 file processed without deglitching')
+    parser.add_argument('-s', '--sensors', nargs='+', default=['ES', 'LI', 'LT'])
+    parser.add_argument('-w', '--windows', nargs='+', type=int, default=[3, 5, 7, 9, 11, 13, 15])
+    parser.add_argument('-g', '--sigmas', nargs='+', type=float, default=[2.0, 2.5, 3.0, 3.5, 4.0])
+    parser.add_argument('--min', nargs='+', type=float, default=[None], help='Minimum thresholds (with --band)')
+    parser.add_argument('--max', nargs='+', type=float, default=[None], help='Maximum thresholds (with --band)')
+    parser.add_argument('--band', type=float, help='Waveband of the thresholds (the nearest one of each sensor is used)')
+    parser.add_argument('-o', '--output', help='.npz file for the badIndex record masks of every combination')
+    args = parser.parse_args()
+    if args.band is None and (args.min != [None] or args.max != [None]):
+        parser.error('--min and --max need --band')
+
+    root = HDFRoot.readHDF5(args.file)
+    directory = os.path.dirname(os.path.abspath(args.file))
+    if args.band is not None:
+        ConfigFile.settings["bL1aqcThreshold"] = 1
+    ConfigFile.settings.setdefault("bL1aqcThreshold", 0)
+
+    saved = {}
+    print(f'{"sensor":8}{"frames":8}{"window":>8}{"sigma":>8}{"min":>8}{"max":>8}{"lost":>8}{"%":>8}')
+    for sensorType in args.sensors:
+        for gp in root.groups:
+            lightDark = gp.attributes.get("FrameType", '').replace('Shutter', '')
+            if lightDark not in ('Dark', 'Light') or sensorType not in gp.datasets:
+                continue
+            sweep = DeglitchSweep.fromDataset(gp.getDataset(sensorType), lightDark)
+            sweep.load(directory)
+            band = None
+            if args.band is not None:
+                band = sweep.bands[Utilities.find_nearest(sweep.bands, args.band)]
+            sweep.sweep(args.windows, args.sigmas)
+            for windowSize, sigma, minRad, maxRad in itertools.product(args.windows, args.sigmas, args.min, args.max):
+                lost, percentLoss = sweep.percentLoss(windowSize, sigma, minRad, maxRad, band)
+                print(f'{sensorType:8}{lightDark:8}{windowSize:8d}{sigma:8.2f}{str(minRad):>8}{str(maxRad):>8}{lost:8d}{percentLoss:8.1f}')
+                saved[f'{sensorType}_{lightDark}_W{windowSize}_S{sigma}_Min{minRad}_Max{maxRad}'] = \
+                    sweep.badRecords(windowSize, sigma, minRad, maxRad, band)
+            sweep.save(directory)
+
+    print(f'Saved the results for the Anomaly Analysis window to {os.path.join(directory, "__cache__")}')
+    if args.output:
+        np.savez_compressed(args.output, **saved)
+        print(f'Saved {os.path.abspath(args.output)}')
+
+if __name__ == '__main__':
+    sys.exit(main())
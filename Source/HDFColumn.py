@@ -0,0 +1,106 @@
+
+import numpy as np
+
+class HDFColumn:
+    ''' Growable, array-backed column used by HDFDataset.appendColumn.
+
+        Values are stored in a NumPy buffer that doubles its capacity when full,
+        so appending N values costs amortized O(1) each and the column can be
+        handed to columnsToDataset as an array view without building a list.
+        Python ints and floats are stored as int64 and float64; any other value
+        (or a mix of types) switches the buffer to an object array, which keeps
+        the exact Python objects as a list would. Indexing and iteration
+        return Python scalars so the column reads like the list it replaces. '''
+
+    MIN_CAPACITY = 16
+
+    def __init__(self):
+        self.buffer = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.toArray().tolist())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.toArray()[i].tolist()
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError("HDFColumn index out of range")
+        return self.buffer[i].item() if self.buffer.dtype != object else self.buffer[i]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.toArray()
+        return self.toArray().astype(dtype)
+
+    def __repr__(self):
+        return repr(self.toArray().tolist())
+
+    def toArray(self):
+        ''' Returns the filled part of the buffer (a view, not a copy) '''
+        if self.buffer is None:
+            return np.empty((0,))
+        return self.buffer[:self.size]
+
+    def tolist(self):
+        return self.toArray().tolist()
+
+    @staticmethod
+    def bufferType(val):
+        ''' NumPy type used to store a Python value '''
+        if type(val) is int:
+            if -2**63 <= val < 2**63:
+                return np.int64
+            return object
+        if type(val) is float:
+            return np.float64
+        return object
+
+    def reserve(self, n, dtype):
+        ''' Grows (doubling) or retypes the buffer so that n more values of dtype fit '''
+        if self.buffer is None:
+            self.buffer = np.empty(max(HDFColumn.MIN_CAPACITY, n), dtype=dtype)
+            return
+        if self.buffer.dtype != dtype and self.buffer.dtype != object:
+            # Mixed types: keep the Python values, as a list would
+            values = self.toArray().tolist()
+            self.buffer = np.empty(len(self.buffer), dtype=object)
+            self.buffer[:self.size] = values
+        if self.size + n > len(self.buffer):
+            grown = np.empty(max(2*len(self.buffer), self.size + n), dtype=self.buffer.dtype)
+            grown[:self.size] = self.buffer[:self.size]
+            self.buffer = grown
+
+    def append(self, val):
+        if self.buffer is None or self.size == len(self.buffer) or \
+            (self.buffer.dtype != object and self.bufferType(val) != self.buffer.dtype):
+            self.reserve(1, self.bufferType(val))
+        self.buffer[self.size] = val
+        self.size += 1
+
+    def extend(self, vals):
+        if isinstance(vals, np.ndarray) and vals.ndim == 1 and vals.dtype.kind in 'iuf' and \
+            not (vals.dtype.kind == 'u' and vals.dtype.itemsize == 8 and len(vals) and vals.max() >= 2**63):
+            dtype = np.float64 if vals.dtype.kind == 'f' else np.int64
+        else:
+            vals = vals.tolist() if isinstance(vals, np.ndarray) and vals.ndim == 1 else list(vals)
+            if len(vals) == 0:
+                return
+            types = set([self.bufferType(val) for val in vals])
+            dtype = types.pop() if len(types) == 1 else object
+            if dtype == object:
+                # Element-wise assignment keeps nested sequences as single values
+                objects = np.empty(len(vals), dtype=object)
+                for j, val in enumerate(vals):
+                    objects[j] = val
+                vals = objects
+        if len(vals) == 0:
+            return
+        self.reserve(len(vals), dtype)
+        self.buffer[self.size:self.size+len(vals)] = vals
+        self.size += len(vals)
@@ -2,13 +2,42 @@ import collections
 import sys
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from Source.HDFColumn import HDFColumn
 
 class HDFDataset:
+    # Target chunk size for compressed writes when no chunk length is configured
+    CHUNK_BYTES = 256*1024
+
     def __init__(self):
         self.id = ""
         self.attributes = collections.OrderedDict()
         self.columns = collections.OrderedDict()
         self.data = None
+        # h5py dataset backing a lazily read dataset until it is loaded
+        self.source = None
+
+    @property
+    def data(self):
+        if self.source is not None:
+            self.load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.source = None
+
+    def isLoaded(self):
+        return self.source is None
+
+    def load(self):
+        ''' Materializes a lazily read dataset from its open HDF5 file '''
+        if self.source is not None:
+            self._data = self.source[:] # Gets converted to numpy.ndarray
+            self.source = None
+        return self._data
 
     def copy(self, ds):
         self.copyAttributes(ds)
@@ -29,7 +58,7 @@ class HDFDataset:
     def printd(self):
         print("Dataset:", self.id)
 
-    def read(self, f):
+    def read(self, f, lazy=False):
         name = f.name[f.name.rfind("/")+1:]
         self.id = name
 
@@ -43,17 +72,35 @@ class HDFDataset:
                 self.attributes[k] = f.attrs[k].decode("utf-8")
 
         # Read dataset
-        self.data = f[:] # Gets converted to numpy.ndarray
+        if lazy:
+            # Defer reading until data is first accessed (see HDFRoot.readHDF5)
+            self._data = None
+            self.source = f
+        else:
+            self.data = f[:] # Gets converted to numpy.ndarray
         # print("Dataset:", name)
         # print("Data:", self.data.dtype)
 
-    def write(self, f):
+    def writeFilters(self, options):
+        ''' create_dataset keywords for the compression options from HDFRoot.writeOptions '''
+        if not options or self.data.ndim == 0 or len(self.data) == 0:
+            return {}
+        # Chunk along time so that reading a time range touches few chunks
+        rows = options.get("chunkRows") or max(1, HDFDataset.CHUNK_BYTES // max(1, self.data[:1].nbytes))
+        filters = {"chunks": (min(int(rows), len(self.data)),) + self.data.shape[1:],
+                   "compression": options["compression"],
+                   "shuffle": options.get("shuffle", False)}
+        if options.get("compressionLevel") is not None:
+            filters["compression_opts"] = options["compressionLevel"]
+        return filters
+
+    def write(self, f, options=None):
         #print("id:", self.id)
         #print("columns:", self.columns)
         #print("data:", self.data)
 
         if self.data is not None:
-            dset = f.create_dataset(self.id, data=self.data, dtype=self.data.dtype)
+            dset = f.create_dataset(self.id, data=self.data, dtype=self.data.dtype, **self.writeFilters(options))
             # f = f.create_group(self.id)
             # Write attributes
             for k in self.attributes:
@@ -68,15 +115,100 @@ class HDFDataset:
 
     def appendColumn(self, name, val):
         if name not in self.columns:
-            self.columns[name] = [val]
-        else:
-            self.columns[name].append(val)
+            self.columns[name] = HDFColumn()
+        self.columns[name].append(val)
+
+    def extendColumn(self, name, vals):
+        if name not in self.columns:
+            self.columns[name] = HDFColumn()
+        self.columns[name].extend(vals)
+
+    def columnView(self, name):
+        ''' Returns a column as a NumPy view of self.data (no copy; writes go through to data) '''
+        if self.data is None or name not in self.data.dtype.names:
+            return None
+        return self.data[name]
+
+    def columnViews(self):
+        ''' Returns all columns as NumPy views of self.data, keyed like self.columns '''
+        views = collections.OrderedDict()
+        if self.data is None:
+            return views
+        for k in self.data.dtype.names:
+            views[k] = self.data[k]
+        return views
 
-    def datasetToColumns(self):
-        ''' Converts numpy array into columns (stored as a dictionary) '''
+    def spectralNames(self):
+        ''' Names of the wavelength columns (e.g. "412.5"), in dataset order '''
+        names = []
+        if self.data is None:
+            return names
+        for k in self.data.dtype.names:
+            try:
+                float(k)
+            except ValueError:
+                continue
+            names.append(k)
+        return names
+
+    def matrix(self, names=None):
+        ''' Returns the spectral columns as a 2-D (time x wavelength) float64 array.
+
+            When the columns are float64 and adjacent in the record (the usual
+            layout for ES/LI/LT) this is a strided view of self.data, so writes
+            go through to the dataset; otherwise it is a copy. '''
+        if names is None:
+            names = self.spectralNames()
+        if self.data is None or len(names) == 0:
+            return np.empty((0 if self.data is None else len(self.data), 0))
+
+        fields = self.data.dtype.fields
+        offset0 = fields[names[0]][1]
+        contiguous = True
+        for j, k in enumerate(names):
+            fieldType, offset = fields[k][:2]
+            if fieldType != np.float64 or offset != offset0 + 8*j:
+                contiguous = False
+                break
+        if contiguous and self.data.ndim == 1:
+            first = self.data[names[0]]
+            return as_strided(first, shape=(len(self.data), len(names)), strides=(first.strides[0], 8))
+
+        return np.column_stack([self.data[k].astype(np.float64) for k in names])
+
+    def setMatrix(self, values, names=None):
+        ''' Writes a 2-D (time x wavelength) array back into the spectral columns '''
+        if names is None:
+            names = self.spectralNames()
+        values = np.asarray(values)
+        for j, k in enumerate(names):
+            column = self.data[k]
+            if not np.shares_memory(column, values[:, j]):
+                column[:] = values[:, j]
+
+    def columnsAreViews(self):
+        ''' True when self.columns are exactly the column views of self.data '''
+        if self.data is None or self.data.dtype.names is None or \
+            list(self.columns.keys()) != list(self.data.dtype.names):
+            return False
+        for k, v in self.columns.items():
+            if not isinstance(v, np.ndarray) or v.base is not self.data or \
+                v.__array_interface__ != self.data[k].__array_interface__:
+                return False
+        return True
+
+    def datasetToColumns(self, views=False):
+        ''' Converts numpy array into columns (stored as a dictionary)
+
+            With views=True the columns are NumPy views of self.data rather
+            than lists, and columnsToDataset becomes a no-op until a column is
+            replaced (in-place edits already land in self.data). '''
         if self.data is None:
             print("Warning - datasetToColumns: data is empty")
             return
+        if views:
+            self.columns = self.columnViews()
+            return
         self.columns = collections.OrderedDict()
         for k in self.data.dtype.names:
             #print("type",type(ltData.data[k]))
@@ -91,6 +223,10 @@ class HDFDataset:
             print("Id:", self.id) #, ", Columns:", self.columns)
             return False
 
+        if self.columnsAreViews():
+            # Columns already live in self.data; nothing to rebuild
+            return True
+
         dtype = []
         for name in self.columns.keys():
 
@@ -140,6 +276,9 @@ class HDFDataset:
                 elif v[0] == 'default':
                     v = 3
 
+            if isinstance(v, HDFColumn):
+                # Single copy from the column buffer into the structured array
+                v = v.toArray()
             self.data[k] = v
 
         return True
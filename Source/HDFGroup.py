@@ -7,11 +7,25 @@ import numpy as np
 from Source.HDFDataset import HDFDataset
 
 class HDFGroup:
+    # Number of in-place renames of any group, so that HDFRoot.getGroup knows when its
+    # index can have missed a name
+    renames = 0
+
     def __init__(self):
         self.id = ""
         self.datasets = collections.OrderedDict()
         self.attributes = collections.OrderedDict()
 
+    @property
+    def id(self):
+        return self._id
+
+    @id.setter
+    def id(self, name):
+        if self.__dict__.get('_id', name) not in ('', name):
+            HDFGroup.renames += 1
+        self._id = name
+
     def copy(self, gp):
         self.copyAttributes(gp)
         for k, ds in gp.datasets.items():
@@ -85,7 +99,12 @@ class HDFGroup:
             ds = self.datasets[k]
             ds.printd()
 
-    def read(self, f):
+    def load(self):
+        ''' Materializes any lazily read datasets '''
+        for ds in self.datasets.values():
+            ds.load()
+
+    def read(self, f, lazy=False):
         name = f.name[f.name.rfind("/")+1:]
         self.id = name
 
@@ -105,9 +124,9 @@ class HDFGroup:
                 #print("Item:", k)
                 ds = HDFDataset()
                 self.datasets[k] = ds
-                ds.read(item)
+                ds.read(item, lazy)
 
-    def write(self, f):
+    def write(self, f, options=None):
         #print("Group:", self.id)
         try:
             f = f.create_group(self.id)
@@ -117,7 +136,7 @@ class HDFGroup:
             # Write datasets
             for key,ds in self.datasets.items():
                 #f.create_dataset(ds.id, data=np.asarray(ds.data))
-                ds.write(f)
+                ds.write(f, options)
         except:
             e = sys.exc_info()[0]
             print(e)
@@ -3,6 +3,7 @@ import collections
 import h5py
 import numpy as np
 
+from Source.ConfigFile import ConfigFile
 from Source.HDFGroup import HDFGroup
 from Source.HDFDataset import HDFDataset
 
@@ -11,9 +12,39 @@ from Source.HDFDataset import HDFDataset
 class HDFRoot:
     def __init__(self):
         self.id = ""
+        # groups keeps file (write) order; groupIndex maps name -> group for lookups.
+        # Add and remove groups with addGroup/appendGroup/removeGroup.
         self.groups = []
+        self.groupIndex = {}
+        self.indexedRenames = HDFGroup.renames
         self.datasets = []
         self.attributes = collections.OrderedDict()
+        # Open h5py.File while a lazily read root still has unloaded datasets
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load(self):
+        ''' Materializes every lazily read dataset; the file can then be closed '''
+        for gp in self.groups:
+            gp.load()
+        for ds in self.datasets:
+            ds.load()
+
+    def close(self):
+        ''' Closes the file of a lazily read root. Datasets not yet loaded are left empty (data is None). '''
+        if self.file is not None:
+            for gp in self.groups:
+                for ds in gp.datasets.values():
+                    ds.source = None
+            for ds in self.datasets:
+                ds.source = None
+            self.file.close()
+            self.file = None
 
     def copy(self, node):
         self.copyAttributes(node)
@@ -30,23 +61,48 @@ class HDFRoot:
         if not gp:
             gp = HDFGroup()
             gp.id = name
-            self.groups.append(gp)
+            self.appendGroup(gp)
         return gp
 
-    def getGroup(self, name):
+    def appendGroup(self, gp):
+        ''' Appends an existing HDFGroup (e.g. one taken from another root) '''
+        self.groups.append(gp)
+        if gp.id not in self.groupIndex:
+            self.groupIndex[gp.id] = gp
+
+    def reindexGroups(self):
+        ''' Rebuilds groupIndex, e.g. after a group was renamed; the first group with a name wins '''
+        self.groupIndex = {}
+        self.indexedRenames = HDFGroup.renames
         for gp in self.groups:
-            if gp.id == name:
-                return gp
-        return None
+            if gp.id not in self.groupIndex:
+                self.groupIndex[gp.id] = gp
 
-    def removeGroup(self, name):
-        gp = name
-        if gp:
-            self.groups.remove(gp)
+    def getGroup(self, name):
+        gp = self.groupIndex.get(name)
+        if gp is not None and gp.id == name:
+            return gp
+        if gp is None and self.indexedRenames == HDFGroup.renames:
+            return None
+        # Stale entry, or a miss since a group was renamed in place: refresh the index
+        self.reindexGroups()
+        return self.groupIndex.get(name)
+
+    def removeGroup(self, gp):
+        ''' Removes a group, given either the HDFGroup or its name '''
+        if isinstance(gp, str):
+            gp = self.getGroup(gp)
+        if gp is None or not any(g is gp for g in self.groups):
+            return False
+        self.groups.remove(gp)
+        if self.groupIndex.get(gp.id) is gp:
+            del self.groupIndex[gp.id]
+        return True
 
     def getDataset(self, name):
-        if name in self.datasets:
-            return self.datasets[name]
+        for ds in self.datasets:
+            if ds.id == name:
+                return ds
         return None
 
     def printd(self):
@@ -58,45 +114,81 @@ class HDFRoot:
             gp.printd()
 
     @staticmethod
-    def readHDF5(fp):
+    def readHDF5(fp, lazy=False):
+        ''' Reads an HDF5 file into a new root.
+
+            With lazy=True only the attributes and the group/dataset layout
+            are read; each dataset's data is read on first access (or by
+            load()), and the file stays open until close() is called. '''
         root = HDFRoot()
-        with h5py.File(fp, "r") as f:
-
-            # set name to text after last '/'
-            name = f.name[f.name.rfind("/")+1:]
-            if len(name) == 0:
-                name = "/"
-            root.id = name
-
-            # Read attributes
-            #print("Attributes:", [k for k in f.attrs.keys()])
-            for k in f.attrs.keys():
-                # Need to check values for non-character encoding
-                value = f.attrs[k]
-                if value.__class__ is np.ndarray:
-                    root.attributes[k] = value
-                else:
-                    root.attributes[k] = f.attrs[k].decode("utf-8")
-                # Use the following when using h5toh4 converter:
-                #root.attributes[k.replace("__GLOSDS", "")] = f.attrs[k].decode("utf-8")
-            # Read groups
-            for k in f.keys():
-                item = f.get(k)
-                #print(item)
-                if isinstance(item, h5py.Group):
-                    gp = HDFGroup()
-                    root.groups.append(gp)
-                    gp.read(item)
-                elif isinstance(item, h5py.Dataset):
-                    # print("HDFRoot should not contain datasets")
-                    ds = HDFDataset()
-                    root.datasets.append(ds)
-                    ds.read(item)
+        if lazy:
+            f = h5py.File(fp, "r")
+            try:
+                root.file = f
+                HDFRoot.readItems(root, f, lazy)
+            except:
+                f.close()
+                root.file = None
+                raise
+        else:
+            with h5py.File(fp, "r") as f:
+                HDFRoot.readItems(root, f, lazy)
 
         return root
 
+    @staticmethod
+    def readItems(root, f, lazy):
+        # set name to text after last '/'
+        name = f.name[f.name.rfind("/")+1:]
+        if len(name) == 0:
+            name = "/"
+        root.id = name
+
+        # Read attributes
+        #print("Attributes:", [k for k in f.attrs.keys()])
+        for k in f.attrs.keys():
+            # Need to check values for non-character encoding
+            value = f.attrs[k]
+            if value.__class__ is np.ndarray:
+                root.attributes[k] = value
+            else:
+                root.attributes[k] = f.attrs[k].decode("utf-8")
+            # Use the following when using h5toh4 converter:
+            #root.attributes[k.replace("__GLOSDS", "")] = f.attrs[k].decode("utf-8")
+        # Read groups
+        for k in f.keys():
+            item = f.get(k)
+            #print(item)
+            if isinstance(item, h5py.Group):
+                gp = HDFGroup()
+                gp.read(item, lazy)
+                root.appendGroup(gp)
+            elif isinstance(item, h5py.Dataset):
+                # print("HDFRoot should not contain datasets")
+                ds = HDFDataset()
+                root.datasets.append(ds)
+                ds.read(item, lazy)
+
+    @staticmethod
+    def writeOptions():
+        ''' Compression options for writeHDF5 from the configuration, or None for uncompressed output '''
+        compression = str(ConfigFile.settings.get("HDFCompression", "none")).lower()
+        if compression not in ("gzip", "lzf"):
+            return None
+        options = {"compression": compression,
+                   "shuffle": bool(ConfigFile.settings.get("bHDFShuffle", 1)),
+                   "chunkRows": int(ConfigFile.settings.get("fHDFChunkRows", 0)),
+                   "compressionLevel": None}
+        if compression == "gzip":
+            options["compressionLevel"] = min(9, max(0, int(ConfigFile.settings.get("fHDFCompressionLevel", 4))))
+        return options
+
     # Writing to HDF5 file
-    def writeHDF5(self, fp):
+    def writeHDF5(self, fp, options=None):
+        ''' Writes the root to fp. options (see writeOptions) default to the configured compression;
+            h5py decompresses transparently on read. '''
+        if options is None:
+            options = HDFRoot.writeOptions()
         with h5py.File(fp, "w") as f:
             #print("Root:", self.id)
             # Write attributes
@@ -107,4 +199,4 @@ class HDFRoot:
                 #f.attrs[k+"__GLOSDS"] = np.string_(self.attributes[k])
             # Write groups
             for gp in self.groups:
-                gp.write(f)
+                gp.write(f, options)
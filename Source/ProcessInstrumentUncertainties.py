@@ -4,7 +4,6 @@ from abc import ABC, abstractmethod
 import numpy as np
 import scipy as sp
 import pandas as pd
-import calendar
 import collections
 from decimal import Decimal
 from inspect import currentframe, getframeinfo
@@ -21,6 +20,7 @@ from Source.ConfigFile import ConfigFile
 from Source.HDFRoot import HDFRoot  # for typing
 from Source.HDFGroup import HDFGroup  # for typing
 from Source.ProcessL1b_FRMCal import ProcessL1b_FRMCal
+from Source.SlaperStrayLight import SlaperStrayLight
 from Source.Uncertainty_Analysis import Propagate
 from Source.Weight_RSR import Weight_RSR
 from Source.CalibrationFileReader import CalibrationFileReader
@@ -1367,34 +1367,7 @@ class Instrument(ABC):
 
     @staticmethod
     def Slaper_SL_correction(input_data, SL_matrix, n_iter=5):
-        nband = len(input_data)
-        m_norm = np.zeros(nband)
-
-        mC = np.zeros((n_iter + 1, nband))
-        mX = np.zeros((n_iter + 1, nband))
-        mZ = SL_matrix
-        mX[0, :] = input_data
-
-        for i in range(nband):
-            jstart = np.max([0, i - 10])
-            jstop = np.min([nband, i + 10])
-            m_norm[i] = np.sum(mZ[i, jstart:jstop])  # eq 4
-
-        for i in range(nband):
-            if m_norm[i] == 0:
-                mZ[i, :] = np.zeros(nband)
-            else:
-                mZ[i, :] = mZ[i, :]/m_norm[i]  # eq 5
-
-        for k in range(1, n_iter + 1):
-            for i in range(nband):
-                mC[k - 1, i] = mC[k - 1, i] + np.sum(mX[k - 1, :]*mZ[i, :])  # eq 6
-                if mC[k - 1, i] == 0:
-                    mX[k, i] = 0
-                else:
-                    mX[k, i] = (mX[k - 1, i]*mX[0, i])/mC[k - 1, i]  # eq 7
-
-        return mX[n_iter - 1, :]
+        return SlaperStrayLight.correct(input_data, SL_matrix, n_iter)
 
     @staticmethod
     def absolute_calibration(normalized_mesure, updated_radcal_gain):
@@ -1591,45 +1564,9 @@ class HyperOCR(Instrument):
     @staticmethod
     def _interp(lightData, lightTimer, darkData, darkTimer):
         # Interpolate Dark Dataset to match number of elements as Light Dataset
-        newDarkData = np.copy(lightData.data)
-        for k in darkData.data.dtype.fields.keys():  # darkData.data.dtype.fields.keys():  # For each wavelength
-            x = np.copy(darkTimer.data).tolist()  # darktimer
-            y = np.copy(darkData.data[k]).tolist()  # data at that band over time
-            new_x = lightTimer.data  # lighttimer
-
-            if len(x) < 3 or len(y) < 3 or len(new_x) < 3:
-                msg = "**************Cannot do cubic spline interpolation, length of datasets < 3"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-            if not Utilities.isIncreasing(x):
-                msg = "**************darkTimer does not contain strictly increasing values"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-            if not Utilities.isIncreasing(new_x):
-                msg = "**************lightTimer does not contain strictly increasing values"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-
-            if len(x) >= 3:
-                # Because x is now a list of datetime tuples, they'll need to be
-                # converted to Unix timestamp values
-                xTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in x]
-                newXTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in new_x]
-
-                newDarkData[k] = Utilities.interp(xTS,y,newXTS, fill_value=np.nan)
-
-                for val in newDarkData[k]:
-                    if np.isnan(val):
-                        frameinfo = getframeinfo(currentframe())
-                        msg = f'found NaN {frameinfo.lineno}'
-            else:
-                msg = '**************Record too small for splining. Exiting.'
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
+        newDarkData = Utilities.interpDark(darkData, darkTimer, lightData, lightTimer)
+        if isinstance(newDarkData, bool):
+            return False
 
         if Utilities.hasNan(darkData):
             frameinfo = getframeinfo(currentframe())
@@ -1820,7 +1757,7 @@ class HyperOCR(Instrument):
                     S12_sl_corr_unc.append(sl4[i] - S12_sl_corr[i])
 
             sample_S12_sl_syst = cm.generate_sample(mDraws, S12_sl_corr, np.array(S12_sl_corr_unc), "syst")
-            sample_S12_sl_rand = prop.run_samples(self.Slaper_SL_correction, [sample_S12, sample_mZ, sample_n_iter])
+            sample_S12_sl_rand = SlaperStrayLight.correctSamples(sample_S12, sample_mZ, sample_n_iter)
             sample_S12_sl_corr = prop.combine_samples([sample_S12_sl_syst, sample_S12_sl_rand])
 
             # alpha = ((S1-S12)/(S12**2)).tolist()
@@ -1933,7 +1870,7 @@ class HyperOCR(Instrument):
                     S12_sl_corr_unc.append(sl4[i] - data2[i])
 
             sample_straylight_1 = cm.generate_sample(mDraws, data2, np.array(S12_sl_corr_unc), "syst")  # model error of method
-            sample_straylight_2 = prop.run_samples(self.Slaper_SL_correction,[sample_data1, sample_mZ, sample_n_iter])  # error from method
+            sample_straylight_2 = SlaperStrayLight.correctSamples(sample_data1, sample_mZ, sample_n_iter)  # error from method
 
             sample_data2 = prop.combine_samples([sample_straylight_1, sample_straylight_2])  # total straylight uncertainty
 
@@ -2217,7 +2154,7 @@ class Trios(Instrument):
                     S12_sl_corr_unc.append(sl4[i] - S12_sl_corr[i])
 
             sample_S12_sl_syst = cm.generate_sample(mDraws, S12_sl_corr, np.array(S12_sl_corr_unc), "syst")
-            sample_S12_sl_rand = prop.run_samples(self.Slaper_SL_correction, [sample_S12, sample_mZ, sample_n_iter])
+            sample_S12_sl_rand = SlaperStrayLight.correctSamples(sample_S12, sample_mZ, sample_n_iter)
             sample_S12_sl_corr = prop.combine_samples([sample_S12_sl_syst, sample_S12_sl_rand])
 
             alpha = self.alphafunc(S1, S12)
@@ -2321,7 +2258,7 @@ class Trios(Instrument):
                     S12_sl_corr_unc.append(sl4[i] - straylight_corr_mesure[i])
 
             sample_straylight_1 = cm.generate_sample(mDraws, straylight_corr_mesure, np.array(S12_sl_corr_unc), "syst")
-            sample_straylight_2 = prop.run_samples(self.Slaper_SL_correction,[sample_linear_corr_mesure, sample_mZ, sample_n_iter])
+            sample_straylight_2 = SlaperStrayLight.correctSamples(sample_linear_corr_mesure, sample_mZ, sample_n_iter)
             sample_straylight_corr_mesure = prop.combine_samples([sample_straylight_1, sample_straylight_2])
 
             # Normalization Correction, based on integration time
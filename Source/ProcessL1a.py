@@ -76,7 +76,7 @@ class ProcessL1a:
             gp.attributes["DISTANCE_2"] = "Surface " + cf.sensorType + " 1 1 0"
             gp.attributes["SensorDataList"] = ", ".join(list(gp.datasets.keys()))
             if gp.id != 'SAS' and gp.id != 'Reference':
-                root.groups.append(gp)
+                root.appendGroup(gp)
 
         # Insure essential data groups are present before proceeding
         hld = 0
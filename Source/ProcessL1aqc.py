@@ -2,13 +2,13 @@
 import math
 import datetime
 import numpy as np
-from pysolar.solar import get_azimuth, get_altitude
 import bisect
 import copy
 
 from Source.HDFDataset import HDFDataset
 from Source.ProcessL1aqc_deglitch import ProcessL1aqc_deglitch
 from Source.Utilities import Utilities
+from Source.SolarPosition import SolarPosition
 from Source.ConfigFile import ConfigFile
 
 class ProcessL1aqc:
@@ -30,34 +30,8 @@ class ProcessL1aqc:
         Utilities.writeLogFile(msg)
 
         # Delete the records in badTime ranges from each dataset in the group
-        finalCount = 0
         originalLength = len(timeStamp)
-        for dateTime in badTimes:
-            # Need to reinitialize for each loop
-            startLength = len(timeStamp)
-            newTimeStamp = []
-
-            start = dateTime[0]
-            stop = dateTime[1]
-
-            # msg = f'Eliminate data between: {dateTime}'
-            # print(msg)
-            # Utilities.writeLogFile(msg)
-
-            if startLength > 0:
-                rowsToDelete = []
-                for i in range(startLength):
-                    if start <= timeStamp[i] and stop >= timeStamp[i]:
-                        rowsToDelete.append(i)
-                        finalCount += 1
-                    else:
-                        newTimeStamp.append(timeStamp[i])
-                group.datasetDeleteRow(rowsToDelete)
-            else:
-                msg = 'Data group is empty. Continuing.'
-                print(msg)
-                Utilities.writeLogFile(msg)
-            timeStamp = newTimeStamp.copy()
+        finalCount = Utilities.deleteTimeRanges(group, timeStamp, badTimes)
 
         msg = f'   Length of records removed from dataset: {finalCount}'
         print(msg)
@@ -180,11 +154,10 @@ class ProcessL1aqc:
                 # Solar geometry is preferentially acquired from SolarTracker or pySAS
                 # Otherwise resorts to ancillary data. Otherwise processing fails.
                 # Run Pysolar to obtain solar geometry.
-                sunAzimuthAnc = []
-                sunZenithAnc = []
-                for i, dt_utc in enumerate(gpsDateTime):
-                    sunAzimuthAnc.append(get_azimuth(latAnc[i],lonAnc[i],dt_utc,0)) # latAnc lonAnc from GPS, not ancillary file
-                    sunZenithAnc.append(90 - get_altitude(latAnc[i],lonAnc[i],dt_utc,0))
+                # latAnc lonAnc from GPS, not ancillary file
+                n = len(gpsDateTime)
+                sunAzimuthAnc, sunZenithAnc = SolarPosition.azimuthZenith(latAnc[:n], lonAnc[:n], gpsDateTime)
+                sunAzimuthAnc, sunZenithAnc = sunAzimuthAnc.tolist(), sunZenithAnc.tolist()
 
                 # SATTHS fluxgate compass on SAS
                 if compass is None:
@@ -245,11 +218,9 @@ class ProcessL1aqc:
             # Solar geometry is preferentially acquired from SolarTracker or pySAS
             # Otherwise resorts to ancillary data. Otherwise processing fails.
             # Run Pysolar to obtain solar geometry.
-            sunAzimuthAnc = []
-            sunZenithAnc = []
-            for i, dt_utc in enumerate(timeStamp):
-                sunAzimuthAnc.append(get_azimuth(latAnc[i],lonAnc[i],dt_utc,0))
-                sunZenithAnc.append(90 - get_altitude(latAnc[i],lonAnc[i],dt_utc,0))
+            n = len(timeStamp)
+            sunAzimuthAnc, sunZenithAnc = SolarPosition.azimuthZenith(latAnc[:n], lonAnc[:n], timeStamp)
+            sunAzimuthAnc, sunZenithAnc = sunAzimuthAnc.tolist(), sunZenithAnc.tolist()
 
             # relAzAnc either from ancillary relZz, ancillary sensorAz, (or THS compass above ^^)
             relAzAnc = []
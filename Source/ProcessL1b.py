@@ -1,6 +1,5 @@
 import os
 import datetime as dt
-import calendar
 from inspect import currentframe, getframeinfo
 import glob
 from datetime import datetime
@@ -408,46 +407,9 @@ class ProcessL1b:
             msg = f'found NaN {frameinfo.lineno}'
 
         # Interpolate Dark Dataset to match number of elements as Light Dataset
-        newDarkData = np.copy(lightData.data)
-        for k in darkData.data.dtype.fields.keys(): # For each wavelength
-            x = np.copy(darkTimer.data).tolist() # darktimer
-            y = np.copy(darkData.data[k]).tolist()  # data at that band over time
-            new_x = lightTimer.data  # lighttimer
-
-            if len(x) < 3 or len(y) < 3 or len(new_x) < 3:
-                msg = "**************Cannot do cubic spline interpolation, length of datasets < 3"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-
-            if not Utilities.isIncreasing(x):
-                msg = "**************darkTimer does not contain strictly increasing values"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-            if not Utilities.isIncreasing(new_x):
-                msg = "**************lightTimer does not contain strictly increasing values"
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
-
-            if len(x) >= 3:
-                # Because x is now a list of datetime tuples, they'll need to be
-                # converted to Unix timestamp values
-                xTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in x]
-                newXTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in new_x]
-
-                newDarkData[k] = Utilities.interp(xTS,y,newXTS, fill_value=np.nan)
-
-                for val in newDarkData[k]:
-                    if np.isnan(val):
-                        frameinfo = getframeinfo(currentframe())
-                        msg = f'found NaN {frameinfo.lineno}'
-            else:
-                msg = '**************Record too small for splining. Exiting.'
-                print(msg)
-                Utilities.writeLogFile(msg)
-                return False
+        newDarkData = Utilities.interpDark(darkData, darkTimer, lightData, lightTimer)
+        if isinstance(newDarkData, bool):
+            return False
 
         darkData.data = newDarkData
 
@@ -459,9 +421,9 @@ class ProcessL1b:
             exit()
 
         # Correct light data by subtracting interpolated dark data from light data
-        for k in lightData.data.dtype.fields.keys():
-            for x in range(lightData.data.shape[0]):
-                lightData.data[k][x] -= newDarkData[k][x]
+        names = list(lightData.data.dtype.names)
+        darks = np.column_stack([newDarkData[k] for k in names])
+        lightData.setMatrix(lightData.matrix(names) - darks, names)
 
         if Utilities.hasNan(lightData):
             frameinfo = getframeinfo(currentframe())
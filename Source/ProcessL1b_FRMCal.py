@@ -9,6 +9,8 @@ from scipy import interpolate
 
 # internal files
 from Source.ConfigFile import ConfigFile
+from Source.SlaperStrayLight import SlaperStrayLight
+from Source.ZongStrayLight import ZongStrayLight
 
 
 class ProcessL1b_FRMCal:
@@ -227,57 +229,14 @@ class ProcessL1b_FRMCal:
 
     @staticmethod
     def Zong_SL_correction_matrix(LSF, n_IB: int = 3):
-        LSF[LSF<=0] = 0
-        SDF = np.copy(LSF)
-        for i in range(len(LSF)):
-        # for j in range(len(LSF)):
-            # define IB indexes
-            j1 = i-n_IB
-            j2 = i+n_IB
-            if j1 <= 0:
-                j1 = 0
-            IB = LSF[i,j1:j2+1]
-            IBsum = np.sum(IB)
-            if np.sum(IB) == 0:
-                IBsum = 1.0
-            # Zong eq. 1
-            SDF[i,:] = SDF[i,:]/float(IBsum)
-            SDF[i,j1:j2+1] = 0
-
-        A = np.identity(len(LSF)) + SDF   # Matrix A from eq. 8
-        C = np.linalg.inv(A)              # Matrix C from eq. 9
-
-        return C
+        ''' Zong stray light correction matrix C (eq. 9), cached by LSF content. Not called at present:
+            its calls are commented out in favour of Slaper_SL_correction (see processL1b_SeaBird) '''
+        return ZongStrayLight.correctionMatrix(LSF, n_IB)
 
     @staticmethod
     def Slaper_SL_correction(input_data, SL_matrix, n_iter=5):
-        nband = len(input_data)
-        m_norm = np.zeros(nband)
-        mC = np.zeros((n_iter+1, nband))
-        mX = np.zeros((n_iter+1, nband))
-        mZ = SL_matrix
-        mX[0, :] = input_data
-
-        for i in range(nband):
-            jstart = np.max([0,i-10])
-            jstop  = np.min([nband,i+10])
-            m_norm[i] = np.sum(mZ[i,jstart:jstop])  # eq 4
-
-        for i in range(nband):
-            if m_norm[i] == 0:
-                mZ[i,:] = np.zeros(nband)
-            else:
-                mZ[i,:] = mZ[i,:]/m_norm[i]   # eq 5
-
-        for k in range(1,n_iter+1):
-            for i in range(nband):
-                mC[k-1,i] = mC[k-1,i] + np.sum(mX[k-1,:]*mZ[i,:])  # eq 6
-                if mC[k-1,i] == 0:
-                    mX[k,i] = 0
-                else:
-                    mX[k,i] = (mX[k-1,i] * mX[0,i]) / mC[k-1,i]   # eq 7
-
-        return mX[n_iter-1,:]
+        ''' Slaper stray light correction of a spectrum or an (n_spectra x nband) batch of spectra '''
+        return SlaperStrayLight.correct(input_data, SL_matrix, n_iter)
 
     def processL1b_SeaBird(node):
         # calibration of HyperOCR following the FRM processing of FRM4SOC2
@@ -356,15 +315,17 @@ class ProcessL1b_FRMCal:
             updated_radcal_gain[ind_nocal==True] = 1
             updated_radcal_gain = updated_radcal_gain[ind_nocal==False]
 
+            # raw data
+            sl_corr_data = raw_data[:, ind_raw_data]
+            # Non-linearity
+            sl_corr_data = sl_corr_data*(1-alpha*sl_corr_data)
+            # Straylight, all measurements at once
+            sl_corr_data = ProcessL1b_FRMCal.Slaper_SL_correction(sl_corr_data, mZ, n_iter)
+            # sl_corr_data = np.matmul(sl_corr_data, C_zong.T)
+
             FRM_mesure = np.zeros((nmes, len(updated_radcal_gain)))
             for n in range(nmes):
-                # raw data
-                data = raw_data[n][ind_raw_data]
-                # Non-linearity
-                data = data*(1-alpha*data)
-                # Straylight
-                data = ProcessL1b_FRMCal.Slaper_SL_correction(data, mZ, n_iter)
-                # data = np.matmul(C_zong, data)
+                data = sl_corr_data[n]
                 # Calibration
                 data = data * (cal_int/int_time[n]) / updated_radcal_gain
                 # thermal
@@ -1,4 +1,5 @@
 
+import collections
 import datetime as dt
 import numpy as np
 import re
@@ -6,171 +7,150 @@ from Source.Utilities import Utilities
 
 class ProcessL1b_FactoryCal:
 
+    # Fit types that are accepted but leave the data unchanged
+    # OPTIC1 and THERM1 (optical thermal sensors like pyrometers, not the thermal responsivity
+    # of OPTIC3 sensors) are not implemented; neither are DDMM, HHMMSS, DDMMYY and TIME2.
+    PASSTHROUGH_FIT_TYPES = ("OPTIC1", "THERM1", "DDMM", "HHMMSS", "DDMMYY", "TIME2", "COUNT", "NONE")
+
     # Used to calibrate raw data (convert from L1a to L1b)
     # Reference: "SAT-DN-00134_Instrument File Format.pdf"
+    # Each method calibrates the (records x fields) matrix of one dataset. coeffs holds one row per
+    # coefficient and one column per field; im (the immersion coefficient) is 1.0 unless immersed.
     @staticmethod
-    def processDataset(ds, cd, inttime=None, immersed=False):
-        #print("FitType:", cd.fitType)
-        if cd.fitType == "OPTIC1":
-            ProcessL1b_FactoryCal.processOPTIC1(ds, cd, immersed)
-        elif cd.fitType == "OPTIC2":
-            ProcessL1b_FactoryCal.processOPTIC2(ds, cd, immersed)
-        elif cd.fitType == "OPTIC3":
-            ProcessL1b_FactoryCal.processOPTIC3(ds, cd, immersed, inttime)
-        elif cd.fitType == "OPTIC4":
-            ProcessL1b_FactoryCal.processOPTIC4(ds, cd, immersed)
-        elif cd.fitType == "THERM1":
-            ProcessL1b_FactoryCal.processTHERM1(ds, cd)
-        elif cd.fitType == "POW10":
-            ProcessL1b_FactoryCal.processPOW10(ds, cd, immersed)
-        elif cd.fitType == "POLYU":
-            ProcessL1b_FactoryCal.processPOLYU(ds, cd)
-        elif cd.fitType == "POLYF":
-            ProcessL1b_FactoryCal.processPOLYF(ds, cd)
-        elif cd.fitType == "DDMM":
-            ProcessL1b_FactoryCal.processDDMM(ds, cd)
-        elif cd.fitType == "HHMMSS":
-            ProcessL1b_FactoryCal.processHHMMSS(ds, cd)
-        elif cd.fitType == "DDMMYY":
-            ProcessL1b_FactoryCal.processDDMMYY(ds, cd)
-        elif cd.fitType == "TIME2":
-            ProcessL1b_FactoryCal.processTIME2(ds, cd)
-        elif cd.fitType == "COUNT":
-            pass
-        elif cd.fitType == "NONE":
-            pass
-        else:
-            msg = f'ProcessL1b_FactoryCal.processDataset: Unknown Fit Type: {cd.fitType}'
-            print(msg)
-            Utilities.writeLogFile(msg)
-
-    # Process OPTIC1 - not implemented
-    @staticmethod
-    def processOPTIC1(ds, cd, immersed):
-        return
-
-    @staticmethod
-    def processOPTIC2(ds, cd, immersed):
-        a0 = float(cd.coefficients[0])
-        a1 = float(cd.coefficients[1])
-        im = float(cd.coefficients[2]) if immersed else 1.0
-        k = cd.id
-        for x in range(ds.data.shape[0]):
-            ds.data[k][x] = im * a1 * (ds.data[k][x] - a0)
+    def processOPTIC2(values, coeffs, aint=None):
+        a0, a1, im = coeffs[0], coeffs[1], coeffs[2]
+        return im * a1 * (values - a0)
 
     @staticmethod
-    def processOPTIC3(ds, cd, immersed, inttime):
-        # a0 = float(cd.coefficients[0])
-        a1 = float(cd.coefficients[1])
-        im = float(cd.coefficients[2]) if immersed else 1.0
-        cint = float(cd.coefficients[3])
-        #print(inttime.data.shape[0], self.data.shape[0])
-        k = cd.id
-        #print(cint, aint)
-        #print(cd.id)
-        for x in range(ds.data.shape[0]):
-            aint = inttime.data[cd.type][x]
-            # ds.data[k][x] = im * a1 * (ds.data[k][x] - a0) * (cint/aint)
-            ##############################################################
-            #   When applying calibration to the dark current corrected
-            #   radiometry, a0 cancels (see ProSoftUserManual7.7 11.1.1.5 Eqns 5-6)
-            #   presuming light and dark factory cals are equivalent (which they are).
-            ##############################################################
-            ds.data[k][x] = im * a1 * (ds.data[k][x]) * (cint/aint)
+    def processOPTIC3(values, coeffs, aint):
+        a1, im, cint = coeffs[1], coeffs[2], coeffs[3]
+        # return im * a1 * (values - a0) * (cint/aint)
+        ##############################################################
+        #   When applying calibration to the dark current corrected
+        #   radiometry, a0 cancels (see ProSoftUserManual7.7 11.1.1.5 Eqns 5-6)
+        #   presuming light and dark factory cals are equivalent (which they are).
+        ##############################################################
+        return im * a1 * values * (cint[None, :]/aint[:, None])
 
     @staticmethod
-    def processOPTIC4(ds, cd, immersed):
-        a0 = float(cd.coefficients[0])
-        a1 = float(cd.coefficients[1])
-        im = float(cd.coefficients[2]) if immersed else 1.0
-        cint = float(cd.coefficients[3])
-        k = cd.id
+    def processOPTIC4(values, coeffs, aint=None):
+        a0, a1, im, cint = coeffs[0], coeffs[1], coeffs[2], coeffs[3]
         aint = 1
-        for x in range(ds.data.shape[0]):
-            ds.data[k][x] = im * a1 * (ds.data[k][x] - a0) * (cint/aint)
+        return im * a1 * (values - a0) * (cint/aint)
 
-    # Process THERM1 - not implemented
-    #   This is for optical thermal sensors like pyrometers, I believe.
-    #   This is not for thermal responsivity of OPTICS3 sensors
     @staticmethod
-    def processTHERM1(ds, cd):
-        return
+    def processPOW10(values, coeffs, aint=None):
+        a0, a1, im = coeffs[0], coeffs[1], coeffs[2]
+        return im * np.power(10.0, (values - a0)/a1)
 
     @staticmethod
-    def processPOW10(ds, cd, immersed):
-        a0 = float(cd.coefficients[0])
-        a1 = float(cd.coefficients[1])
-        im = float(cd.coefficients[2]) if immersed else 1.0
-        k = cd.id
-        for x in range(ds.data.shape[0]):
-            ds.data[k][x] = im * pow(10, ((ds.data[k][x]-a0)/a1))
+    def processPOLYU(values, coeffs, aint=None):
+        num = np.zeros_like(values)
+        for i, a in enumerate(coeffs):
+            num = num + a * np.power(values, i)
+        return num
 
     @staticmethod
-    def processPOLYU(ds, cd):
-        k = cd.id
-        for x in range(ds.data.shape[0]):
-            num = 0
-            for i in range(0, len(cd.coefficients)):
-                a = float(cd.coefficients[i])
-                num += a * pow(ds.data[k][x],i)
-            ds.data[k][x] = num
+    def processPOLYF(values, coeffs, aint=None):
+        num = np.broadcast_to(coeffs[0], values.shape)
+        for a in coeffs[1:]:
+            num = num * (values - a)
+        return num
 
     @staticmethod
-    def processPOLYF(ds, cd):
-        a0 = float(cd.coefficients[0])
-        k = cd.id
-        for x in range(ds.data.shape[0]):
-            num = a0
-            for a in cd.coefficients[1:]:
-                num *= (ds.data[k][x] - float(a))
-            ds.data[k][x] = num
+    def coefficients(cd, immersed=False):
+        ''' The coefficients of a field as floats, with the immersion coefficient (OPTIC2-4, POW10)
+            replaced by 1.0 when not immersed '''
+        coeffs = [float(a) for a in cd.coefficients]
+        if cd.fitType in ("OPTIC2", "OPTIC3", "OPTIC4", "POW10") and not immersed:
+            coeffs = coeffs[:2] + [1.0] + coeffs[3:]
+        return coeffs
 
     @staticmethod
-    def processDDMM(ds, cd):
-        ''' Process DDMM - not implemented '''
-        return
-        #s = "{:.2f}".format(x)
-        #x = s[:1] + " " + s[1:3] + "\' " + s[3:5] + "\""
+    def compilePlan(cf, immersed=False):
+        ''' Groups the calibrated fields of a CalibrationFile into steps of one dataset and fit type,
+            with their coefficients stacked into (coefficients x fields) arrays. Each field keeps the
+            order of its calibrations; a field listed twice goes into a later step. Returns the
+            INTTIME steps, the other steps, and whether the file has INTTIME fields. '''
+        inttimeSteps = {}
+        steps = {}
+        seen = collections.Counter()
+        hasInttime = False
+        for cd in cf.data:
+            if cd.type == "INTTIME":
+                hasInttime = True
+            if cd.fitType in ProcessL1b_FactoryCal.PASSTHROUGH_FIT_TYPES:
+                continue
+            group = inttimeSteps if cd.type == "INTTIME" else steps
+            if not hasattr(ProcessL1b_FactoryCal, "process" + cd.fitType):
+                # Unknown fit types are reported when applied, field by field
+                group[("UNKNOWN", cd.type, cd.id)] = (cd.fitType, cd.type, [cd.id], None)
+                continue
+            coeffs = ProcessL1b_FactoryCal.coefficients(cd, immersed)
+            # Only fields with as many coefficients (e.g. polynomials of one degree) are stacked
+            key = (cd.type, cd.fitType, len(coeffs), seen[(cd.type, cd.id)])
+            seen[(cd.type, cd.id)] += 1
+            if key not in group:
+                group[key] = (cd.fitType, cd.type, [], [])
+            group[key][2].append(cd.id)
+            group[key][3].append(coeffs)
+
+        def stack(group):
+            return [(fitType, dsType, names, None if coeffs is None else np.array(coeffs, dtype=np.float64).T)
+                    for (fitType, dsType, names, coeffs) in group.values()]
+        return stack(inttimeSteps), stack(steps), hasInttime
 
     @staticmethod
-    def processHHMMSS(ds, cd):
-        ''' Process HHMMSS - not implemented '''
-        return
-        #s = "{:.2f}".format(x)
-        #x = s[:2] + ":" + s[2:4] + ":" + s[4:6] + "." + s[6:8]
+    def calibrationPlan(cf, immersed=False):
+        ''' The compiled plan of a CalibrationFile, cached on it so that every file processed with
+            the same calibration map reuses it '''
+        if immersed not in cf.calibrationPlans:
+            cf.calibrationPlans[immersed] = ProcessL1b_FactoryCal.compilePlan(cf, immersed)
+        return cf.calibrationPlans[immersed]
 
     @staticmethod
-    def processDDMMYY(ds, cd):
-        ''' Process DDMMYY - not implemented '''
-        return
-        #s = str(x)
-        #x = s[:2] + "/" + s[2:4] + "/" + s[4:]
+    def processStep(ds, step, inttime=None):
+        fitType, dsType, names, coeffs = step
+        if coeffs is None:
+            msg = f'ProcessL1b_FactoryCal.processDataset: Unknown Fit Type: {fitType}'
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return
+        aint = None
+        if fitType == "OPTIC3":
+            aint = np.asarray(inttime.data[dsType], dtype=np.float64)
+        process = getattr(ProcessL1b_FactoryCal, "process" + fitType)
+        ds.setMatrix(process(ds.matrix(names), coeffs, aint), names)
 
     @staticmethod
-    def processTIME2(ds, cd):
-        ''' Process TIME2 - not implemented '''
-        return
-        #x = datetime.fromtimestamp(x).strftime("%y-%m-%d %H:%M:%S")
+    def processDataset(ds, cd, inttime=None, immersed=False):
+        ''' Calibrates a single field '''
+        if cd.fitType in ProcessL1b_FactoryCal.PASSTHROUGH_FIT_TYPES:
+            return
+        if not hasattr(ProcessL1b_FactoryCal, "process" + cd.fitType):
+            step = (cd.fitType, cd.type, [cd.id], None)
+        else:
+            coeffs = ProcessL1b_FactoryCal.coefficients(cd, immersed)
+            step = (cd.fitType, cd.type, [cd.id], np.array([coeffs], dtype=np.float64).T)
+        ProcessL1b_FactoryCal.processStep(ds, step, inttime)
 
     # Used to calibrate raw data (from L1a to L1b)
     @staticmethod
     def processGroup(gp, cf): # group, calibration file
+        inttimeSteps, steps, hasInttime = ProcessL1b_FactoryCal.calibrationPlan(cf)
 
         inttime = None
-        for cd in cf.data: # cd is the name of the cal file data
+        if hasInttime:
             # Process slightly differently for INTTIME
-            if cd.type == "INTTIME":
-                #print("Process INTTIME")
-                ds = gp.getDataset("INTTIME")
-                ProcessL1b_FactoryCal.processDataset(ds, cd)
-                inttime = ds
+            inttime = gp.getDataset("INTTIME")
+            for step in inttimeSteps:
+                ProcessL1b_FactoryCal.processStep(inttime, step)
 
-        for cd in cf.data:
+        for step in steps:
             # process each dataset in the cal file list of data, except INTTIME
-            if gp.getDataset(cd.type) and cd.type != "INTTIME":
-                #print("Dataset:", cd.type)
-                ds = gp.getDataset(cd.type)
-                ProcessL1b_FactoryCal.processDataset(ds, cd, inttime)
+            ds = gp.getDataset(step[1])
+            if ds:
+                ProcessL1b_FactoryCal.processStep(ds, step, inttime)
 
     @staticmethod
     def get_cal_file_lines(calibrationMap):
@@ -1,15 +1,14 @@
 
 import collections
 import datetime as dt
-import calendar
 from inspect import currentframe, getframeinfo
-from pysolar.solar import get_azimuth, get_altitude
 import numpy as np
-import scipy as sp
-import warnings
 
 from Source.HDFRoot import HDFRoot
 from Source.Utilities import Utilities
+from Source.SolarPosition import SolarPosition
+from Source.SplineResampler import SplineResampler
+from Source.TimeInterpolator import TimeInterpolator
 from Source.ConfigFile import ConfigFile
 
 
@@ -308,39 +307,53 @@ class ProcessL1b_Interp:
         # List of datasets requiring fill instead of interpolation
         fillList = ['STATION']
 
-        for k in xData.data.dtype.names:
-            if k == "Datetag" or k == "Timetag2" or k == "Datetime":
-                continue
-            # print(k)
-            x = list(xTimer)
-            new_x = list(yTimer)
-            y = np.copy(xData.data[k]).tolist()
+        names = [k for k in xData.data.dtype.names if k not in ("Datetag", "Timetag2", "Datetime")]
 
-            # Because x is now a list of datetime tuples, they'll need to be
-            # converted to Unix timestamp values
-            xTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in x]
-            newXTS = [calendar.timegm(xDT.utctimetuple()) + xDT.microsecond / 1E6 for xDT in new_x]
+        # Because x is now a list of datetime tuples, they'll need to be
+        # converted to Unix timestamp values. The interpolation operator of this pair of timers is
+        # shared with every other dataset on the same timer.
+        operator = TimeInterpolator.operator(xTimer, yTimer)
+        xTS, newXTS, index = operator
 
+        if index is not None and kind == 'linear' and dataName not in fillList:
             if dataName in angList:
-
-                newXData.columns[k] = Utilities.interpAngular(xTS, y, newXTS, fill_value=0)
+                newY = TimeInterpolator.angular(operator, xData.matrix(names))
 
                 # Some angular measurements (like SAS pointing) are + and -, and get converted
                 # to all +. Convert them back to - for 180-359
                 if dataName == "POINTING":
-                    pointingData = newXData.columns[k]
-                    for i, angle in enumerate(pointingData):
-                        if angle > 180:
-                            pointingData[i] = angle - 360
+                    newY[newY > 180] -= 360
+            else:
+                newY = TimeInterpolator.linear(operator, xData.matrix(names))
 
-            elif dataName in fillList:
-                newXData.columns[k] = Utilities.interpFill(xTS,y,newXTS, fillValue=np.nan)
+            for j, k in enumerate(names):
+                newXData.columns[k] = newY[:, j]
+
+        else:
+            # Timers which are not strictly increasing, fills and splines go column by column
+            for k in names:
+                y = np.copy(xData.data[k]).tolist()
+
+                if dataName in angList:
+
+                    newXData.columns[k] = Utilities.interpAngular(xTS.tolist(), y, newXTS.tolist(), fill_value=0)
+
+                    # Some angular measurements (like SAS pointing) are + and -, and get converted
+                    # to all +. Convert them back to - for 180-359
+                    if dataName == "POINTING":
+                        pointingData = newXData.columns[k]
+                        for i, angle in enumerate(pointingData):
+                            if angle > 180:
+                                pointingData[i] = angle - 360
+
+                elif dataName in fillList:
+                    newXData.columns[k] = Utilities.interpFill(xTS.tolist(),y,newXTS.tolist(), fillValue=np.nan)
 
-            else:
-                if kind == 'cubic':
-                    newXData.columns[k] = Utilities.interpSpline(xTS, y, newXTS)
                 else:
-                    newXData.columns[k] = Utilities.interp(xTS,y,newXTS, fill_value=np.nan)
+                    if kind == 'cubic':
+                        newXData.columns[k] = Utilities.interpSpline(xTS.tolist(), y, newXTS.tolist())
+                    else:
+                        newXData.columns[k] = Utilities.interp(xTS.tolist(),y,newXTS.tolist(), fill_value=np.nan)
 
         if ConfigFile.settings["bL1bPlotTimeInterp"] == 1 and dataName != 'T':
             print('Plotting time interpolations ' +dataName)
@@ -431,22 +444,14 @@ class ProcessL1b_Interp:
 
         # Perform interpolation on full hyperspectral time series
         #   In the case of solar geometries, calculate to new times, don't interpolate
-        if dataName == 'SOLAR_AZ':
-            sunAzimuthAnc = []
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", category=UserWarning)
-                for i, dt_utc in enumerate(yDatetime):
-                    sunAzimuthAnc.append(get_azimuth(latData.columns['NONE'][i],lonData.columns['NONE'][i],dt_utc,0))
-            xData.columns['NONE'] = sunAzimuthAnc
-        elif dataName == 'SZA':
-            sunZenithAnc = []
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", category=UserWarning)
-                for i, dt_utc in enumerate(yDatetime):
-                    sunZenithAnc.append(90 - get_altitude(latData.columns['NONE'][i],lonData.columns['NONE'][i],dt_utc,0))
-            xData.columns['NONE'] = sunZenithAnc
+        if dataName in ('SOLAR_AZ', 'SZA'):
+            n = len(yDatetime)
+            sunAzimuthAnc, sunZenithAnc = SolarPosition.azimuthZenith(
+                latData.columns['NONE'][:n], lonData.columns['NONE'][:n], yDatetime)
+            if dataName == 'SOLAR_AZ':
+                xData.columns['NONE'] = sunAzimuthAnc.tolist()
+            else:
+                xData.columns['NONE'] = sunZenithAnc.tolist()
         else:
             ProcessL1b_Interp.interpolateL1b_Interp(xData, xDatetime, yDatetime, xData, dataName, 'linear', fileName)
 
@@ -466,42 +471,20 @@ class ProcessL1b_Interp:
             of all sensors, the minimum highest wavelength, and the interval
             set in the Configuration Window. '''
 
-        # Copy dataset to dictionary
-        ds.datasetToColumns()
-        columns = ds.columns
-        saveDatetag = columns.pop("Datetag")
-        saveTimetag2 = columns.pop("Timetag2")
-        columns.pop("Datetime")
-
         # Get wavelength values
-        wavelength = []
-        for k in columns:
-            wavelength.append(float(k))
-
-        x = np.asarray(wavelength)
+        names = ds.spectralNames()
+        x = np.asarray([float(k) for k in names])
 
         newColumns = collections.OrderedDict()
-        newColumns["Datetag"] = saveDatetag
-        newColumns["Timetag2"] = saveTimetag2
+        newColumns["Datetag"] = ds.data["Datetag"].tolist()
+        newColumns["Timetag2"] = ds.data["Timetag2"].tolist()
         # Can leave Datetime off at this point
 
-        for i in range(newWavebands.shape[0]):
+        # Resample all timestamps at once with the spline operator of this pair of grids
+        new_y = SplineResampler.resample(x, ds.matrix(names), newWavebands)
+        for waveIndex in range(newWavebands.shape[0]):
             # limit to one decimal place
-            newColumns[str(round(10*newWavebands[i])/10)] = []
-
-        # Perform interpolation for each timestamp
-        for timeIndex in range(len(saveDatetag)):
-            values = []
-
-            for k in columns:
-                values.append(columns[k][timeIndex])
-
-            y = np.asarray(values)
-            #new_y = sp.interpolate.interp1d(x, y)(newWavebands)
-            new_y = sp.interpolate.InterpolatedUnivariateSpline(x, y, k=3)(newWavebands)
-
-            for waveIndex in range(newWavebands.shape[0]):
-                newColumns[str(round(10*newWavebands[waveIndex])/10)].append(new_y[waveIndex])
+            newColumns[str(round(10*newWavebands[waveIndex])/10)] = new_y[:, waveIndex]
 
         newDS.columns = newColumns
         newDS.columnsToDataset()
@@ -522,17 +505,17 @@ class ProcessL1b_Interp:
 
         newReferenceGroup = root.addGroup("IRRADIANCE")
         newSASGroup = root.addGroup("RADIANCE")
-        root.groups.append(node.getGroup("GPS"))
+        root.appendGroup(node.getGroup("GPS"))
         if node.getGroup("ANCILLARY_METADATA"):
-            root.groups.append(node.getGroup("ANCILLARY_METADATA"))
+            root.appendGroup(node.getGroup("ANCILLARY_METADATA"))
         if node.getGroup("SOLARTRACKER"):
-            root.groups.append(node.getGroup("SOLARTRACKER"))
+            root.appendGroup(node.getGroup("SOLARTRACKER"))
         if node.getGroup("SOLARTRACKER_STATUS"):
-            root.groups.append(node.getGroup("SOLARTRACKER_STATUS"))
+            root.appendGroup(node.getGroup("SOLARTRACKER_STATUS"))
         if node.getGroup("PYROMETER"):
-            root.groups.append(node.getGroup("PYROMETER"))
+            root.appendGroup(node.getGroup("PYROMETER"))
         if node.getGroup("PY6S_MODEL"):
-            root.groups.append(node.getGroup("PY6S_MODEL"))
+            root.appendGroup(node.getGroup("PY6S_MODEL"))
 
         referenceGroup = node.getGroup("IRRADIANCE")
         sasGroup = node.getGroup("RADIANCE")
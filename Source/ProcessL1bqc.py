@@ -1,6 +1,7 @@
 
+import collections
+import warnings
 import numpy as np
-import scipy as sp
 import datetime as datetime
 
 from Source.MainConfig import MainConfig
@@ -14,39 +15,47 @@ class ProcessL1bqc:
     '''Process L1BQC'''
 
     @staticmethod
-    def interpolateColumn(columns, wl):
-        ''' Interpolate wavebands to estimate a single, unsampled waveband. This allows for QC filters
-            designed for nominal bands. '''
-        #print("interpolateColumn")
-        # Values to return
-        return_y = []
+    def interpolateColumns(ds, wavelengths):
+        ''' Interpolate wavebands to estimate single, unsampled wavebands. This allows for QC filters
+            designed for nominal bands. Returns one array (one value per record) per wavelength. '''
+        names = ds.spectralNames()
+        x = np.asarray([float(k) for k in names])
+        Y = ds.matrix(names)
+        # As interp1d, sort the wavebands and refuse to extrapolate
+        order = np.argsort(x, kind='mergesort')
+        x = x[order]
+        Y = Y[:, order]
+        new_x = np.asarray(wavelengths, dtype=np.float64)
+        if np.any(new_x < x[0]) or np.any(new_x > x[-1]):
+            raise ValueError("A value in x_new is outside of the interpolation range.")
+
+        new_y = Utilities.interpColumns(Utilities.interpIndex(x, new_x), Y.T)
+        return {wl: new_y[i] for i, wl in enumerate(wavelengths)}
 
-        # Column to interpolate to
-        new_x = [wl]
-
-        # Get wavelength values
-        wavelength = []
-        for k in columns:
-            #print(k)
-            wavelength.append(float(k))
-        x = np.asarray(wavelength)
-
-        # get the length of a column
-        num = len(list(columns.values())[0])
-
-        # Perform interpolation for each row
-        for i in range(num):
-            values = []
-            for k in columns:
-                #print("b")
-                values.append(columns[k][i])
-            y = np.asarray(values)
-
-            new_y = sp.interpolate.interp1d(x, y)(new_x)
-            return_y.append(new_y[0])
+    @staticmethod
+    def flagsToBadTimes(dateTimes, flags):
+        ''' Merges the boolean masks of each flag (one value per record), logs how many records each
+            one flagged, and returns the merged mask with the flagged timestamps as badTimes
+            (or None if there are none) '''
+        merged = np.zeros(len(dateTimes), dtype=bool)
+        for name, mask in flags.items():
+            msg = f'   {name}: {np.count_nonzero(mask)} of {len(dateTimes)} spectra flagged'
+            print(msg)
+            Utilities.writeLogFile(msg)
+            merged |= mask
 
-        return return_y
+        badTimes = np.unique(np.asarray(dateTimes, dtype=object)[merged])
+        # Duplicate each element to a list of two elements in a list
+        ''' BUG: This is not optimal as it creates one badTimes record for each bad
+            timestamp, rather than span of timestamps from badtimes[i][0] to badtimes[i][1]'''
+        badTimes = np.rot90(np.matlib.repmat(badTimes,2,1), 3)
+        msg = f'{len(np.unique(badTimes))/len(dateTimes)*100:.1f}% of spectra flagged'
+        print(msg)
+        Utilities.writeLogFile(msg)
 
+        if len(badTimes) == 0:
+            badTimes = None
+        return merged, badTimes
 
     @staticmethod
     def specQualityCheck(group, inFilePath, station=None):
@@ -92,136 +101,84 @@ class ProcessL1bqc:
         return badTimes
 
 
+    @staticmethod
+    def ltQualityFlags(ltData):
+        ''' Lt quality flags, as boolean masks over the records '''
+        # If the Lt spectrum in the NIR is brighter than in the UVA, something is very wrong
+        UVA = [350,400]
+        NIR = [780,850]
+        names = ltData.spectralNames()
+        waves = np.asarray([float(k) for k in names])
+        Lt = ltData.matrix(names)
+        with warnings.catch_warnings():
+            # Records without any valid band in one of the ranges are not flagged
+            warnings.simplefilter('ignore', RuntimeWarning)
+            ltUVA = np.nanmean(Lt[:, (waves > UVA[0]) & (waves < UVA[1])], axis=1)
+            ltNIR = np.nanmean(Lt[:, (waves > NIR[0]) & (waves < NIR[1])], axis=1)
+
+        flags = collections.OrderedDict()
+        flags['Lt(NIR) > Lt(UVA)'] = ltUVA < ltNIR
+        return flags
+
     @staticmethod
     def ltQuality(sasGroup):
         ''' Perform Lt Quality checking '''
 
         ltData = sasGroup.getDataset("LT")
-        ltData.datasetToColumns()
-        ltColumns = ltData.columns
-        # These get popped off the columns, but restored when filterData runs datasetToColumns
-        ltColumns.pop('Datetag')
-        ltColumns.pop('Timetag2')
-        ltDatetime = ltColumns.pop('Datetime')
-
-        badTimes = []
-        for indx, dateTime in enumerate(ltDatetime):
-            # If the Lt spectrum in the NIR is brighter than in the UVA, something is very wrong
-            UVA = [350,400]
-            NIR = [780,850]
-            ltUVA = []
-            ltNIR = []
-            for wave in ltColumns:
-                if float(wave) > UVA[0] and float(wave) < UVA[1]:
-                    ltUVA.append(ltColumns[wave][indx])
-                elif float(wave) > NIR[0] and float(wave) < NIR[1]:
-                    ltNIR.append(ltColumns[wave][indx])
-
-            if np.nanmean(ltUVA) < np.nanmean(ltNIR):
-                badTimes.append(dateTime)
-
-        badTimes = np.unique(badTimes)
-        # Duplicate each element to a list of two elements in a list
-        ''' BUG: This is not optimal as it creates one badTimes record for each bad
-            timestamp, rather than span of timestamps from badtimes[i][0] to badtimes[i][1]'''
-        badTimes = np.rot90(np.matlib.repmat(badTimes,2,1), 3)
-        msg = f'{len(np.unique(badTimes))/len(ltDatetime)*100:.1f}% of spectra flagged'
-        print(msg)
-        Utilities.writeLogFile(msg)
-
-        if len(badTimes) == 0:
-            badTimes = None
+        flags = ProcessL1bqc.ltQualityFlags(ltData)
+        _, badTimes = ProcessL1bqc.flagsToBadTimes(ltData.data["Datetime"], flags)
+        if badTimes is None:
             # In case filterData does not need to be run:
             ltData.datasetToColumns()
         return badTimes
 
     @staticmethod
-    def metQualityCheck(refGroup, sasGroup):
-        ''' Perform meteorological quality control '''
+    def metQualityFlags(esData, liData):
+        ''' Meteorological quality flags, as boolean masks over the records '''
 
         esFlag = float(ConfigFile.settings["fL1bqcSignificantEsFlag"])
         dawnDuskFlag = float(ConfigFile.settings["fL1bqcDawnDuskFlag"])
         humidityFlag = float(ConfigFile.settings["fL1bqcRainfallHumidityFlag"])
         cloudFLAG = float(ConfigFile.settings["fL1bqcCloudFlag"]) # Not to be confused with cloudFlag...
 
-        esData = refGroup.getDataset("ES")
-        esData.datasetToColumns()
-        esColumns = esData.columns
-
-        esColumns.pop('Datetag')
-        esColumns.pop('Timetag2')
-        esTime = esColumns.pop('Datetime')
-
-        liData = sasGroup.getDataset("LI")
-        liData.datasetToColumns()
-        liColumns = liData.columns
-        liColumns.pop('Datetag')
-        liColumns.pop('Timetag2')
-        liColumns.pop('Datetime')
+        li = ProcessL1bqc.interpolateColumns(liData, [750.0])
+        es = ProcessL1bqc.interpolateColumns(esData, [370.0, 470.0, 480.0, 680.0, 720.0, 750.0])
 
-        ltData = sasGroup.getDataset("LT")
-        ltData.datasetToColumns()
-        ltColumns = ltData.columns
-        ltColumns.pop('Datetag')
-        ltColumns.pop('Timetag2')
-        ltColumns.pop('Datetime')
-
-        li750 = ProcessL1bqc.interpolateColumn(liColumns, 750.0)
-        es370 = ProcessL1bqc.interpolateColumn(esColumns, 370.0)
-        es470 = ProcessL1bqc.interpolateColumn(esColumns, 470.0)
-        es480 = ProcessL1bqc.interpolateColumn(esColumns, 480.0)
-        es680 = ProcessL1bqc.interpolateColumn(esColumns, 680.0)
-        es720 = ProcessL1bqc.interpolateColumn(esColumns, 720.0)
-        es750 = ProcessL1bqc.interpolateColumn(esColumns, 750.0)
-        badTimes = []
-        for indx, dateTime in enumerate(esTime):
+        flags = collections.OrderedDict()
+        with np.errstate(divide='ignore', invalid='ignore'):
             # Masking spectra affected by clouds (Ruddick 2006, IOCCG Protocols).
             # The alternative to masking is to process them differently (e.g. See Ruddick_Rho)
             # Therefore, set this very high if you don't want it triggered (e.g. 1.0, see Readme)
-            if li750[indx]/es750[indx] >= cloudFLAG:
-                # msg = f"Quality Check: Li(750)/Es(750) >= cloudFLAG:{cloudFLAG}"
-                # print(msg)
-                # Utilities.writeLogFile(msg)
-                badTimes.append(dateTime)
+            flags[f'Li(750)/Es(750) >= cloudFLAG:{cloudFLAG}'] = li[750.0]/es[750.0] >= cloudFLAG
 
             # Threshold for significant es
             # Wernand 2002
-            if es480[indx] < esFlag:
-                # msg = f"Quality Check: es(480) < esFlag:{esFlag}"
-                # print(msg)
-                # Utilities.writeLogFile(msg)
-                badTimes.append(dateTime)
+            flags[f'Es(480) < esFlag:{esFlag}'] = es[480.0] < esFlag
 
             # Masking spectra affected by dawn/dusk radiation
             # Wernand 2002
             #v = esXSlice["470.0"][0] / esXSlice["610.0"][0] # Fix 610 -> 680
-            if es470[indx]/es680[indx] < dawnDuskFlag:
-                # msg = f'Quality Check: ES(470.0)/ES(680.0) < dawnDuskFlag:{dawnDuskFlag}'
-                # print(msg)
-                # Utilities.writeLogFile(msg)
-                badTimes.append(dateTime)
+            flags[f'Es(470)/Es(680) < dawnDuskFlag:{dawnDuskFlag}'] = es[470.0]/es[680.0] < dawnDuskFlag
 
             # Masking spectra affected by rainfall and high humidity
             # Wernand 2002 (940/370), Garaba et al. 2012 also uses Es(940/370), presumably 720 was developed by Wang...???
             ''' Follow up on the source of this flag'''
-            if es720[indx]/es370[indx] < humidityFlag:
-                # msg = f'Quality Check: ES(720.0)/ES(370.0) < humidityFlag:{humidityFlag}'
-                # print(msg)
-                # Utilities.writeLogFile(msg)
-                badTimes.append(dateTime)
-
-        badTimes = np.unique(badTimes)
-        badTimes = np.rot90(np.matlib.repmat(badTimes,2,1), 3) # Duplicates each element to a list of two elements in a list
-        msg = f'{len(np.unique(badTimes))/len(esTime)*100:.1f}% of spectra flagged'
-        print(msg)
-        Utilities.writeLogFile(msg)
+            flags[f'Es(720)/Es(370) < humidityFlag:{humidityFlag}'] = es[720.0]/es[370.0] < humidityFlag
+        return flags
 
-        if len(badTimes) == 0:
-            # Restore timestamps to columns (since it's not going to filterData, where it otherwise happens)
+    @staticmethod
+    def metQualityCheck(refGroup, sasGroup):
+        ''' Perform meteorological quality control '''
+
+        esData = refGroup.getDataset("ES")
+        liData = sasGroup.getDataset("LI")
+        flags = ProcessL1bqc.metQualityFlags(esData, liData)
+        _, badTimes = ProcessL1bqc.flagsToBadTimes(esData.data["Datetime"], flags)
+        if badTimes is None:
+            # Refresh the columns (since it's not going to filterData, where it otherwise happens)
             esData.datasetToColumns()
             liData.datasetToColumns()
-            ltData.datasetToColumns()
-            badTimes = None
+            sasGroup.getDataset("LT").datasetToColumns()
         return badTimes
 
     @staticmethod
@@ -1,4 +1,8 @@
+import os
+import sys
 import collections
+import concurrent.futures
+import multiprocessing
 import warnings
 import time
 
@@ -23,6 +27,13 @@ from Source.ProcessInstrumentUncertainties import Trios, HyperOCR
 class ProcessL2:
     ''' Process L2 '''
 
+    # Output groups of ensemblesReflectance
+    ENSEMBLE_GROUPS = ('ANCILLARY', 'REFLECTANCE', 'IRRADIANCE', 'RADIANCE')
+    # (node, input groups) of the ensembles run by worker processes (see parallelEnsembles)
+    ensembleInputs = None
+    # Set by ensemblesReflectance when its result depends on the earlier ensembles in node
+    readsEarlierEnsembles = False
+
     @staticmethod
     def nirCorrectionSatellite(root, sensor, rrsNIRCorr, nLwNIRCorr):
         newReflectanceGroup = root.getGroup("REFLECTANCE")
@@ -609,37 +620,8 @@ class ProcessL2:
         Utilities.writeLogFile(msg)
 
         # Delete the records in badTime ranges from each dataset in the group
-        finalCount = 0
         originalLength = len(timeStamp)
-        for dateTime in badTimes:
-            # Need to reinitialize for each loop
-            startLength = len(timeStamp)
-            newTimeStamp = []
-
-            # msg = f'Eliminate data between: {dateTime}'
-            # print(msg)
-            # Utilities.writeLogFile(msg)
-
-            start = dateTime[0]
-            stop = dateTime[1]
-
-            if startLength > 0:
-                rowsToDelete = []
-                for i in range(startLength):
-                    if start <= timeStamp[i] and stop >= timeStamp[i]:
-                        try:
-                            rowsToDelete.append(i)
-                            finalCount += 1
-                        except:
-                            print('error')
-                    else:
-                        newTimeStamp.append(timeStamp[i])
-                group.datasetDeleteRow(rowsToDelete)
-            else:
-                msg = 'Data group is empty. Continuing.'
-                print(msg)
-                Utilities.writeLogFile(msg)
-            timeStamp = newTimeStamp.copy()
+        finalCount = Utilities.deleteTimeRanges(group, timeStamp, badTimes)
 
         if badTimes == []:
             startLength = 1 # avoids div by zero below when finalCount is 0
@@ -942,6 +924,19 @@ class ProcessL2:
         return newSlice
 
 
+    @staticmethod
+    def datasetToSlice(ds, start, end):
+        ''' Take a slice of a dataset as columns, converting only the records in the slice '''
+        if start == end:
+            records = ds.data[start:end+1] # otherwise you get nada []
+        else:
+            records = ds.data[start:end] # up to not including end...next slice will pick it up
+        newSlice = collections.OrderedDict()
+        for col in ds.data.dtype.names:
+            newSlice[col] = records[col].tolist()
+        return newSlice
+
+
     @staticmethod
     # def interpAncillary(node, ancData, modRoot, radData):
     def includeModelDefaults(ancGroup, modRoot):
@@ -1142,8 +1137,7 @@ class ProcessL2:
             else:
                 newDS = newAncGroup.addDataset(ds)
             DS = ancGroup.getDataset(ds)
-            DS.datasetToColumns()
-            dsSlice = ProcessL2.columnToSlice(DS.columns,start, end)
+            dsSlice = ProcessL2.datasetToSlice(DS,start, end)
             dsXSlice = None
 
             for subset in dsSlice: # ancillary datasets contain columns (including date, time, and flags)
@@ -1201,17 +1195,10 @@ class ProcessL2:
         liData = sasGroup.getDataset("LI")
         ltData = sasGroup.getDataset("LT")
 
-        # Copy datasets to dictionary
-        esData.datasetToColumns()
-        esColumns = esData.columns
-        liData.datasetToColumns()
-        liColumns = liData.columns
-        ltData.datasetToColumns()
-        ltColumns = ltData.columns
-
-        esSlice = ProcessL2.columnToSlice(esColumns,start, end)
-        liSlice = ProcessL2.columnToSlice(liColumns,start, end)
-        ltSlice = ProcessL2.columnToSlice(ltColumns,start, end)
+        # Copy the records of the slice to dictionaries
+        esSlice = ProcessL2.datasetToSlice(esData,start, end)
+        liSlice = ProcessL2.datasetToSlice(liData,start, end)
+        ltSlice = ProcessL2.datasetToSlice(ltData,start, end)
         n = len(list(ltSlice.values())[0])
 
         # process raw groups for generating standard deviations
@@ -1573,7 +1560,7 @@ class ProcessL2:
 
         ########################################################################
         # Calculate Rho_sky
-        wavebands = [*esColumns] # just grabs the keys
+        wavebands = esData.data.dtype.names
         wavelength = []
         wavelengthStr = []
         for k in wavebands:
@@ -1618,6 +1605,8 @@ class ProcessL2:
                 print(msg)
                 Utilities.writeLogFile(msg)
                 # Need to eliminate this slice from newAncGroup
+                # Whether any ancillary data remain depends on the ensembles before this one
+                ProcessL2.readsEarlierEnsembles = True
                 badTimes = []
                 start = dateTime
                 stop = dateTime
@@ -1997,6 +1986,184 @@ class ProcessL2:
         return True
 
 
+    @staticmethod
+    def ensembleBins(timeStamp, interval):
+        ''' Start and end indexes of the ensembles of interval seconds, as (i, start, end, final) with
+            i the record which closed the ensemble, and the (start, end) of the trailing ensemble
+            (or None).
+
+            An ensemble closes at the first record past the end time, which then restarts from that
+            record. The ensemble whose next end time would pass the end of the file is the final one
+            (as is the whole file when it is shorter than one interval, which leaves out its last
+            record), and no trailing ensemble follows it. The trailing ensemble only happens when
+            the last record falls exactly on an end time. '''
+        times = Utilities.toDatetime64(timeStamp)
+        nRecords = len(times)
+        delta = np.timedelta64(datetime.timedelta(0,interval))
+        endFileTime = times[-1]
+        ordered = bool(np.all(times[1:] >= times[:-1])) and delta >= np.timedelta64(0)
+
+        bins = []
+        start = 0
+        endTime = times[0] + delta
+        if endTime > endFileTime:
+            # File shorter than interval; include all spectra
+            return [(0, 0, nRecords-1, True)], None
+
+        while True:
+            # The first record past endTime, searching on from the one after the last bin closed
+            if ordered:
+                i = int(np.searchsorted(times, endTime, side='right'))
+            else:
+                first = start+1 if bins else 0
+                after = np.flatnonzero(times[first:] > endTime)
+                i = first+int(after[0]) if len(after) > 0 else nRecords
+            if i >= nRecords:
+                return bins, (start, nRecords)
+            endTime = times[i] + delta
+            final = bool(endTime > endFileTime)
+            bins.append((i, start, i, final))
+            if final:
+                return bins, None
+            start = i
+
+    @staticmethod
+    def ensembleWorkers(nEnsembles):
+        ''' Number of worker processes for nEnsembles ensembles: fL2EnsembleWorkers (negative for
+            one per CPU), at most one per ensemble, and 0 where the ensembles are to be processed serially '''
+        workers = int(ConfigFile.settings.get("fL2EnsembleWorkers", 0))
+        if workers < 0:
+            workers = os.cpu_count() or 1
+        workers = min(workers, nEnsembles)
+        if workers < 2:
+            return 0
+
+        msg = None
+        if not sys.platform.startswith('linux'):
+            # Workers get the input groups by forking rather than by copying them, which is only safe on
+            # Linux (on macOS, Qt and Accelerate do not survive a fork)
+            msg = 'Parallel ensembles are only available on Linux. Processing ensembles serially.'
+        elif ConfigFile.settings["bL1bCal"] == 3:
+            # Py6S irradiance ratios of the FRM regime use the ancillary data of all earlier ensembles
+            msg = 'Parallel ensembles are not available for FRM Full Characterization. Processing ensembles serially.'
+        if msg is not None:
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return 0
+        return workers
+
+    @staticmethod
+    def ensembleNode(node):
+        ''' A new output node for a single ensemble: the attributes and the other (L1AQC) groups of node,
+            and empty output groups '''
+        newNode = HDFRoot()
+        newNode.copyAttributes(node)
+        for gp in node.groups:
+            if gp.id in ProcessL2.ENSEMBLE_GROUPS:
+                newNode.addGroup(gp.id).copyAttributes(gp)
+            else:
+                newNode.appendGroup(gp)
+        return newNode
+
+    @staticmethod
+    def ensembleTask(start, end):
+        ''' Runs in a worker process. Processes one ensemble on its own output node and returns its
+            success flag, output groups and log lines, or None if the ensemble has to be processed on top
+            of the earlier ones instead '''
+        node, groups = ProcessL2.ensembleInputs
+        newNode = ProcessL2.ensembleNode(node)
+        ProcessL2.readsEarlierEnsembles = False
+        # The log lines are written by the main process, in ensemble order (see mergeEnsemble)
+        Utilities.logCapture = []
+        try:
+            flag = ProcessL2.ensemblesReflectance(newNode, *groups, start, end)
+        finally:
+            logLines = Utilities.logCapture
+            Utilities.logCapture = None
+        if ProcessL2.readsEarlierEnsembles:
+            return None
+
+        output = collections.OrderedDict()
+        for gpName in ProcessL2.ENSEMBLE_GROUPS:
+            gp = newNode.getGroup(gpName)
+            datasets = collections.OrderedDict()
+            for dsName, ds in gp.datasets.items():
+                datasets[dsName] = (ds.attributes, ds.columns)
+            output[gpName] = (gp.attributes, datasets)
+        return flag, output, logLines
+
+    @staticmethod
+    def mergeEnsemble(node, output, logLines):
+        ''' Writes the log lines of an ensemble (see ensembleTask) and appends its output groups to node
+            as ensemblesReflectance appends them: ancillary columns with np.append (see sliceAveAnc) and
+            the others as lists '''
+        for line in logLines:
+            Utilities.writeLogFile(line)
+
+        for gpName, (attributes, datasets) in output.items():
+            gp = node.getGroup(gpName)
+            gp.attributes.update(attributes)
+            for dsName, (dsAttributes, columns) in datasets.items():
+                ds = gp.getDataset(dsName)
+                if ds is None:
+                    ds = gp.addDataset(dsName)
+                    ds.columns = columns
+                else:
+                    for k, values in columns.items():
+                        if gpName == 'ANCILLARY':
+                            ds.columns[k] = np.append(ds.columns.get(k, []), values)
+                        elif k in ds.columns:
+                            ds.columns[k].extend(values)
+                        else:
+                            ds.columns[k] = list(values)
+                lengths = {k: len(v) for k, v in ds.columns.items()}
+                if len(set(lengths.values())) > 1:
+                    msg = f'ProcessL2.mergeEnsemble: columns of {gpName}/{dsName} differ in length: {lengths}'
+                    print(msg)
+                    Utilities.writeLogFile(msg)
+                    raise ValueError(msg)
+                ds.attributes.update(dsAttributes)
+                ds.columnsToDataset()
+
+    @staticmethod
+    def parallelEnsembles(node, groups, slices):
+        ''' Processes the ensembles of slices [(start, end), ...] in worker processes, if so configured
+            (see ensembleWorkers), and merges their outputs into node in time order, so node ends up as
+            if they had been processed one after the other. Returns a deque of their success flags, which
+            is empty if the ensembles are to be processed serially. '''
+        results = collections.deque()
+        workers = ProcessL2.ensembleWorkers(len(slices))
+        if workers == 0:
+            return results
+
+        msg = f'Processing {len(slices)} ensembles in {workers} worker processes.'
+        print(msg)
+        Utilities.writeLogFile(msg)
+
+        # No plotting thread should be holding locks when the workers are forked
+        Utilities.waitForPlots()
+        # Forked workers share the input groups; they are never copied or pickled
+        ProcessL2.ensembleInputs = (node, groups)
+        # Each worker reseeds its Monte Carlo draws rather than repeating those of this process
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                          mp_context=multiprocessing.get_context('fork'),
+                                                          initializer=np.random.seed)
+        try:
+            futures = [executor.submit(ProcessL2.ensembleTask, start, end) for start, end in slices]
+            for (start, end), future in zip(slices, futures):
+                result = future.result()
+                if result is None:
+                    # The earlier ensembles are all in node by now
+                    results.append(ProcessL2.ensemblesReflectance(node, *groups, start, end))
+                else:
+                    flag, output, logLines = result
+                    ProcessL2.mergeEnsemble(node, output, logLines)
+                    results.append(flag)
+        finally:
+            executor.shutdown(cancel_futures=True)
+            ProcessL2.ensembleInputs = None
+        return results
+
     @staticmethod
     def stationsEnsemblesReflectance(node, root, station=None):
         ''' Extract stations if requested, then pass to ensemblesReflectance for ensemble
@@ -2133,68 +2300,58 @@ class ProcessL2:
                 msg = "failed to interpolate dark data to light data timer"
                 print(msg)
 
+        groups = (sasGroup, referenceGroup, ancGroup, uncGroup, esRawGroup, liRawGroup, ltRawGroup)
         if interval == 0:
             # Here, take the complete time series
             print("No time binning. This can take a moment.")
+            slices = [(i, i+1) for i in range(0, esLength-1)]
+        else:
+            msg = 'Binning datasets to ensemble time interval.'
+            print(msg)
+            Utilities.writeLogFile(msg)
+
+            # All the ensembles at once (see ensembleBins)
+            bins, ender = ProcessL2.ensembleBins(timeStamp, interval)
+            slices = [(start, end) for i, start, end, final in bins]
+            if ender is not None:
+                slices.append(ender)
+
+        # Ensembles processed in parallel are already in node; their results are taken in the same order
+        results = ProcessL2.parallelEnsembles(node, groups, slices)
+        def ensemble(start, end):
+            if results:
+                return results.popleft()
+            return ProcessL2.ensemblesReflectance(node, *groups, start, end)
+
+        if interval == 0:
             progressBar = tqdm(total=esLength, unit_scale=True, unit_divisor=1)
-            for i in range(0, esLength-1):
+            for start, end in slices:
                 progressBar.update(1)
-                start = i
-                end = i+1
 
-                if not ProcessL2.ensemblesReflectance(node, sasGroup, referenceGroup, ancGroup, uncGroup, esRawGroup,
-                                                      liRawGroup, ltRawGroup, start, end):
+                if not ensemble(start, end):
                     msg = 'ProcessL2.ensemblesReflectance unsliced failed. Abort.'
                     print(msg)
                     Utilities.writeLogFile(msg)
                     continue
         else:
-            msg = 'Binning datasets to ensemble time interval.'
-            print(msg)
-            Utilities.writeLogFile(msg)
+            for i, start, end, final in bins:
+                if not ensemble(start, end):
+                    msg = 'ProcessL2.ensemblesReflectance with slices failed. Continue.'
+                    print(msg)
+                    Utilities.writeLogFile(msg)
 
-            # Iterate over the time ensembles
-            start = 0
-            endTime = timeStamp[0] + datetime.timedelta(0,interval)
-            endFileTime = timeStamp[-1]
-            timeFlag = False
-            # endTime is theoretical based on interval
-            if endTime > endFileTime:
-                endTime = endFileTime
-                timeFlag = True # In case the whole file is shorter than the selected interval
-
-            for i in range(0, esLength):
-                # time = Utilities.timeTag2ToSec(tt2[i])
-                time = timeStamp[i]
-                if (time > endTime) or timeFlag: # end of increment reached
-                    if timeFlag:
-                        end = len(timeStamp)-1 # File shorter than interval; include all spectra
-                    else:
-                        endTime = time + datetime.timedelta(0,interval) # increment for the next bin loop
-                        end = i # end of the slice is up to and not including...so -1 is not needed
-                    if endTime > endFileTime:
-                        endTime = endFileTime
-                        timeFlag = True
-
-                    if not ProcessL2.ensemblesReflectance(node, sasGroup, referenceGroup, ancGroup, uncGroup, esRawGroup,
-                                                          liRawGroup, ltRawGroup, start, end):
-                        msg = 'ProcessL2.ensemblesReflectance with slices failed. Continue.'
-                        print(msg)
-                        Utilities.writeLogFile(msg)
-
-                        start = i
-                        continue
-                    start = i
-
-                    if timeFlag:
-                        # No need to continue incrementing; all records captured in one ensemble
-                        break
+                    if final:
+                        # A failed last ensemble is retried from each following record until one succeeds
+                        for j in range(i+1, esLength):
+                            if ensemble(j-1, esLength-1):
+                                break
+                            print(msg)
+                            Utilities.writeLogFile(msg)
 
             # For the rare case where end of record is reached at, but not exceeding, endTime...
-            if not timeFlag:
-                end = i+1 # i is the index of end of record; plus one to include i due to -1 list slicing
-                if not ProcessL2.ensemblesReflectance(node, sasGroup, referenceGroup, ancGroup, uncGroup, esRawGroup,
-                                                      liRawGroup, ltRawGroup, start, end):
+            if ender is not None:
+                start, end = ender
+                if not ensemble(start, end):
                     msg = 'ProcessL2.ensemblesReflectance ender clause failed.'
                     print(msg)
                     Utilities.writeLogFile(msg)
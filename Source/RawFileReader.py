@@ -1,4 +1,9 @@
 
+import bisect
+import collections
+import mmap
+import os
+import re
 import sys
 
 from Source.Utilities import Utilities
@@ -8,6 +13,8 @@ class RawFileReader:
     MAX_BLOCK_READ = 1024
     SATHDR_READ = 128
     RESET_TAG_READ = MAX_TAG_READ-16
+    # Set False to fall back on the byte-by-byte readRawFileSequential scanner
+    INDEXED_SCAN = True
 
     # Function for reading SATHDR (Header) messages
     # Messages are in format: SATHDR <Value> (<Name>)\r\n
@@ -39,6 +46,211 @@ class RawFileReader:
     # Reads a raw file
     @staticmethod
     def readRawFile(filepath, calibrationMap, contextMap, root):
+        if RawFileReader.INDEXED_SCAN:
+            RawFileReader.readRawFileIndexed(filepath, calibrationMap, contextMap, root)
+        else:
+            RawFileReader.readRawFileSequential(filepath, calibrationMap, contextMap, root)
+
+    # Reads a raw file by memory-mapping it, indexing every frame with indexRawFile
+    # and then decoding the index. Produces the same output as readRawFileSequential.
+    @staticmethod
+    def readRawFileIndexed(filepath, calibrationMap, contextMap, root):
+        if os.path.getsize(filepath) == 0:
+            return
+
+        with open(filepath, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                index = RawFileReader.indexRawFile(mm, calibrationMap)
+                RawFileReader.decodeFrames(mm, index, calibrationMap, contextMap, root)
+
+    # Compiles all frame tags into one case-insensitive matcher. Tags are
+    # merged into a trie so that the regex engine tests shared prefixes
+    # (e.g. "SATH") once; the lookahead reports every offset at which any tag
+    # starts, including overlapping ones. Also returns the tags in the
+    # priority readRawFileSequential tests them: SATHDR, then calibrationMap order.
+    @staticmethod
+    def compileFrameMatcher(calibrationMap):
+        tags = [(b"SATHDR", None)]
+        for key in calibrationMap:
+            tags.append((calibrationMap[key].id.upper().encode("utf-8"), key))
+
+        trie = {}
+        for (tag, _) in tags:
+            node = trie
+            for c in tag:
+                node = node.setdefault(c, {})
+            node[None] = True
+
+        pattern = b"(?=" + RawFileReader.trieToPattern(trie) + b")"
+        return (re.compile(pattern), tags)
+
+    # Converts a tag trie into a regex, matching letters in either case as bytes.upper() does
+    @staticmethod
+    def trieToPattern(node):
+        if None in node:
+            # A whole tag ends here; longer tags sharing it as prefix add no new start offsets
+            return b""
+        alternatives = []
+        for c, child in node.items():
+            ch = bytes([c])
+            if ch.isalpha():
+                alternatives.append(b"[" + ch.upper() + ch.lower() + b"]" + RawFileReader.trieToPattern(child))
+            else:
+                alternatives.append(re.escape(ch) + RawFileReader.trieToPattern(child))
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return b"(?:" + b"|".join(alternatives) + b")"
+
+    # Builds the frame index of a raw file buffer in a single pass.
+    # Returns a list of (offset, length, key) in file order, where key is the
+    # calibrationMap key of the frame (None for SATHDR headers) and length is
+    # the value frameLength returned (-1 when verification failed, None when
+    # the frame could not be converted).
+    # Only the candidate offsets found by the matcher are visited, but the
+    # 32 byte tag window of readRawFileSequential (including its resync after
+    # failed frames) is reproduced so that exactly the same frames are found.
+    @staticmethod
+    def indexRawFile(buf, calibrationMap):
+        (matcher, tags) = RawFileReader.compileFrameMatcher(calibrationMap)
+        candidates = [m.start() for m in matcher.finditer(buf)]
+        nCandidates = len(candidates)
+        size = len(buf)
+        lastTest = RawFileReader.MAX_TAG_READ-2 # b[MAX_TAG_READ-1:] is never tested
+
+        index = []
+        pos = 0 # file position
+        c = 0
+        while pos < size:
+            start = pos
+            c = bisect.bisect_left(candidates, start, c)
+            if c == nCandidates:
+                break
+
+            # Skip windows without tags as the sequential reader would
+            if candidates[c] > start + lastTest:
+                n = -(-(candidates[c] - start - lastTest) // RawFileReader.RESET_TAG_READ)
+                pos = start + n*RawFileReader.RESET_TAG_READ
+                continue
+
+            windowEnd = min(start + RawFileReader.MAX_TAG_READ, size)
+            num = 0
+            j = c
+            while j < nCandidates and candidates[j] <= start + lastTest:
+                i = candidates[j] - start
+                j += 1
+                testString = buf[start+i:windowEnd].upper()
+
+                if testString.startswith(b"SATHDR"):
+                    pos = min(pos + i, size)
+                    length = min(RawFileReader.SATHDR_READ, size - pos)
+                    index.append((pos, length, None))
+                    pos += length
+                    num = length
+                    break
+
+                num = 0
+                for (tag, key) in tags[1:]:
+                    if testString.startswith(tag):
+                        pos = min(pos + i, size)
+                        msg = buf[pos:pos+RawFileReader.MAX_BLOCK_READ]
+                        try:
+                            length = calibrationMap[key].frameLength(msg)
+                            num = length
+                        except:
+                            length = None
+                        index.append((pos, length, key))
+                        if num >= 0:
+                            pos = min(pos + num, size)
+                        break
+                if num > 0:
+                    break
+
+            # Reset file position on max read
+            if num <= 0:
+                pos = min(pos + RawFileReader.RESET_TAG_READ, size)
+
+        return index
+
+    # Decodes the frames of a raw file buffer listed in index (see indexRawFile)
+    # into the groups of contextMap and the attributes of root.
+    # Frames of fixed layout calibration files are gathered by group, in runs of
+    # consecutive frames of one calibration file, and decoded together with
+    # CalibrationFile.convertRawFrames; the others are decoded one at a time
+    # with convertRaw, as readRawFileSequential does.
+    @staticmethod
+    def decodeFrames(buf, index, calibrationMap, contextMap, root):
+        posframe = 2 # Prosoft adds posframe=1 to the GPS (see readRawFileSequential)
+        # Deferred frames by frame tag (group), as [(key, frames, posframes), ...]
+        # runs in frame order, since several calibration files can share a group
+        bulk = collections.OrderedDict()
+
+        for (offset, length, key) in index:
+            if key is None:
+                hdr = buf[offset:offset+RawFileReader.SATHDR_READ]
+                (k,v) = RawFileReader.readSATHDR(hdr)
+                root.attributes[k] = v
+                continue
+
+            cf = calibrationMap[key]
+            gp = contextMap[cf.id]
+            # Only the first time through
+            if len(gp.attributes) == 0:
+                gp.id = key
+                gp.attributes["CalFileName"] = key
+                gp.attributes["FrameTag"] = cf.id
+
+            # Complete frames that passed frameLength can be deferred; frames at
+            # the end of a truncated file are read from a short message instead
+            if cf.frameDtype is not None and length is not None and \
+                cf.fixedFrameLength <= RawFileReader.MAX_BLOCK_READ and \
+                offset + cf.fixedFrameLength <= len(buf):
+                runs = bulk.setdefault(cf.id, [])
+                if len(runs) == 0 or runs[-1][0] != key:
+                    runs.append((key, [], []))
+                runs[-1][1].append(buf[offset:offset+cf.fixedFrameLength])
+                runs[-1][2].append(posframe)
+                posframe += 1
+                continue
+
+            # Keep the order of the frames already deferred for this group
+            if cf.id in bulk:
+                RawFileReader.decodeBulkFrames(calibrationMap, gp, bulk.pop(cf.id))
+
+            msg = buf[offset:offset+RawFileReader.MAX_BLOCK_READ]
+            num = 0
+            try:
+                # Frames that frameLength measured have already passed verifyRaw
+                num = cf.convertRaw(msg, gp, verified=(length is not None and length >= 0))
+            except:
+                pmsg = f'Unable to convert the following raw message: {msg}'
+                print(pmsg)
+                Utilities.writeLogFile(pmsg)
+
+            if num >= 0:
+                # Generate POSFRAME
+                ds = gp.getDataset("POSFRAME")
+                if ds is None:
+                    ds = gp.addDataset("POSFRAME")
+                ds.appendColumn(u"COUNT", posframe)
+                posframe += 1
+
+        for frameTag, runs in bulk.items():
+            RawFileReader.decodeBulkFrames(calibrationMap, contextMap[frameTag], runs)
+
+    # Decodes the deferred runs of frames of one group, in order, and adds
+    # their POSFRAME
+    @staticmethod
+    def decodeBulkFrames(calibrationMap, gp, runs):
+        for (key, frames, posframes) in runs:
+            calibrationMap[key].convertRawFrames(b"".join(frames), gp)
+            ds = gp.getDataset("POSFRAME")
+            if ds is None:
+                ds = gp.addDataset("POSFRAME")
+            ds.extendColumn(u"COUNT", posframes)
+
+    # Reads a raw file one 32 byte tag window at a time
+    @staticmethod
+    def readRawFileSequential(filepath, calibrationMap, contextMap, root):
 
         posframe = 1
 
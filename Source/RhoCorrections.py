@@ -36,7 +36,7 @@ class RhoCorrections:
         # load in the LUT HDF file
         inFilePath = os.path.join(PATH_TO_DATA, 'rhoTable_AO1999.hdf')
         try:
-            lut = HDFRoot.readHDF5(inFilePath)
+            lut = HDFRoot.readHDF5(inFilePath, lazy=True)
         except:
             msg = "Unable to open M99 LUT."
             Utilities.errorWindow("File Error", msg)
@@ -44,6 +44,7 @@ class RhoCorrections:
             Utilities.writeLogFile(msg)
 
         lutData = lut.groups[0].datasets['LUT'].data
+        lut.close()
         # convert to a 2D array
         lut = np.array(lutData.tolist())
         # match to the row
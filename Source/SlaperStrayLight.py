@@ -0,0 +1,80 @@
+import numpy as np
+
+from Source.Utilities import Utilities
+
+
+class SlaperStrayLight:
+    ''' Slaper et al. (1996) iterative stray light correction (FRM4SOC2), for a single spectrum
+        or a whole (n_spectra x nband) batch at once.
+
+        The stray light distribution matrix of an instrument is normalized once (eqs 4 and 5) and
+        kept in a small cache keyed by its content, so that the per-spectrum calls of the FRM
+        branch stop renormalizing it. Each iteration (eqs 6 and 7) is one matrix product over
+        all spectra. '''
+
+    # Normalized matrices of recently used instruments, keyed by content digest
+    normalizedCache = {}
+    CACHE_SIZE = 8
+
+    @staticmethod
+    def normalize(SL_matrix):
+        ''' Normalizes each row of an (nband x nband) matrix, or of a stack of them, by its sum over
+            the columns i-10 to i+9 (eq 4). Rows summing to zero are zeroed (eq 5). '''
+        mZ = np.asarray(SL_matrix, dtype=np.float64)
+        nband = mZ.shape[-1]
+        i = np.arange(nband)[:, None]
+        j = np.arange(nband)[None, :]
+        window = (j >= i - 10) & (j < i + 10)
+        m_norm = np.sum(np.where(window, mZ, 0.0), axis=-1)  # eq 4
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mZ = np.where(m_norm[..., None] == 0, 0.0, mZ/m_norm[..., None])  # eq 5
+        return mZ
+
+    @staticmethod
+    def normalizedMatrix(SL_matrix):
+        ''' The normalized matrix of an instrument, from the cache when the same matrix was seen before '''
+        SL_matrix = np.ascontiguousarray(SL_matrix, dtype=np.float64)
+
+        def build():
+            mZ = SlaperStrayLight.normalize(SL_matrix)
+            mZ.setflags(write=False)
+            return mZ
+        return Utilities.cached(SlaperStrayLight.normalizedCache, SlaperStrayLight.CACHE_SIZE,
+                                Utilities.arrayDigest(SL_matrix), build)
+
+    @staticmethod
+    def iterate(mX0, mZ, n_iter):
+        ''' Iterations of eqs 6 and 7 from the measured spectra mX0 (nband, or n_spectra x nband)
+            with a normalized matrix mZ, or with one matrix per spectrum (n_spectra x nband x nband).
+            As in the original formulation, the result is that of iteration n_iter-1. '''
+        mX = mX0
+        for k in range(1, n_iter):
+            if mZ.ndim == 2:
+                mC = mX @ mZ.T  # eq 6
+            else:
+                mC = np.matmul(mZ, mX[..., None])[..., 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mX = np.where(mC == 0, 0.0, (mX*mX0)/mC)  # eq 7
+        return mX
+
+    @staticmethod
+    def correct(input_data, SL_matrix, n_iter=5):
+        ''' Stray light corrected spectrum (nband) or spectra (n_spectra x nband) '''
+        mX0 = np.asarray(input_data, dtype=np.float64)
+        return SlaperStrayLight.iterate(mX0, SlaperStrayLight.normalizedMatrix(SL_matrix), n_iter)
+
+    @staticmethod
+    def correctSamples(sample_data, sample_SL_matrix, sample_n_iter):
+        ''' Monte Carlo draws of the correction, each with its own spectrum, matrix and number of
+            iterations: the equivalent of punpy's run_samples(Slaper_SL_correction, ...), which
+            also drops draws without any finite value '''
+        sample_data = np.asarray(sample_data, dtype=np.float64)
+        sample_n_iter = np.asarray(sample_n_iter).reshape(len(sample_data))
+        mZ = SlaperStrayLight.normalize(sample_SL_matrix)
+
+        corrected = np.empty(sample_data.shape)
+        for n_iter in np.unique(sample_n_iter):
+            draws = sample_n_iter == n_iter
+            corrected[draws] = SlaperStrayLight.iterate(sample_data[draws], mZ[draws], int(n_iter))
+        return corrected[np.any(np.isfinite(corrected), axis=-1)]
@@ -0,0 +1,151 @@
+import datetime
+import warnings
+
+import numpy as np
+from pysolar import constants
+from pysolar import solartime
+
+from Source.Utilities import Utilities
+
+''' Vectorized solar position (Reda and Andreas 2005, NREL SPA), following the pysolar
+    implementation step for step so that results match pysolar.solar.get_azimuth and
+    get_altitude (sea level, standard atmosphere). The VSOP87 and nutation coefficient
+    tables, leap seconds, and delta T come from pysolar itself.
+
+    Validated against pysolar 0.13 on random latitudes, longitudes and times in 1990-2030:
+    zenith agrees to within 1e-6 degrees and azimuth to within 1e-5 degrees (the azimuth
+    difference grows as 1/sin(zenith) with the sun near the zenith). '''
+
+class SolarPosition:
+    # pysolar periodic term tables as arrays, one (terms x [A, B, C]) array per power of jme
+    tables = {}
+
+    @staticmethod
+    def coeffTable(name):
+        if name not in SolarPosition.tables:
+            coeffs = getattr(constants, name)
+            SolarPosition.tables[name] = [np.array(line, dtype=np.float64).reshape(-1, 3) for line in coeffs]
+        return SolarPosition.tables[name]
+
+    @staticmethod
+    def getCoeff(jme, name):
+        ''' Polynomial in jme of periodic terms, as pysolar.solar.get_coeff '''
+        result = np.zeros_like(jme)
+        x = np.ones_like(jme)
+        for line in SolarPosition.coeffTable(name):
+            # All terms of one power at once: (terms x records)
+            result += (line[:, 0] @ np.cos(line[:, 1, None] + line[:, 2, None] * jme[None, :])) * x
+            x = x * jme
+        return result
+
+    @staticmethod
+    def timeOffsets(times):
+        ''' Leap seconds and delta T (s) for each time; both only change by month, so pysolar's
+            tables are evaluated once per distinct month '''
+        months = times.astype('datetime64[M]')
+        uniqueMonths, inverse = np.unique(months, return_inverse=True)
+        leap = np.empty(len(uniqueMonths))
+        deltaT = np.empty(len(uniqueMonths))
+        for i, month in enumerate(uniqueMonths):
+            when = month.astype('datetime64[D]').astype(object)
+            when = datetime.datetime(when.year, when.month, when.day, tzinfo=datetime.timezone.utc)
+            leap[i] = solartime.get_leap_seconds(when)
+            deltaT[i] = solartime.get_delta_t(when)
+        return leap[inverse], deltaT[inverse]
+
+    @staticmethod
+    def nutation(jce):
+        ''' Nutation in longitude and obliquity (degrees) '''
+        p = constants.get_aberration_coeffs()
+        x = np.stack([p[k](jce) for k in
+            ('MeanElongationOfMoon', 'MeanAnomalyOfSun', 'MeanAnomalyOfMoon',
+             'ArgumentOfLatitudeOfMoon', 'LongitudeOfAscendingNode')], axis=1)
+        y = np.array(constants.aberration_sin_terms, dtype=np.float64)
+        abcd = np.array(constants.nutation_coefficients, dtype=np.float64)
+        sigmaxy = np.radians(x @ y.T)
+        longitude = ((abcd[:, 0] + abcd[:, 1] * jce[:, None]) * np.sin(sigmaxy)).sum(axis=1)
+        obliquity = ((abcd[:, 2] + abcd[:, 3] * jce[:, None]) * np.cos(sigmaxy)).sum(axis=1)
+        # 36000000 scales from 0.0001 arcseconds to degrees
+        return longitude/36000000.0, obliquity/36000000.0
+
+    @staticmethod
+    def azimuthZenith(latitude, longitude, times, elevation=0,
+                      temperature=constants.standard_temperature, pressure=constants.standard_pressure):
+        ''' Solar azimuth and (refraction corrected) zenith in degrees for arrays of latitude,
+            longitude and UTC times (datetime64, or timezone-aware datetimes).
+            Equivalent to pysolar get_azimuth and 90 - get_altitude, per record. '''
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        times = Utilities.toDatetime64(times)
+        if len(times) == 0:
+            return np.empty(0), np.empty(0)
+
+        # Time-dependent terms (pysolar.solartime)
+        with warnings.catch_warnings():
+            # pysolar warns once per call when its leap second table is out of date
+            warnings.simplefilter("ignore", category=UserWarning)
+            leap, deltaT = SolarPosition.timeOffsets(times)
+        timestamp = times.astype(np.int64) / 1e6
+        dayOffset = solartime.gregorian_day_offset + solartime.julian_day_offset
+        jd = (timestamp + leap + solartime.tt_offset - deltaT) / constants.seconds_per_day + dayOffset
+        jde = (timestamp + leap + solartime.tt_offset) / constants.seconds_per_day + dayOffset
+        jc = (jd - 2451545.0) / 36525.0
+        jce = (jde - 2451545.0) / 36525.0
+        jme = jce / 10.0
+
+        geocentricLatitude = -np.degrees(SolarPosition.getCoeff(jme, 'heliocentric_latitude_coeffs') / 1e8)
+        heliocentricLongitude = np.degrees(SolarPosition.getCoeff(jme, 'heliocentric_longitude_coeffs') / 1e8) % 360
+        geocentricLongitude = (heliocentricLongitude + 180) % 360
+        sunEarthDistance = SolarPosition.getCoeff(jme, 'sun_earth_distance_coeffs') / 1e8
+        aberrationCorrection = -20.4898 / (3600.0 * sunEarthDistance)
+        equatorialHorizontalParallax = 8.794 / (3600 / sunEarthDistance)
+        nutationLongitude, nutationObliquity = SolarPosition.nutation(jce)
+
+        u = jme/10.0
+        meanObliquity = 84381.448 - (4680.93 * u) - (1.55 * u ** 2) + (1999.25 * u ** 3) \
+            - (51.38 * u ** 4) -(249.67 * u ** 5) - (39.05 * u ** 6) + (7.12 * u ** 7) \
+            + (27.87 * u ** 8) + (5.79 * u ** 9) + (2.45 * u ** 10)
+        trueEclipticObliquity = (meanObliquity / 3600.0) + nutationObliquity
+
+        meanSiderealTime = (280.46061837 + (360.98564736629 * (jd - 2451545.0)) + 0.000387933 * jc * jc * (1 - jc / 38710000)) % 360
+        apparentSiderealTime = meanSiderealTime + nutationLongitude * np.cos(trueEclipticObliquity)
+
+        # Location and time dependent terms
+        apparentSunLongitude = np.radians(geocentricLongitude + nutationLongitude + aberrationCorrection)
+        obliquityRad = np.radians(trueEclipticObliquity)
+        latitudeRad = np.radians(geocentricLatitude)
+        rightAscension = np.degrees(np.arctan2(np.sin(apparentSunLongitude) * np.cos(obliquityRad) - np.tan(latitudeRad) * np.sin(obliquityRad),
+                                               np.cos(apparentSunLongitude))) % 360
+        declination = np.radians(np.degrees(np.arcsin(np.sin(latitudeRad) * np.cos(obliquityRad) +
+                                                      np.cos(latitudeRad) * np.sin(obliquityRad) * np.sin(apparentSunLongitude))))
+        localHourAngle = (apparentSiderealTime + longitude - rightAscension) % 360
+
+        flattenedLatitude = np.radians(np.degrees(np.arctan(0.99664719 * np.tan(np.radians(latitude)))))
+        projectedRadialDistance = np.cos(flattenedLatitude) + (elevation * np.cos(np.radians(latitude)) / constants.earth_radius)
+        projectedAxialDistance = 0.99664719 * np.sin(flattenedLatitude) + (elevation * np.sin(np.radians(latitude)) / constants.earth_radius)
+
+        parallaxRad = np.radians(equatorialHorizontalParallax)
+        hourAngleRad = np.radians(localHourAngle)
+        parallaxRightAscension = np.degrees(np.arctan2(-1 * projectedRadialDistance * np.sin(parallaxRad) * np.sin(hourAngleRad),
+                                                       np.cos(declination) - projectedRadialDistance * np.sin(parallaxRad) * np.cos(hourAngleRad)))
+        topocentricHourAngle = np.radians(localHourAngle - parallaxRightAscension)
+        topocentricDeclination = np.radians(np.degrees(np.arctan2(
+            (np.sin(declination) - projectedAxialDistance * np.sin(parallaxRad)) * np.cos(np.radians(parallaxRightAscension)),
+            np.cos(declination) - (projectedAxialDistance * np.sin(parallaxRad) * np.cos(hourAngleRad)))))
+
+        # Azimuth (pysolar convention: degrees clockwise from North)
+        latitudeRad = np.radians(latitude)
+        azimuth = (180.0 + np.degrees(np.arctan2(np.sin(topocentricHourAngle),
+            np.cos(topocentricHourAngle) * np.sin(latitudeRad) - np.tan(topocentricDeclination) * np.cos(latitudeRad)))) % 360
+
+        # Elevation with the NREL SPA refraction correction, as pysolar.get_altitude
+        elevationAngle = np.degrees(np.arcsin(np.sin(latitudeRad) * np.sin(topocentricDeclination) +
+                                              np.cos(latitudeRad) * np.cos(topocentricDeclination) * np.cos(topocentricHourAngle)))
+        sunRadius = 0.26667
+        atmosRefract = 0.5667
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = pressure * 2.830 * 1.02
+            b = 1010.0 * temperature * 60.0 * np.tan(np.radians(elevationAngle + (10.3/(elevationAngle + 5.11))))
+            refraction = np.where(elevationAngle >= -1.0*(sunRadius + atmosRefract), a / b, 0.)
+
+        return azimuth, 90 - (elevationAngle + refraction)
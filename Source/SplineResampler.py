@@ -0,0 +1,42 @@
+import numpy as np
+import scipy as sp
+
+from Source.Utilities import Utilities
+
+
+class SplineResampler:
+    ''' Cubic spline resampling of spectra from the wavebands of an instrument to a new set of
+        wavebands.
+
+        The interpolating cubic spline (InterpolatedUnivariateSpline with k=3, i.e. not-a-knot end
+        conditions) is linear in the data, so for fixed source and target wavebands it is a
+        (n_new x n_src) matrix. The matrix is built once per pair of grids and the whole
+        (time x n_src) spectral matrix of a dataset is resampled with one matrix product. '''
+
+    # Resampling operators of recently used grids, keyed by a digest of both grids
+    operators = {}
+    CACHE_SIZE = 8
+
+    @staticmethod
+    def operator(x, newX):
+        ''' The (n_new x n_src) matrix whose product with a spectrum on x is its spline on newX '''
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        newX = np.ascontiguousarray(newX, dtype=np.float64)
+
+        def build():
+            # The splines of the unit spectra, evaluated on newX, are the columns of the operator
+            M = np.ascontiguousarray(sp.interpolate.make_interp_spline(x, np.identity(len(x)), k=3)(newX))
+            M.setflags(write=False)
+            return M
+        return Utilities.cached(SplineResampler.operators, SplineResampler.CACHE_SIZE,
+                                Utilities.arrayDigest(x, newX), build)
+
+    @staticmethod
+    def resample(x, Y, newX):
+        ''' Spectra Y (time x n_src, on wavebands x) resampled to newX (time x n_new).
+            Spectra with NaN or inf values use their own spline, as before. '''
+        Y = np.asarray(Y, dtype=np.float64)
+        newY = Y @ SplineResampler.operator(x, newX).T
+        for i in np.flatnonzero(~np.all(np.isfinite(Y), axis=1)):
+            newY[i] = sp.interpolate.InterpolatedUnivariateSpline(x, Y[i], k=3)(newX)
+        return newY
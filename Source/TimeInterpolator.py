@@ -0,0 +1,53 @@
+import numpy as np
+
+from Source.Utilities import Utilities
+
+
+class TimeInterpolator:
+    ''' Linear time interpolation of whole datasets onto the timestamps of a reference dataset.
+
+        Interpolating from one timer to another is a sparse (n_target x n_source) operator with at
+        most two weights per row. It is stored as the bracketing indices and offsets of
+        Utilities.interpIndex, built once per (source timer, target timer) pair and shared by
+        every spectral and ancillary dataset with that timer. Applying it with
+        Utilities.interpColumns gives, column by column, the same values as Utilities.interp and
+        Utilities.interpAngular, including their nearest-record fill beyond the ends. '''
+
+    # Operators of recently used timer pairs, keyed by a digest of both sets of timestamps
+    operators = {}
+    CACHE_SIZE = 16
+
+    @staticmethod
+    def operator(xTimer, yTimer):
+        ''' Returns (xTS, newXTS, index): the Unix timestamps of both timers and the interpolation
+            index from the first to the second. index is None unless both timers are strictly
+            increasing, which the vectorized interpolation requires. '''
+        xTS = Utilities.toTimestamps(xTimer)
+        newXTS = Utilities.toTimestamps(yTimer)
+
+        def build():
+            index = None
+            if len(xTS) >= 2 and len(newXTS) >= 1 and Utilities.isIncreasing(xTS) \
+                    and Utilities.isIncreasing(newXTS):
+                index = Utilities.interpIndex(xTS, newXTS)
+            return (xTS, newXTS, index)
+        return Utilities.cached(TimeInterpolator.operators, TimeInterpolator.CACHE_SIZE,
+                                Utilities.arrayDigest(xTS, newXTS), build)
+
+    @staticmethod
+    def linear(operator, Y):
+        ''' Interpolates every column of the (n_source x columns) array Y '''
+        return Utilities.interpColumns(operator[2], Y)
+
+    @staticmethod
+    def angular(operator, Y):
+        ''' Interpolates every column of Y, in degrees, as Utilities.interpAngular with fill_value=0
+            does: negative angles are taken as 360 + angle and the results are in [0, 360).
+            Columns with NaNs drop them before interpolating, so they go through interpAngular. '''
+        xTS, newXTS, index = operator
+        Y = np.asarray(Y, dtype=np.float64)
+        Y = np.where(Y < 0, 360 + Y, Y)
+        newY = np.rad2deg(Utilities.interpColumns(index, np.deg2rad(Y)) % (2*np.pi))
+        for j in np.flatnonzero(np.isnan(Y).any(axis=0)):
+            newY[:, j] = Utilities.interpAngular(xTS.tolist(), Y[:, j], newXTS.tolist(), fill_value=0)
+        return newY
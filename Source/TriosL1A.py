@@ -147,7 +147,7 @@ class TriosL1A:
         # A = f.create_group('SAM_'+name+'.dat')
         gp =  HDFGroup()
         gp.id = 'SAM_'+name+'.ini'
-        root.groups.append(gp)
+        root.appendGroup(gp)
 
         # Configuration file
         TriosL1A.attr_ini(cal_path + 'SAM_'+name+'.ini',gp)
@@ -84,6 +84,7 @@ class TriosL1B:
         mesure = raw_data/65535.0
         FRM_mesure = np.zeros((nmes, nband))
         back_mesure = np.zeros((nmes, nband))
+        linear_corr_mesure = np.zeros((nmes, nband))
         for n in range(nmes):
             # Background correction : B0 and B1 read from full charaterisation
             back_mesure[n,:] = B0 + B1*(int_time[n]/int_time_t0)
@@ -94,11 +95,14 @@ class TriosL1B:
             offset_corrected_mesure = back_corrected_mesure - offset
 
             # Non-linearity correction
-            linear_corr_mesure = offset_corrected_mesure*(1-alpha*offset_corrected_mesure)
+            linear_corr_mesure[n,:] = offset_corrected_mesure*(1-alpha*offset_corrected_mesure)
 
-            # Straylight correction over measurement
-            straylight_corr_mesure = ProcessL1b_FRMCal.Slaper_SL_correction(linear_corr_mesure, mZ, n_iter)
-            # straylight_corr_mesure = np.matmul(C_zong, linear_corr_mesure)
+        # Straylight correction over all measurements at once
+        straylight_corr_mesures = ProcessL1b_FRMCal.Slaper_SL_correction(linear_corr_mesure, mZ, n_iter)
+        # straylight_corr_mesures = np.matmul(linear_corr_mesure, C_zong.T)
+
+        for n in range(nmes):
+            straylight_corr_mesure = straylight_corr_mesures[n]
 
             # Normalization for integration time
             normalized_mesure = straylight_corr_mesure * int_time_t0/int_time[n]
@@ -532,8 +532,9 @@ class Propagate:
 
         # load in the LUT HDF file
         inFilePath = os.path.join(PATH_TO_DATA, 'rhoTable_AO1999.hdf')
-        lut = HDFRoot.readHDF5(inFilePath)
+        lut = HDFRoot.readHDF5(inFilePath, lazy=True)
         lutData = lut.groups[0].datasets['LUT'].data
+        lut.close()
 
         # convert to a 2D array
         lut = np.array(lutData.tolist())
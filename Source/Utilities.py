@@ -2,6 +2,9 @@
 import os
 import datetime
 import collections
+import hashlib
+import json
+import concurrent.futures
 
 import pytz
 from collections import Counter
@@ -12,6 +15,7 @@ from PyQt5.QtWidgets import QMessageBox
 
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import cm
+from matplotlib.figure import Figure
 import numpy as np
 import scipy.interpolate
 from scipy.interpolate import splev, splrep
@@ -113,13 +117,14 @@ class Utilities:
             # fp = 'Data/Thuillier_F0.sb'
             # print("SB_support.readSB: " + fp)
             print("Reading : " + fp)
-            if not HDFRoot.readHDF5(fp):
+            # Lazy read: only the SSI, SSI_UNC and wavelength datasets are loaded
+            F0_hybrid = HDFRoot.readHDF5(fp, lazy=True)
+            if not F0_hybrid:
                 msg = "Unable to read TSIS-1 netcdf file."
                 print(msg)
                 Utilities.writeLogFile(msg)
                 return None
             else:
-                F0_hybrid = HDFRoot.readHDF5(fp)
                 # F0_raw = np.array(Thuillier.data['esun']) # uW cm^-2 nm^-1
                 # wv_raw = np.array(Thuillier.data['wavelength'])
                 for ds in F0_hybrid.datasets:
@@ -131,6 +136,7 @@ class Utilities:
                         F0_unc_raw = F0_unc_raw * 100 # uW cm^-2 nm^-1
                     if ds.id == 'Vacuum Wavelength':
                         wv_raw =ds.data
+                F0_hybrid.close()
 
         # Earth-Sun distance
         day = int(str(dateTag)[4:7])
@@ -246,8 +252,14 @@ class Utilities:
         returnValue = msgBox.exec_()
         return returnValue
 
+    # Log lines held back instead of written, while not None (e.g. in L2 ensemble worker processes)
+    logCapture = None
+
     @staticmethod
     def writeLogFile(logText, mode='a'):
+        if Utilities.logCapture is not None:
+            Utilities.logCapture.append(logText)
+            return
         with open('Logs/' + os.environ["LOGFILE"], mode) as logFile:
             logFile.write(logText + "\n")
 
@@ -389,6 +401,50 @@ class Utilities:
         return datetime.datetime(year,mon,day,0,0,0,0,tzinfo=datetime.timezone.utc)
 
 
+    # Vectorized DATETAG (YYYYDOY) and TIMETAG2 (HHMMSSmmm) to a datetime64[us] (UTC) time axis.
+    # Returns the times and a mask of valid records. Invalid records (NaT) are datetags
+    # outside the 20th and 21st centuries, timetags of 0 or NaN, and out-of-range fields.
+    @staticmethod
+    def tagsToDatetime64(dateTag, timeTag2):
+        dateTag = np.asarray(dateTag, dtype=np.float64)
+        timeTag2 = np.asarray(timeTag2, dtype=np.float64)
+        finite = np.isfinite(dateTag) & np.isfinite(timeTag2)
+        dateTag = np.where(finite, dateTag, 0).astype(np.int64)
+        timeTag2 = np.where(finite, timeTag2, 0)
+        tt2 = timeTag2.astype(np.int64)
+
+        year = dateTag // 1000
+        doy = dateTag % 1000
+        h = tt2 // 10**7
+        m = (tt2 // 10**5) % 100
+        s = (tt2 // 1000) % 100
+        ms = tt2 % 1000
+        valid = finite & (year >= 1900) & (year <= 2099) & (doy >= 1) & (doy <= 366) \
+            & (timeTag2 > 0) & (tt2 < 10**9) & (h < 24) & (m < 60) & (s < 60)
+
+        year = np.where(valid, year, 1970)
+        doy = np.where(valid, doy, 1)
+        days = (year - 1970).astype('datetime64[Y]').astype('datetime64[D]') + (doy - 1).astype('timedelta64[D]')
+        us = (((h*60 + m)*60 + s)*1000 + ms)*1000
+        times = days.astype('datetime64[us]') + np.where(valid, us, 0).astype('timedelta64[us]')
+        times[~valid] = np.datetime64('NaT')
+        return times, valid
+
+    # datetime64 time axis to a list of UTC datetimes, as used in DATETIME datasets and Datetime columns
+    @staticmethod
+    def datetime64ToDateTime(times):
+        return [t.replace(tzinfo=datetime.timezone.utc) for t in times.astype('datetime64[us]').astype(object)]
+
+    # Logs invalid records found by tagsToDatetime64 and returns their indexes
+    @staticmethod
+    def badTagRows(valid, dateTag, timeTag2):
+        badRows = np.flatnonzero(~valid)
+        for i in badRows:
+            msg = f"Bad Datetag or Timetag2 found. Eliminating record. {i} DT: {dateTag[i]} TT2: {timeTag2[i]}"
+            print(msg)
+            Utilities.writeLogFile(msg)
+        return badRows
+
     # Add a dataset to each group for DATETIME, as defined by TIMETAG2 and DATETAG
     # Also screens for nonsense timetags like 0.0 or NaN, and datetags that are not
     # in the 20th or 21st centuries
@@ -397,31 +453,17 @@ class Utilities:
         for gp in node.groups:
             # print(gp.id)
             if gp.id != "SOLARTRACKER_STATUS" and "UNCERT" not in gp.id and gp.id != "SATMSG.tdf": # No valid timestamps in STATUS
-                timeData = gp.getDataset("TIMETAG2").data["NONE"].tolist()
-                dateTag = gp.getDataset("DATETAG").data["NONE"].tolist()
-                timeStamp = []
-                for i, timei in enumerate(timeData):
-                    # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
-                    # Filter for aberrant Datetags
-                    t = str(int(timei)).zfill(9)
-                    h = int(t[:2])
-                    m = int(t[2:4])
-                    s = int(t[4:6])
-
-                    if (str(dateTag[i]).startswith("19") or str(dateTag[i]).startswith("20")) \
-                        and timei != 0.0 and not np.isnan(timei) \
-                            and h < 60 and m < 60 and s < 60:
-
-                        dt = Utilities.dateTagToDateTime(dateTag[i])
-                        timeStamp.append(Utilities.timeTag2ToDateTime(dt, timei))
-                    else:
-                        msg = f"Bad Datetag or Timetag2 found. Eliminating record. {i} DT: {dateTag[i]} TT2: {timei}"
-                        print(msg)
-                        Utilities.writeLogFile(msg)
-                        gp.datasetDeleteRow(i)
+                timeData = gp.getDataset("TIMETAG2").data["NONE"]
+                dateTag = gp.getDataset("DATETAG").data["NONE"]
+                # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
+                # Filter for aberrant Datetags, then drop the bad records in one step
+                times, valid = Utilities.tagsToDatetime64(dateTag, timeData)
+                badRows = Utilities.badTagRows(valid, dateTag, timeData)
+                if len(badRows) > 0:
+                    gp.datasetDeleteRow(badRows)
 
                 dateTime = gp.addDataset("DATETIME")
-                dateTime.data = timeStamp
+                dateTime.data = Utilities.datetime64ToDateTime(times[valid])
         return node
 
     # Add a data column to each group dataset for DATETIME, as defined by TIMETAG2 and DATETAG
@@ -444,21 +486,14 @@ class Utilities:
                                 timeData = gp.datasets[ds].columns["Timetag2"]
                                 dateTag = gp.datasets[ds].columns["Datetag"]
 
-                                timeStamp = []
-                                for i, timei in enumerate(timeData):
-                                    # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
-                                    # Filter for aberrant Datetags
-                                    if (str(dateTag[i]).startswith("19") or str(dateTag[i]).startswith("20")) \
-                                        and timei != 0.0 and not np.isnan(timei):
-
-                                        dt = Utilities.dateTagToDateTime(dateTag[i])
-                                        timeStamp.append(Utilities.timeTag2ToDateTime(dt, timei))
-                                    else:
-                                        gp.datasetDeleteRow(i)
-                                        msg = f"Bad Datetag or Timetag2 found. Eliminating record. {i} DT: {dateTag[i]} TT2: {timei}"
-                                        print(msg)
-                                        Utilities.writeLogFile(msg)
-                                gp.datasets[ds].columns["Datetime"] = timeStamp
+                                # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
+                                # Filter for aberrant Datetags, then drop the bad records in one step
+                                times, valid = Utilities.tagsToDatetime64(dateTag, timeData)
+                                badRows = Utilities.badTagRows(valid, dateTag, timeData)
+                                if len(badRows) > 0:
+                                    gp.datasetDeleteRow(badRows)
+                                    gp.datasets[ds].datasetToColumns()
+                                gp.datasets[ds].columns["Datetime"] = Utilities.datetime64ToDateTime(times[valid])
                                 gp.datasets[ds].columns.move_to_end('Datetime', last=False)
                                 gp.datasets[ds].columnsToDataset()
                 else:
@@ -476,22 +511,15 @@ class Utilities:
                     gp.datasets['Timestamp'].columns['Timetag2'] = timeData
                     gp.datasets['Timestamp'].columnsToDataset()
 
-                    timeStamp = []
-                    for i, timei in enumerate(timeData):
-                        # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
-                        # Filter for aberrant Datetags
-                        if (str(dateTag[i]).startswith("19") or str(dateTag[i]).startswith("20")) \
-                            and timei != 0.0 and not np.isnan(timei):
-
-                            dt = Utilities.dateTagToDateTime(dateTag[i])
-                            timeStamp.append(Utilities.timeTag2ToDateTime(dt, timei))
-                        else:
-                            gp.datasetDeleteRow(i) # L1AQC datasets all have the same i
-                            msg = f"Bad Datetag or Timetag2 found. Eliminating record. {i} DT: {dateTag[i]} TT2: {timei}"
-                            print(msg)
-                            Utilities.writeLogFile(msg)
+                    # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
+                    # Filter for aberrant Datetags, then drop the bad records in one step
+                    times, valid = Utilities.tagsToDatetime64(dateTag, timeData)
+                    badRows = Utilities.badTagRows(valid, dateTag, timeData)
+                    if len(badRows) > 0:
+                        gp.datasetDeleteRow(badRows) # L1AQC datasets all have the same i
+                        gp.datasets['Timestamp'].datasetToColumns()
                     # This will be the only dataset structure like a higher level with time/date columns
-                    gp.datasets['Timestamp'].columns["Datetime"] = timeStamp
+                    gp.datasets['Timestamp'].columns["Datetime"] = Utilities.datetime64ToDateTime(times[valid])
                     gp.datasets['Timestamp'].columns.move_to_end('Datetime', last=False)
                     gp.datasets['Timestamp'].columnsToDataset()
 
@@ -504,31 +532,17 @@ class Utilities:
     def rawDataAddDateTime(node):
         for gp in node.groups:
             if "L1AQC" in gp.id:
-                timeData = gp.getDataset("TIMETAG2").data["NONE"].tolist()
-                dateTag = gp.getDataset("DATETAG").data["NONE"].tolist()
-                timeStamp = []
-                for i, timei in enumerate(timeData):
-                    # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
-                    # Filter for aberrant Datetags
-                    t = str(int(timei)).zfill(9)
-                    h = int(t[:2])
-                    m = int(t[2:4])
-                    s = int(t[4:6])
-
-                    if (str(dateTag[i]).startswith("19") or str(dateTag[i]).startswith("20")) \
-                        and timei != 0.0 and not np.isnan(timei) \
-                            and h < 60 and m < 60 and s < 60:
-
-                        dt = Utilities.dateTagToDateTime(dateTag[i])
-                        timeStamp.append(Utilities.timeTag2ToDateTime(dt, timei))
-                    else:
-                        msg = f"Bad Datetag or Timetag2 found. Eliminating record. {i} DT: {dateTag[i]} TT2: {timei}"
-                        print(msg)
-                        Utilities.writeLogFile(msg)
-                        gp.datasetDeleteRow(i)
+                timeData = gp.getDataset("TIMETAG2").data["NONE"]
+                dateTag = gp.getDataset("DATETAG").data["NONE"]
+                # Converts from TT2 (hhmmssmss. UTC) and Datetag (YYYYDOY UTC) to datetime
+                # Filter for aberrant Datetags, then drop the bad records in one step
+                times, valid = Utilities.tagsToDatetime64(dateTag, timeData)
+                badRows = Utilities.badTagRows(valid, dateTag, timeData)
+                if len(badRows) > 0:
+                    gp.datasetDeleteRow(badRows)
 
                 dateTime = gp.addDataset("DATETIME")
-                dateTime.data = timeStamp
+                dateTime.data = Utilities.datetime64ToDateTime(times[valid])
         return node
 
     # Remove records if values of DATETIME are not strictly increasing
@@ -618,18 +632,19 @@ class Utilities:
             length = np.asarray(list(ds.values())).shape[1]
 
         for k in keys:
-            for x in range(length):
-                if k != 'Datetime':
-                    if np.isnan(data[k][x]):
-                        return True
-                # else:
-                #     if np.isnan(ds.data[k][x]):
-                #         return True
+            if k != 'Datetime':
+                if np.isnan(np.asarray(data[k][:length])).any():
+                    return True
+            # else:
+            #     if np.isnan(ds.data[k][x]):
+            #         return True
         return False
 
     # Check if the list contains strictly increasing values
     @staticmethod
     def isIncreasing(l):
+        if isinstance(l, np.ndarray) and l.dtype.kind in 'iufM':
+            return bool(np.all(l[1:] > l[:-1]))
         return all(x<y for x, y in zip(l, l[1:]))
 
     @staticmethod
@@ -678,6 +693,52 @@ class Utilities:
         return out[int(np.floor(window_size/2)):-int(np.floor(window_size/2))]
 
 
+    @staticmethod
+    def movingAverageBands(data, window_size):
+        ''' Utilities.movingAverage applied to every row of a 2-D (band x time) array at once.
+            NaN-tolerant: each window averages its non-NaN values. The rolling sums are
+            accumulated from window_size shifted slices of the zero-padded rows. '''
+        data = np.asarray(data, dtype=np.float64)
+        mask = np.isnan(data)
+        nBands, n = data.shape
+        halfWindow = int(np.floor(window_size/2))
+        # Length of movingAverage output (n for odd windows)
+        m = n + window_size - 1 - 2*halfWindow
+
+        values = np.zeros((nBands, n + 2*(window_size - 1)))
+        values[:, window_size - 1:window_size - 1 + n] = np.where(mask, 0, data)
+        counts = np.zeros((nBands, n + 2*(window_size - 1)), dtype=int)
+        counts[:, window_size - 1:window_size - 1 + n] = ~mask
+
+        total = values[:, halfWindow:halfWindow + m].copy()
+        denom = counts[:, halfWindow:halfWindow + m].copy()
+        for shift in range(1, window_size):
+            total += values[:, halfWindow + shift:halfWindow + shift + m]
+            denom += counts[:, halfWindow + shift:halfWindow + shift + m]
+        denom = np.where(denom != 0, denom, 1) # block div0; the numerator will be zero anyway
+
+        return total/denom
+
+    @staticmethod
+    def rollingStdBands(residual, window_size):
+        ''' Rolling standard deviation of each row of a 2-D (band x time) residual, as in the
+            light deglitching: leading (and NaN) windows take the first full window's value,
+            rounded to 3 decimals. '''
+        residualDf = pd.DataFrame(residual.T)
+        rollingStd = residualDf.rolling(window_size).std().to_numpy()
+        rollingStd = np.where(np.isnan(rollingStd), rollingStd[window_size - 1], rollingStd)
+        return np.ascontiguousarray(np.round(rollingStd, 3).T)
+
+    @staticmethod
+    def convolutionBad(data, avg, std, sigma):
+        ''' Vectorized darkConvolution/lightConvolution for 2-D (band x time) arrays; std is
+            one value per band (dark) or per band and record (light) '''
+        badIndex = (data > avg + (sigma*std)) | (data < avg - (sigma*std))
+        # First and last avg values from convolution are not to be trusted
+        badIndex[:, 0] = True
+        badIndex[:, -1] = True
+        return badIndex
+
     @staticmethod
     def darkConvolution(data,avg,std,sigma):
         badIndex = []
@@ -768,6 +829,51 @@ class Utilities:
 
         return new_y
 
+    @staticmethod
+    def interpIndex(x, new_x):
+        ''' The part of Utilities.interp (linear) that depends only on x and new_x: the bracketing
+            indices, spacing and offset of each new_x, to be shared by every column interpolated
+            with interpColumns. As in Utilities.interp, values beyond either end of x take the
+            first or last value. x must be strictly increasing. '''
+        x = np.asarray(x, dtype=np.float64)
+        new_x = np.asarray(new_x, dtype=np.float64)
+        # Segments as found by numpy.interp, which interp1d uses for linear interpolation
+        hi = np.clip(np.searchsorted(x, new_x, side='right'), 1, len(x)-1)
+        lo = hi - 1
+        dx = x[hi] - x[lo]
+        offset = new_x - x[lo]
+
+        # Beyond the ends: zero slope from the first or last record
+        before = new_x < x[0]
+        after = new_x >= x[-1]
+        lo[before] = hi[before] = 0
+        lo[after] = hi[after] = len(x)-1
+        dx[before | after] = 1.0
+        offset[before | after] = 0.0
+        return lo, hi, dx, offset
+
+    @staticmethod
+    def interpColumns(index, y):
+        ''' Linearly interpolates every column of the (len(x) x columns) array y with the
+            interpIndex of x and new_x, giving a (len(new_x) x columns) array equal column by
+            column to Utilities.interp(x, y[:,j], new_x) '''
+        lo, hi, dx, offset = index
+        y = np.asarray(y, dtype=np.float64)
+        yLo = y[lo]
+        yHi = y[hi]
+        slope = (yHi - yLo) / dx[:, None]
+        new_y = slope*offset[:, None] + yLo
+
+        # numpy.interp retries from the upper end of the segment where the result is NaN
+        # (e.g. an infinite slope), and takes yLo where that fails too but yLo == yHi
+        nan = np.isnan(new_y)
+        if nan.any():
+            upper = slope*(offset - dx)[:, None] + yHi
+            new_y[nan] = upper[nan]
+            same = nan & np.isnan(new_y) & (yLo == yHi)
+            new_y[same] = yLo[same]
+        return new_y
+
     @staticmethod
     def interpAngular(x, y, new_x, fill_value="extrapolate"):
         ''' Wrapper for scipy interp1d that works even if
@@ -876,6 +982,112 @@ class Utilities:
         return newYList
 
 
+    @staticmethod
+    def toDatetime64(times):
+        ''' Converts datetimes to a datetime64[us] array. Timezone-aware values are
+            converted to UTC (HyperCP timestamps are UTC-aware). '''
+        if isinstance(times, np.ndarray) and times.dtype.kind == 'M':
+            return times.astype('datetime64[us]')
+        naive = []
+        for t in times:
+            if getattr(t, 'tzinfo', None) is not None:
+                t = (t - t.utcoffset()).replace(tzinfo=None)
+            naive.append(t)
+        return np.array(naive, dtype='datetime64[us]')
+
+    @staticmethod
+    def toTimestamps(times):
+        ''' Unix timestamps (float seconds) of datetimes, equal to
+            calendar.timegm(t.utctimetuple()) + t.microsecond/1E6 for each t '''
+        microseconds = Utilities.toDatetime64(times).astype(np.int64)
+        seconds = microseconds // 1000000
+        return seconds.astype(np.float64) + (microseconds - seconds*1000000) / 1E6
+
+    @staticmethod
+    def interpDark(darkData, darkTimer, lightData, lightTimer):
+        ''' Interpolates every waveband of the dark dataset to the light timestamps in one pass.
+            Returns a copy of lightData.data holding the interpolated darks, or False if the
+            timers are too short or not strictly increasing. '''
+        x = Utilities.toDatetime64(darkTimer.data)
+        new_x = Utilities.toDatetime64(lightTimer.data)
+
+        if len(x) < 3 or len(darkData.data) < 3 or len(new_x) < 3:
+            msg = "**************Cannot do cubic spline interpolation, length of datasets < 3"
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return False
+        if not Utilities.isIncreasing(x):
+            msg = "**************darkTimer does not contain strictly increasing values"
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return False
+        if not Utilities.isIncreasing(new_x):
+            msg = "**************lightTimer does not contain strictly increasing values"
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return False
+
+        # Timestamps and interpolation weights are shared by all wavebands
+        names = list(darkData.data.dtype.names)
+        index = Utilities.interpIndex(Utilities.toTimestamps(x), Utilities.toTimestamps(new_x))
+        darks = Utilities.interpColumns(index, darkData.matrix(names))
+
+        newDarkData = np.copy(lightData.data)
+        for j, k in enumerate(names):
+            newDarkData[k] = darks[:, j]
+        return newDarkData
+
+    @staticmethod
+    def mergeTimeRanges(badTimes):
+        ''' Sorts and merges overlapping [start, stop] ranges (inclusive).
+            Returns datetime64 arrays of the merged starts and stops. '''
+        if len(badTimes) == 0:
+            return np.array([], dtype='datetime64[us]'), np.array([], dtype='datetime64[us]')
+        starts = Utilities.toDatetime64([dateTime[0] for dateTime in badTimes])
+        stops = Utilities.toDatetime64([dateTime[1] for dateTime in badTimes])
+        # Inverted ranges never matched a record
+        valid = starts <= stops
+        starts, stops = starts[valid], stops[valid]
+        if len(starts) == 0:
+            return starts, stops
+        order = np.argsort(starts, kind='stable')
+        starts, stops = starts[order], stops[order]
+        # A range starts a new block unless it begins within (or at the end of) the ranges before it
+        reach = np.maximum.accumulate(stops)
+        newBlock = np.ones(len(starts), dtype=bool)
+        newBlock[1:] = starts[1:] > reach[:-1]
+        blockFirst = np.flatnonzero(newBlock)
+        blockLast = np.append(blockFirst[1:] - 1, len(starts) - 1)
+        return starts[blockFirst], reach[blockLast]
+
+    @staticmethod
+    def timeRangesMask(timeStamp, badTimes):
+        ''' Boolean mask, True for each timestamp within any [start, stop] range of badTimes '''
+        times = Utilities.toDatetime64(timeStamp)
+        starts, stops = Utilities.mergeTimeRanges(badTimes)
+        if len(starts) == 0 or len(times) == 0:
+            return np.zeros(len(times), dtype=bool)
+        # Last merged range starting at or before each time
+        block = np.searchsorted(starts, times, side='right') - 1
+        inRange = block >= 0
+        inRange[inRange] = times[inRange] <= stops[block[inRange]]
+        return inRange
+
+    @staticmethod
+    def deleteTimeRanges(group, timeStamp, badTimes):
+        ''' Deletes the records of timeStamp that fall in badTimes from every dataset
+            in the group, in a single pass. Returns the number of records removed. '''
+        if len(badTimes) == 0:
+            return 0
+        if len(timeStamp) == 0:
+            msg = 'Data group is empty. Continuing.'
+            print(msg)
+            Utilities.writeLogFile(msg)
+            return 0
+        rowsToDelete = np.flatnonzero(Utilities.timeRangesMask(timeStamp, badTimes))
+        group.datasetDeleteRow(rowsToDelete)
+        return len(rowsToDelete)
+
     @staticmethod
     def filterData(group, badTimes, level = None):
         ''' Delete flagged records. Level is only specified to point to the timestamp.
@@ -906,38 +1118,8 @@ class Utilities:
         Utilities.writeLogFile(msg)
 
         # Delete the records in badTime ranges from each dataset in the group
-        finalCount = 0
         originalLength = len(timeStamp)
-        for dateTime in badTimes:
-            # Need to reinitialize for each loop
-            startLength = len(timeStamp)
-            newTimeStamp = []
-
-            # msg = f'Eliminate data between: {dateTime}'
-            # print(msg)
-            # Utilities.writeLogFile(msg)
-
-            start = dateTime[0]
-            stop = dateTime[1]
-
-            if startLength > 0:
-                rowsToDelete = []
-                for i in range(startLength):
-                    if start <= timeStamp[i] and stop >= timeStamp[i]:
-                        try:
-                            rowsToDelete.append(i)
-                            finalCount += 1
-                        except:
-                            print('error')
-                    else:
-                        newTimeStamp.append(timeStamp[i])
-                group.datasetDeleteRow(rowsToDelete)
-            else:
-                msg = 'Data group is empty. Continuing.'
-                print(msg)
-                Utilities.writeLogFile(msg)
-                break
-            timeStamp = newTimeStamp.copy()
+        finalCount = Utilities.deleteTimeRanges(group, timeStamp, badTimes)
 
         # TRIOS: reset CAL and BACK as before filtering
         if ConfigFile.settings['SensorType'].lower() == 'trios':
@@ -1558,32 +1740,44 @@ class Utilities:
 
         print('\n')
 
-    @staticmethod
-    def specFilter(inFilePath, Dataset, timeStamp, station=None, filterRange=[400, 700],\
-                filterFactor=3, rType='None'):
-
-        if ConfigFile.settings['bL1bqcEnableSpecQualityCheckPlot']:
-            import logging
-            logging.getLogger('matplotlib.font_manager').disabled = True
-
-            dirPath = os.getcwd()
-            outDir = MainConfig.settings["outDir"]
-            # If default output path (HyperInSPACE/Data) is used, choose the root HyperInSPACE path,
-            # and build on that (HyperInSPACE/Plots/etc...)
-            if os.path.abspath(outDir) == os.path.join(dirPath,'Data'):
-                outDir = dirPath
-
-            # Otherwise, put Plots in the chosen output directory from Main
-            plotDir = os.path.join(outDir,'Plots','L1BQC_Spectral_Filter')
-
-            if not os.path.exists(plotDir):
-                os.makedirs(plotDir)
+    # Plots handed off by the processing (e.g. spectral filters) and rendered by a worker thread.
+    # With PLOT_WORKERS = 0 they are rendered immediately instead.
+    PLOT_WORKERS = 1
+    plotExecutor = None
+    pendingPlots = []
+
+    @staticmethod
+    def submitPlot(function, *args):
+        ''' Renders a plot in the background. function must not use pyplot (which is not thread
+            safe) but draw on its own matplotlib Figure. '''
+        if Utilities.PLOT_WORKERS == 0:
+            function(*args)
+            return
+        if Utilities.plotExecutor is None:
+            Utilities.plotExecutor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=Utilities.PLOT_WORKERS, thread_name_prefix='plots')
+        Utilities.pendingPlots.append(Utilities.plotExecutor.submit(function, *args))
+
+    @staticmethod
+    def waitForPlots():
+        ''' Blocks until every submitted plot is saved (e.g. before a report includes them) '''
+        pending = Utilities.pendingPlots
+        Utilities.pendingPlots = []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as err:
+                msg = f'Utilities.waitForPlots: plot failed: {err}'
+                print(msg)
+                Utilities.writeLogFile(msg)
 
-            font = {'family': 'serif',
-                    'color':  'darkred',
-                    'weight': 'normal',
-                    'size': 16,
-                    }
+    @staticmethod
+    def specFilterMask(Dataset, filterRange=[400, 700], filterFactor=3):
+        ''' Spectral outlier test over the (records x bands) matrix of the bands in filterRange.
+            Each spectrum is normalized to its peak; records beyond filterFactor standard deviations
+            from the median normalized spectrum, or negative, in any band (but the last) are bad.
+            Returns the mask of bad records, the wavelengths, the normalized spectra and their
+            median and standard deviation. '''
 
         # Collect each column name ignoring Datetag and Timetag2 (i.e. each wavelength) in the desired range
         x = []
@@ -1594,84 +1788,93 @@ class Utilities:
                     x.append(k)
                     wave.append(float(k))
 
-        # Read in each spectrum
-        total = Dataset.data.shape[0]
-        specArray = []
-        normSpec = []
+        specArray = Dataset.matrix(x)
 
-        if ConfigFile.settings['bL1bqcEnableSpecQualityCheckPlot']:
-            # cmap = cm.get_cmap("jet")
-            # color=iter(cmap(np.linspace(0,1,total)))
-            print('Creating plots...')
-            plt.figure(1, figsize=(10,8))
+        # The peak of each spectrum, as found by max(): NaNs are passed over, except in the first band
+        peakIndx = np.argmax(np.where(np.isnan(specArray), -np.inf, specArray), axis=1)
+        peakIndx[np.isnan(specArray[:, 0])] = 0
+        normSpec = specArray / specArray[np.arange(len(specArray)), peakIndx][:, None]
 
-        for timei in range(total):
-            y = []
-            for waveband in x:
-                y.append(Dataset.data[waveband][timei])
+        aveSpec = np.median(normSpec, axis = 0)
+        stdSpec = np.std(normSpec, axis = 0)
 
-            specArray.append(y)
-            peakIndx = y.index(max(y))
-            normSpec.append(y / y[peakIndx])
-            # plt.plot(wave, y / y[peakIndx], color='grey')
+        # Identify outliers and negative values for elimination. The last band is not tested.
+        upper = aveSpec + filterFactor*stdSpec
+        lower = aveSpec - filterFactor*stdSpec
+        rad = normSpec[:, :-1]
+        badIndx = np.any((rad > upper[:-1]) | (rad < lower[:-1]) | (rad < 0), axis=1)
 
-        normSpec = np.array(normSpec)
+        return badIndx, wave, normSpec, aveSpec, stdSpec
 
-        aveSpec = np.median(normSpec, axis = 0)
-        stdSpec = np.std(normSpec, axis = 0)
+    @staticmethod
+    def plotSpecFilter(fp, wave, normSpec, badIndx, aveSpec, stdSpec, filterFactor, rType):
+        ''' Saves the plot of a spectral filter to fp (on its own Figure, so it can run in a worker) '''
+        import logging
+        logging.getLogger('matplotlib.font_manager').disabled = True
+
+        font = {'family': 'serif',
+                'color':  'darkred',
+                'weight': 'normal',
+                'size': 16,
+                }
+
+        fig = Figure(figsize=(10,8))
+        axes = fig.add_subplot()
+        for timei in range(len(normSpec)):
+            if badIndx[timei]:
+                axes.plot( wave, normSpec[timei,:], color='red', linewidth=0.5, linestyle=(0, (5, 5)) ) # dashed
+            else:
+                axes.plot(wave, normSpec[timei,:], color='grey')
+
+        axes.plot(wave, aveSpec, color='black', linewidth=0.5)
+        axes.plot(wave, aveSpec + filterFactor*stdSpec, color='black', linewidth=2, linestyle='dashed')
+        axes.plot(wave, aveSpec - filterFactor*stdSpec, color='black', linewidth=2, linestyle='dashed')
+
+        axes.set_title(f'Sigma = {filterFactor}', fontdict=font)
+        axes.set_xlabel('Wavelength [nm]', fontdict=font)
+        axes.set_ylabel(f'{rType} [Normalized to peak value]', fontdict=font)
+        fig.subplots_adjust(left=0.15)
+        fig.subplots_adjust(bottom=0.15)
+        axes.grid()
+
+        # Save the plot
+        fig.savefig(fp)
 
-        badTimes  = []
-        badIndx = []
-        # For each spectral band...
-        for i in range(0, len(normSpec[0])-1):
-            # For each timeseries radiometric measurement...
-            for j, rad in enumerate(normSpec[:,i]):
-                # Identify outliers and negative values for elimination
-                if rad > (aveSpec[i] + filterFactor*stdSpec[i]) or \
-                    rad < (aveSpec[i] - filterFactor*stdSpec[i]) or \
-                    rad < 0:
-                    badIndx.append(j)
-                    badTimes.append(timeStamp[j])
-
-        badIndx = np.unique(badIndx)
-        badTimes = np.unique(badTimes)
+    @staticmethod
+    def specFilter(inFilePath, Dataset, timeStamp, station=None, filterRange=[400, 700],\
+                filterFactor=3, rType='None'):
+
+        badIndx, wave, normSpec, aveSpec, stdSpec = Utilities.specFilterMask(Dataset, filterRange, filterFactor)
+
+        badTimes = np.unique([timeStamp[j] for j in np.flatnonzero(badIndx)])
         # Duplicates each element to a list of two elements in a list:
         badTimes = np.rot90(np.matlib.repmat(badTimes,2,1), 3)
 
         if ConfigFile.settings['bL1bqcEnableSpecQualityCheckPlot']:
-            # t0 = time.time()
-            for timei in range(total):
-            # for i in badIndx:
-                if timei in badIndx:
-                    # plt.plot( wave, normSpec[i,:], color='red', linewidth=0.5, linestyle=(0, (1, 10)) ) # long-dot
-                    plt.plot( wave, normSpec[timei,:], color='red', linewidth=0.5, linestyle=(0, (5, 5)) ) # dashed
-                else:
-                    plt.plot(wave, normSpec[timei,:], color='grey')
-
-            # t1 = time.time()
-            # print(f'Time elapsed: {str(round((t1-t0)))} Seconds')
+            dirPath = os.getcwd()
+            outDir = MainConfig.settings["outDir"]
+            # If default output path (HyperInSPACE/Data) is used, choose the root HyperInSPACE path,
+            # and build on that (HyperInSPACE/Plots/etc...)
+            if os.path.abspath(outDir) == os.path.join(dirPath,'Data'):
+                outDir = dirPath
 
-            plt.plot(wave, aveSpec, color='black', linewidth=0.5)
-            plt.plot(wave, aveSpec + filterFactor*stdSpec, color='black', linewidth=2, linestyle='dashed')
-            plt.plot(wave, aveSpec - filterFactor*stdSpec, color='black', linewidth=2, linestyle='dashed')
+            # Otherwise, put Plots in the chosen output directory from Main
+            plotDir = os.path.join(outDir,'Plots','L1BQC_Spectral_Filter')
 
-            plt.title(f'Sigma = {filterFactor}', fontdict=font)
-            plt.xlabel('Wavelength [nm]', fontdict=font)
-            plt.ylabel(f'{rType} [Normalized to peak value]', fontdict=font)
-            plt.subplots_adjust(left=0.15)
-            plt.subplots_adjust(bottom=0.15)
-            axes = plt.gca()
-            axes.grid()
+            if not os.path.exists(plotDir):
+                os.makedirs(plotDir)
 
-            # Save the plot
             _,filename = os.path.split(inFilePath)
             filebasename,_ = filename.rsplit('_',1)
             if station:
                 fp = os.path.join(plotDir, f'STATION_{station}_{filebasename}_{rType}.png')
             else:
                 fp = os.path.join(plotDir, f'{filebasename}_{rType}.png')
-            plt.savefig(fp)
-            plt.close()
+
+            # Rendered off the processing path; Controller waits for it before writing reports
+            print('Creating plots...')
+            Utilities.submitPlot(Utilities.plotSpecFilter, fp, wave, normSpec, badIndx, aveSpec, stdSpec,
+                                 filterFactor, rType)
 
         return badTimes
 
@@ -1944,75 +2147,89 @@ class Utilities:
                 This may benefit in the future from eliminating the thresholded values from the moving
                 average filter analysis.
         '''
-        if lightDark == 'Dark':
-            # For Darks, calculate the moving average and residual vectors
-            #   and the OVERALL standard deviation of the residual over the entire file
+        radiometry = np.array(radiometry1D, dtype=np.float64).reshape(-1, 1)
+        badIndex, badIndex2, badIndex3 = Utilities.deglitchBands(
+            [band], radiometry, windowSize, sigma, lightDark, minRad, maxRad, minMaxBand)
 
-            # First pass
-            avg = Utilities.movingAverage(radiometry1D, windowSize).tolist()
-            residual = np.array(radiometry1D) - np.array(avg)
-            stdData = np.std(residual)
+        return badIndex[:, 0].tolist(), badIndex2[:, 0].tolist(), badIndex3[:, 0].tolist()
 
-            badIndex = Utilities.darkConvolution(radiometry1D,avg,stdData,sigma)
+    @staticmethod
+    def deglitchBands(bands, radiometry, windowSize, sigma, lightDark, minRad, maxRad, minMaxBand):
+        ''' deglitchBand for all wavebands at once. radiometry is a 2-D (time x band) array
+                (e.g. HDFDataset.matrix); returns the first pass, second pass and threshold
+                badIndex as boolean (time x band) arrays.
+        '''
+        # Work band-major so that each band's reductions run over one contiguous row
+        data = np.ascontiguousarray(np.asarray(radiometry, dtype=np.float64).T)
 
-            # Second pass
-            radiometry1D2 = np.array(radiometry1D[:])
-            radiometry1D2[badIndex] = np.nan
-            radiometry1D2 = radiometry1D2.tolist()
-            avg2 = Utilities.movingAverage(radiometry1D2, windowSize).tolist()
-            residual = np.array(radiometry1D2) - np.array(avg2)
-            stdData = np.nanstd(residual)
+        avg, std = Utilities.deglitchFirstPassStats(data, windowSize, lightDark)
+        badIndex, badIndex2 = Utilities.deglitchPasses(data, avg, std, windowSize, sigma, lightDark)
+        badIndex3 = Utilities.deglitchThresholdBands(bands, data, minRad, maxRad, minMaxBand)
 
-            badIndex2 = Utilities.darkConvolution(radiometry1D2,avg2,stdData,sigma)
+        return badIndex.T, badIndex2.T, badIndex3.T
 
-            # Threshold pass
-            # Tolerates "None" for min or max Rad. ConfigFile.setting updated directly from checkbox
-            badIndex3 = Utilities.deglitchThresholds(band,radiometry1D,minRad,maxRad, minMaxBand)
+    @staticmethod
+    def deglitchFirstPassStats(data, windowSize, lightDark):
+        ''' Moving average and residual std of the first deglitching pass for a (band x time)
+            array. These depend on the window only, not sigma, so they can be shared by runs
+            with several sigmas (see DeglitchSweep). '''
+        # Note: the moving average is not tolerant to 2 or fewer records
+        avg = Utilities.movingAverageBands(data, windowSize)
+        residual = data - avg
 
+        if lightDark == 'Dark':
+            # For Darks, the OVERALL standard deviation of the residual over the entire file
+            std = np.std(residual, axis=1, keepdims=True)
         else:
-            # For Lights, calculate the moving average and residual vectors
-            #   and the ROLLING standard deviation of the residual
+            # For Lights, the ROLLING standard deviation of the residual
+            std = Utilities.rollingStdBands(residual, windowSize)
+            # This rolling std on the residual has a tendancy to blow up for extreme outliers,
+            # replace it with the median residual std when that happens
+            median = np.median(std, axis=1, keepdims=True)
+            std = np.where(std > median + 3*np.std(std, axis=1, keepdims=True), median, std)
 
-            # First pass
-            avg = Utilities.movingAverage(radiometry1D, windowSize).tolist()
-            residual = np.array(radiometry1D) - np.array(avg)
+        return avg, std
 
-            # Calculate the variation in the distribution of the residual
-            residualDf = pd.DataFrame(residual)
-            testing_std_as_df = residualDf.rolling(windowSize).std()
-            rolling_std = testing_std_as_df.replace(np.nan,
-                testing_std_as_df.iloc[windowSize - 1]).round(3).iloc[:,0].tolist()
+    @staticmethod
+    def deglitchPasses(data, avg, std, windowSize, sigma, lightDark):
+        ''' First and second deglitching passes for a (band x time) array, given the first pass
+            stats. sigma is a scalar or one value per row. '''
+        if not np.isscalar(sigma):
+            sigma = np.asarray(sigma, dtype=np.float64).reshape(-1, 1)
 
-            # This rolling std on the residual has a tendancy to blow up for extreme outliers,
-            # replace it with the median residual std when that happens
-            y = np.array(rolling_std)
-            y[y > np.median(y)+3*np.std(y)] = np.median(y)
-            rolling_std = y.tolist()
+        # First pass
+        badIndex = Utilities.convolutionBad(data, avg, std, sigma)
 
-            badIndex = Utilities.lightConvolution(radiometry1D,avg,rolling_std,sigma)
+        # Second pass
+        data2 = data.copy()
+        data2[badIndex] = np.nan # BEWARE: NaNs introduced
+        avg2 = Utilities.movingAverageBands(data2, windowSize)
+        residual2 = data2 - avg2
 
-            # Second pass
-            radiometry1D2 = np.array(radiometry1D[:])
-            radiometry1D2[badIndex] = np.nan
-            radiometry1D2 = radiometry1D2.tolist()
-            avg2 = Utilities.movingAverage(radiometry1D2, windowSize).tolist()
-            residual2 = np.array(radiometry1D2) - np.array(avg2)
-            residualDf2 = pd.DataFrame(residual2)
-            testing_std_as_df2 = residualDf2.rolling(windowSize).std()
-            rolling_std2 = testing_std_as_df2.replace(np.nan,
-                testing_std_as_df2.iloc[windowSize - 1]).round(3).iloc[:,0].tolist()
-            y = np.array(rolling_std2)
-            y[np.isnan(y)] = np.nanmedian(y)
-            y[y > np.nanmedian(y)+3*np.nanstd(y)] = np.nanmedian(y)
-            rolling_std2 = y.tolist()
+        if lightDark == 'Dark':
+            std2 = np.nanstd(residual2, axis=1, keepdims=True)
+        else:
+            std2 = Utilities.rollingStdBands(residual2, windowSize)
+            std2 = np.where(np.isnan(std2), np.nanmedian(std2, axis=1, keepdims=True), std2)
+            median = np.nanmedian(std2, axis=1, keepdims=True)
+            std2 = np.where(std2 > median + 3*np.nanstd(std2, axis=1, keepdims=True), median, std2)
 
-            badIndex2 = Utilities.lightConvolution(radiometry1D2,avg2,rolling_std2,sigma)
+        badIndex2 = Utilities.convolutionBad(data2, avg2, std2, sigma)
 
-            # Threshold pass
-            # Tolerates "None" for min or max Rad
-            badIndex3 = Utilities.deglitchThresholds(band, radiometry1D,minRad,maxRad, minMaxBand)
+        return badIndex, badIndex2
 
-        return badIndex, badIndex2, badIndex3
+    @staticmethod
+    def deglitchThresholdBands(bands, data, minRad, maxRad, minMaxBand):
+        ''' Threshold pass (deglitchThresholds) for a (band x time) array '''
+        # Tolerates "None" for min or max Rad. ConfigFile.setting updated directly from checkbox
+        badIndex3 = np.zeros(data.shape, dtype=bool)
+        if ConfigFile.settings["bL1aqcThreshold"]:
+            for j, band in enumerate(bands):
+                # Only run on the pre-selected waveband
+                if band == minMaxBand:
+                    badIndex3[j] = Utilities.deglitchThresholds(band, data[j], minRad, maxRad, minMaxBand)
+
+        return badIndex3
 
 
     @staticmethod
@@ -2373,21 +2590,110 @@ class Utilities:
         return True
 
 
+    @staticmethod
+    def arrayDigest(*arrays, prefix=''):
+        ''' Cache key identifying the contents (dtype, shape and values) of arrays, and a prefix '''
+        h = hashlib.blake2b(prefix.encode(), digest_size=16)
+        for a in arrays:
+            a = np.ascontiguousarray(a)
+            h.update(f'|{a.dtype.str}{a.dtype.descr}{a.shape}|'.encode())
+            h.update(a.tobytes())
+        return h.digest()
+
+    @staticmethod
+    def cacheStore(cache, size, key, value):
+        ''' Stores value in a dict used as a cache of at most size entries, dropping the oldest '''
+        while len(cache) >= size:
+            cache.pop(next(iter(cache)))
+        cache[key] = value
+        return value
+
+    @staticmethod
+    def cached(cache, size, key, compute):
+        ''' cache[key], computed with compute() and stored (see cacheStore) if not there yet '''
+        if key in cache:
+            return cache[key]
+        return Utilities.cacheStore(cache, size, key, compute())
+
+    # Interpolated RAW_UNCERTAINTIES tables of recently used (instrument, characterization set,
+    # wavelength grid) combinations, keyed by a digest of the raw tables and of the grids
+    uncertaintyTables = {}
+    UNCERTAINTY_CACHE_SIZE = 16
+
+    @staticmethod
+    def sensorWavelengths(node, sensor):
+        ''' Hyper-spectral wavelengths of the ES, LI or LT light dataset '''
+        if ConfigFile.settings['SensorType'].lower() == "seabird":
+            data = node.getGroup(sensor+'_LIGHT').getDataset(sensor)
+        elif ConfigFile.settings['SensorType'].lower() == "trios":
+            data = node.getGroup(sensor).getDataset(sensor)
+        return np.array(data.data.dtype.names, dtype=float)
+
+    @staticmethod
+    def uncertaintyTablesKey(node, mode):
+        ''' Digest of everything the interpolation depends on: the raw characterization tables
+            (which identify the instrument and the characterization set) and the wavelengths of
+            each sensor '''
+        names = [mode, ConfigFile.settings["SensorType"].lower()]
+        arrays = [Utilities.sensorWavelengths(node, sensor) for sensor in ['ES', 'LI', 'LT']]
+        for ds in node.getGroup("RAW_UNCERTAINTIES").datasets.values():
+            if ds.data is None:
+                names.append(f'{ds.id}:empty')
+            else:
+                names.append(ds.id)
+                arrays.append(ds.data)
+        return Utilities.arrayDigest(*arrays, prefix='_'.join(names))
+
+    @staticmethod
+    def memoizedUncertainties(node, mode, compute):
+        ''' Runs one of the computeUncertainties_* methods on the RAW_UNCERTAINTIES group of a node,
+            or attaches the tables it produced for an earlier file with the same instrument,
+            characterization set and wavelength grid '''
+        grp = node.getGroup("RAW_UNCERTAINTIES")
+        key = Utilities.uncertaintyTablesKey(node, mode)
+        if key in Utilities.uncertaintyTables:
+            for name, (columns, data) in Utilities.uncertaintyTables[key].items():
+                ds = grp.getDataset(name)
+                ds.columns = collections.OrderedDict((k, v.copy()) for k, v in columns.items())
+                ds.data = data.copy()
+            return True
+
+        # The original objects are held (not their ids, which freed objects can pass on) so that
+        # tables rebuilt by compute can be told apart from those it left alone
+        before = {name: (ds.columns, ds.data) for name, ds in grp.datasets.items()}
+        compute(node)
+        # Only the tables which were interpolated (or otherwise rebuilt) need to be kept
+        tables = {}
+        for name, ds in grp.datasets.items():
+            columns, data = before.get(name, (None, None))
+            if ds.columns is not columns or ds.data is not data:
+                tables[name] = (collections.OrderedDict((k, v.copy()) for k, v in ds.columns.items()),
+                                ds.data.copy())
+
+        Utilities.cacheStore(Utilities.uncertaintyTables, Utilities.UNCERTAINTY_CACHE_SIZE, key, tables)
+        return True
+
     @staticmethod
     def interpUncertainties_Factory(node):
+        return Utilities.memoizedUncertainties(node, 'Factory', Utilities.computeUncertainties_Factory)
+
+    @staticmethod
+    def interpUncertainties_Class(node):
+        return Utilities.memoizedUncertainties(node, 'Class', Utilities.computeUncertainties_Class)
+
+    @staticmethod
+    def interpUncertainties_FullChar(node):
+        return Utilities.memoizedUncertainties(node, 'FullChar', Utilities.computeUncertainties_FullChar)
+
+    @staticmethod
+    def computeUncertainties_Factory(node):
 
         grp = node.getGroup("RAW_UNCERTAINTIES")
         sensorList = ['ES', 'LI', 'LT']
         for sensor in sensorList:
 
-            ## retrieve dataset from corresponding instrument
-            if ConfigFile.settings['SensorType'].lower() == "seabird":
-                data = node.getGroup(sensor+'_LIGHT').getDataset(sensor)
-            elif ConfigFile.settings['SensorType'].lower() == "trios":
-                data = node.getGroup(sensor).getDataset(sensor)
-
-            # Retrieve hyper-spectral wavelengths from dataset
-            x_new = np.array(pd.DataFrame(data.data).columns, dtype=float)
+            # Retrieve hyper-spectral wavelengths from corresponding instrument
+            x_new = Utilities.sensorWavelengths(node, sensor)
 
             for data_type in ["_RADCAL_UNC"]:
                 ds = grp.getDataset(sensor+data_type)
@@ -2460,20 +2766,14 @@ class Utilities:
 
 
     @staticmethod
-    def interpUncertainties_Class(node):
+    def computeUncertainties_Class(node):
 
         grp = node.getGroup("RAW_UNCERTAINTIES")
         sensorList = ['ES', 'LI', 'LT']
         for sensor in sensorList:
 
-            ## retrieve dataset from corresponding instrument
-            if ConfigFile.settings['SensorType'].lower() == "seabird":
-                data = node.getGroup(sensor+'_LIGHT').getDataset(sensor)
-            elif ConfigFile.settings['SensorType'].lower() == "trios":
-                data = node.getGroup(sensor).getDataset(sensor)
-
-            # Retrieve hyper-spectral wavelengths from dataset
-            x_new = np.array(pd.DataFrame(data.data).columns, dtype=float)
+            # Retrieve hyper-spectral wavelengths from corresponding instrument
+            x_new = Utilities.sensorWavelengths(node, sensor)
 
 
             # RADCAL data do not need interpolation, just removing the first line
@@ -2576,7 +2876,7 @@ class Utilities:
 
 
     @staticmethod
-    def interpUncertainties_FullChar(node):
+    def computeUncertainties_FullChar(node):
         """
         For full char, all input comes already with a wavelength columns,
         except RADCAL LAMP ad PANEL, that need to be interpolated on wvl.
@@ -2597,14 +2897,7 @@ class Utilities:
             # x_new2 = bands[valid]
 
             ## retrieve hyper-spectral wavelengths from corresponding instrument
-            if ConfigFile.settings['SensorType'].lower() == "seabird":
-                data = node.getGroup(sensor+'_LIGHT').getDataset(sensor)
-            elif ConfigFile.settings['SensorType'].lower() == "trios":
-                # inv_dict = {v: k for k, v in sensorId.items()}
-                # data = node.getGroup('SAM_'+inv_dict[sensor]+'.dat').getDataset(sensor)
-                data = node.getGroup(sensor).getDataset(sensor)
-
-            x_new = np.array(pd.DataFrame(data.data).columns, dtype=float)
+            x_new = Utilities.sensorWavelengths(node, sensor)
 
             # intersect, ind1, valid = np.intersect1d(x_new, bands, return_indices=True)
             if len(bands[valid]) != len(x_new):
@@ -2692,75 +2985,99 @@ class Utilities:
         :gp: HDFGroup object - Input data is stored as HDFDatasets and appended to this group.
         return type: None - may be changed to bool for better error handling
         """
+        # The text is parsed once per file content (see Utilities.cachedEvents); the resulting
+        # events are then applied to gp
+        for event in Utilities.cachedEvents(filepath, 'unc', Utilities.readUncEvents):
+            if event[0] == 'calType':
+                gp.attributes['INSTRUMENT_CAL_TYPE'] = event[1]
+            elif event[0] == 'calFile':
+                if 'CAL_FILE' not in gp.attributes.keys():
+                    gp.attributes['CAL_FILE'] = []
+                gp.attributes['CAL_FILE'].append(event[1])
+            elif event[0] == 'data':
+                _, name, index, attrs, columns, ended = event
+                ds = gp.addDataset(name)
+                if ds is None:
+                    ds = gp.getDataset(name)
+                ds.attributes['INDEX'] = list(index)  # populate ds attributes with column names
+                # populate ds attributes with header data
+                for k, v in attrs.items():
+                    ds.attributes[k] = v  # set the attributes
+                Utilities.addColumns(ds, columns)  # add the data
+                if ended:
+                    ds.columnsToDataset()  # convert read data to dataset
+
+    @staticmethod
+    def readUncEvents(lines: list) -> list:
+        """Parses the lines of a calibration file read by read_unc into a list of events: ('calType', str),
+        ('calFile', str), and ('data', dataset name, column names, attributes, columns, ended)"""
+        events = []
         begin_data = False  # set up data flag
         attrs = {}
         end_flag = 0
-
-        with open(filepath, 'r') as f:  # open file
-            key = None; index = None
-            while True:  # start loop
-                line = Utilities.getline(f, '\n')  # reads the file until a '\n' character is reached
-                if end_flag == 0:  # end condition not met
-
-                    if '[END_OF_CALDATA]' in line:  # end conditions met
-                        begin_data = False  # set to not collect data
-                        ds.columnsToDataset()  # convert read data to dataset
-                        end_flag = 1
-
-                    elif line.startswith('!'):  # first lines start with '!' so can be used to determine which file is being read
-                        if 'FRM' in line:
-                            gp.attributes['INSTRUMENT_CAL_TYPE'] = line[1:]
-                        else:
-                            caltype = line[1:]
-                            if 'CAL_FILE' not in gp.attributes.keys():
-                                gp.attributes['CAL_FILE'] = []
-                            gp.attributes['CAL_FILE'].append(line[1:])
-
-                    # elif line.startswith('SAT'):
-                    #     device = line.rstrip()
-                    #     name = device+'_'+caltype
-
-                    # elif line.startswith('SAM_'):
-                    #     device = line.rstrip()
-                    #     name = device+'_'+caltype
-
-                    elif begin_data:
-                        Utilities.parseLine(line, ds)  # add the data
-
-                    else:  # part of header
-                        if '[CALDATA]' in line:  # begin reading data
-                            begin_data = True
-                            ds = gp.addDataset(name)
-                            if ds is None:
-                                ds = gp.getDataset(name)
-                            ds.attributes['INDEX'] = [x for x in index if x != ' ']  # populate ds attributes with column names
-                            index = None
-                            # populate ds attributes with header data
-                            for k, v in attrs.items():
-                                ds.attributes[k] = v  # set the attributes
-                            attrs.clear()
-
-                        else:  # part of header, check if attribute or column names
-                            if line.startswith('['):  # if line has '[ ]' then take the next line as the attribute
-                                key = line[1:-1]
-                            elif key is not None:
-                                attrs[key] = line
-                                if key == "DEVICE":
-                                    device = line.rstrip()
-                                    name = device+'_'+caltype
-                                key = None
-                            else:  # only blank lines and comments get here
-                                if index is None and len(line.split(',')) > 2:  # if comma separated then must be column names!
-                                    index = list(line[1:].split(','))
-
-                else:  # check for end condition
-                    # this will skip the first real line after 'END_OF_XXXXDATA', however this is always a comment so ignored.
-                    if end_flag >= 3:
-                        break  # end if empty lines found after [END_DATA], else more data to be read
-                    elif not line:
-                        end_flag += 1
+        key = None; index = None
+        block = None
+        i = 0
+
+        def endBlock(ended):
+            _, name, blockIndex, blockAttrs, dataLines = block
+            events.append(('data', name, blockIndex, blockAttrs, Utilities.parseColumns(dataLines, blockIndex), ended))
+
+        while True:  # start loop
+            if i >= len(lines) and end_flag == 0:
+                break  # end of file without the blank lines closing the data
+            line = lines[i] if i < len(lines) else ''
+            i += 1
+            if end_flag == 0:  # end condition not met
+
+                if '[END_OF_CALDATA]' in line:  # end conditions met
+                    begin_data = False  # set to not collect data
+                    endBlock(True)
+                    block = None
+                    end_flag = 1
+
+                elif line.startswith('!'):  # first lines start with '!' so can be used to determine which file is being read
+                    if 'FRM' in line:
+                        events.append(('calType', line[1:]))
                     else:
-                        end_flag = 0
+                        caltype = line[1:]
+                        events.append(('calFile', line[1:]))
+
+                elif begin_data:
+                    block[4].append(line)  # add the data
+
+                else:  # part of header
+                    if '[CALDATA]' in line:  # begin reading data
+                        begin_data = True
+                        block = ('data', name, [x for x in index if x != ' '], dict(attrs), [])
+                        index = None
+                        attrs.clear()
+
+                    else:  # part of header, check if attribute or column names
+                        if line.startswith('['):  # if line has '[ ]' then take the next line as the attribute
+                            key = line[1:-1]
+                        elif key is not None:
+                            attrs[key] = line
+                            if key == "DEVICE":
+                                device = line.rstrip()
+                                name = device+'_'+caltype
+                            key = None
+                        else:  # only blank lines and comments get here
+                            if index is None and len(line.split(',')) > 2:  # if comma separated then must be column names!
+                                index = list(line[1:].split(','))
+
+            else:  # check for end condition
+                # this will skip the first real line after 'END_OF_XXXXDATA', however this is always a comment so ignored.
+                if end_flag >= 3:
+                    break  # end if empty lines found after [END_DATA], else more data to be read
+                elif not line:
+                    end_flag += 1
+                else:
+                    end_flag = 0
+
+        if block is not None:
+            endBlock(False)
+        return events
 
     @staticmethod
     def parseLine_no_index(line: str, ds) -> None:
@@ -2775,62 +3092,184 @@ class Utilities:
 
     @staticmethod
     def read_char(filepath: str, gp) -> None:
+        # The text is parsed once per file content (see Utilities.cachedEvents); the resulting
+        # events are then applied to gp
+        Azimuth_angle = None
+        for event in Utilities.cachedEvents(filepath, 'char', Utilities.readCharEvents):
+            if event[0] == 'fileType':
+                gp.attributes['CHARACTERISATION_FILE_TYPE'] = event[1]
+            elif event[0] == 'device':
+                name = event[1] + '_' + gp.attributes['CHARACTERISATION_FILE_TYPE']
+            elif event[0] == 'data':
+                _, attrs, columns, ended = event
+                ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}")
+                if ds is None:
+                    if 'AZIMUTH_ANGLE' in attrs:  # reading angular file and has identical identifiers for different az angles
+                        ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}_AZ{attrs['AZIMUTH_ANGLE']}")
+                        Azimuth_angle = attrs['AZIMUTH_ANGLE']
+                    elif Azimuth_angle is not None:  # uncertainty also repeated so save the az angle from earlier to use here
+                        ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}_AZ{Azimuth_angle}")
+                        Azimuth_angle = None
+                    else:
+                        msg = f"dataset could not be contructed, Utilties.read_char(file-path, HDFGroup) in {gp.attributes['CHARACTERISATION_FILE_TYPE']}"
+                        print(msg)
+                        raise KeyError
+                # populate ds attributes with header data
+                for k, v in attrs.items():
+                    ds.attributes[k] = v  # set the attributes
+                Utilities.addColumns(ds, columns)  # add the data
+                if ended:
+                    ds.columnsToDataset()  # convert read data to dataset
+        return "end condition reached"
+
+    @staticmethod
+    def readCharEvents(lines: list) -> list:
+        """Parses the lines of a characterisation file read by read_char into a list of events: ('fileType', str),
+        ('device', str), and ('data', attributes, columns, ended)"""
+        events = []
         begin_data = False  # set up data flag
         attrs = {}
         end_count = 0
-        Azimuth_angle = None
-
-        with open(filepath, 'r') as f:  # open file
-            key = None
-            while True:  # start loop
-                line = Utilities.getline(f, '\n')  # reads the file until a '\n' character is reached
-                if not line:  # breaks out of loop if three empty lines in a row
-                    if end_count < 3:
-                        end_count += 1
+        key = None
+        block = None
+        i = 0
+        while True:  # start loop
+            line = lines[i] if i < len(lines) else ''
+            i += 1
+            if not line:  # breaks out of loop if three empty lines in a row
+                if end_count < 3:
+                    end_count += 1
+                else:
+                    break
+            elif not line.startswith('#'):  # not a comment
+                end_count = 0
+                if begin_data:
+                    if 'end' in line.lower():  # end conditions met
+                        begin_data = False  # set to read header data
+                        events.append(('data', block[0], Utilities.parseColumns(block[1]), True))
+                        block = None
                     else:
-                        return "end condition reached"
-                elif not line.startswith('#'):  # not a comment
-                    end_count = 0
-                    if begin_data:
-                        if 'end' in line.lower():  # end conditions met
-                            begin_data = False  # set to read header data
-                            ds.columnsToDataset()  # convert read data to dataset
-                        else:
-                            Utilities.parseLine_no_index(line, ds)  # add the data
-                    else:  # part of header
-                        if line.startswith('!'):  # get filetype from ! comment
-                            if line != '!FRM4SOC_CP':
-                                gp.attributes['CHARACTERISATION_FILE_TYPE'] = line[1:]
-                        elif any([k in line.lower() for k in ['data', 'lsf', 'uncertainty', 'coserror']]) is True:
-                        # elif ['data', 'lsf', 'uncertainty'] in line.lower():  # begin reading data
-                            begin_data = True
-                            attrs['DATA_TYPE'] = line[1:line.lower().find('data')]
-                            ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}")
-                            if ds is None:
-                                if 'AZIMUTH_ANGLE' in attrs:  # reading angular file and has identical identifiers for different az angles
-                                    ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}_AZ{attrs['AZIMUTH_ANGLE']}")
-                                    Azimuth_angle = attrs['AZIMUTH_ANGLE']
-                                elif Azimuth_angle is not None:  # uncertainty also repeated so save the az angle from earlier to use here
-                                    ds = gp.addDataset(f"{name}_{attrs['DATA_TYPE']}_AZ{Azimuth_angle}")
-                                    Azimuth_angle = None
-                                else:
-                                    msg = f"dataset could not be contructed, Utilties.read_char(file-path, HDFGroup) in {gp.attributes['CHARACTERISATION_FILE_TYPE']}"
-                                    print(msg)
-                                    raise KeyError
-                            # populate ds attributes with header data
-                            for k, v in attrs.items():
-                                ds.attributes[k] = v  # set the attributes
-                            attrs.clear()
-
-                        else:  # part of header, check if attribute or column names
-                            if line.startswith('['):  # if line has '[ ]' then take the next line as the attribute
-                                key = line[1:-1]
-                            elif key is not None:
-                                attrs[key] = line
-                                if key.lower() == "device":
-                                    device = line.rstrip()
-                                    name = device + '_' + gp.attributes['CHARACTERISATION_FILE_TYPE']
-                                key = None
+                        block[1].append(line)  # add the data
+                else:  # part of header
+                    if line.startswith('!'):  # get filetype from ! comment
+                        if line != '!FRM4SOC_CP':
+                            events.append(('fileType', line[1:]))
+                    elif any([k in line.lower() for k in ['data', 'lsf', 'uncertainty', 'coserror']]) is True:
+                        begin_data = True
+                        attrs['DATA_TYPE'] = line[1:line.lower().find('data')]
+                        block = (dict(attrs), [])
+                        attrs.clear()
+
+                    else:  # part of header, check if attribute or column names
+                        if line.startswith('['):  # if line has '[ ]' then take the next line as the attribute
+                            key = line[1:-1]
+                        elif key is not None:
+                            attrs[key] = line
+                            if key.lower() == "device":
+                                events.append(('device', line.rstrip()))
+                            key = None
+
+        if block is not None:
+            events.append(('data', block[0], Utilities.parseColumns(block[1]), False))
+        return events
+
+    @staticmethod
+    def parseColumns(lines: list, index: list = None) -> dict:
+        """Parses tab separated data lines into columns keyed by index (column names), or by column number
+        without an index, as parseLine and parseLine_no_index do line by line. Empty fields are skipped and
+        values that are not numbers are kept as strings."""
+        rows = [line.split('\t') for line in lines]
+        if len(rows) > 0 and all(len(row) == len(rows[0]) and '' not in row for row in rows) and \
+                (index is None or len(set(index[:len(rows[0])])) == len(rows[0])):
+            # Rectangular block: convert it all at once
+            try:
+                values = [list(map(float, row)) for row in rows]
+            except ValueError:
+                values = None
+            if values is not None:
+                return {(str(i) if index is None else index[i]): list(column) for i, column in enumerate(zip(*values))}
+
+        columns = {}
+        for row in rows:
+            for i, x in enumerate(row):
+                if x:
+                    k = str(i) if index is None else index[i]
+                    if k not in columns.keys():
+                        columns[k] = []
+                    try:
+                        columns[k].append(float(x))
+                    except ValueError:
+                        columns[k].append(x)
+        return columns
+
+    @staticmethod
+    def addColumns(ds, columns: dict) -> None:
+        ''' Appends parsed columns to the columns of a dataset '''
+        for k, v in columns.items():
+            if k not in ds.columns.keys():
+                ds.columns[k] = []
+            ds.columns[k].extend(v)
+
+    # Version of the parsed events stored by cachedEvents; change it whenever readUncEvents or
+    # readCharEvents change what they return
+    EVENTS_CACHE_VERSION = 2
+    # Content hash of each file by (path, mtime, size), and the parsed events of recent hashes
+    eventsFileHashes = {}
+    eventsCache = {}
+    EVENTS_CACHE_SIZE = 64
+
+    @staticmethod
+    def replaceFile(path, write, mode='wb'):
+        ''' Creates or replaces a file with write(f), writing it under a temporary name first so that
+            concurrent runs never read a partial file '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, mode) as f:
+                write(f)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def cachedEvents(filepath: str, kind: str, parser) -> list:
+        """Events of a calibration/characterisation file parsed by parser, cached by content.
+
+        The content hash of a file is only recomputed when its modification time or size changes.
+        Parsed events are kept in memory and written as JSON to a __cache__ directory next to the
+        file, so that later runs skip the text parsing entirely. They are never pickled, as these
+        directories are copied and shared between users."""
+        stat = os.stat(filepath)
+        statKey = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size, kind)
+        digest = Utilities.eventsFileHashes.get(statKey)
+        if digest is None:
+            h = hashlib.sha256(f'{kind}_{Utilities.EVENTS_CACHE_VERSION}_'.encode())
+            with open(filepath, 'rb') as f:
+                h.update(f.read())
+            digest = h.hexdigest()
+            Utilities.eventsFileHashes[statKey] = digest
+        if digest in Utilities.eventsCache:
+            return Utilities.eventsCache[digest]
+
+        cachePath = os.path.join(os.path.dirname(os.path.abspath(filepath)), '__cache__', f'{digest}.json')
+        events = None
+        if os.path.isfile(cachePath):
+            try:
+                with open(cachePath, 'r') as f:
+                    events = json.load(f)
+            except (OSError, ValueError):
+                events = None
+
+        if events is None:
+            with open(filepath, 'r') as f:  # open file
+                events = parser(f.read().split('\n'))
+            try:
+                Utilities.replaceFile(cachePath, lambda f: json.dump(events, f), 'w')
+            except OSError:
+                pass  # read-only calibration directory; parse again next time
+
+        return Utilities.cacheStore(Utilities.eventsCache, Utilities.EVENTS_CACHE_SIZE, digest, events)
 
     @staticmethod
     def datasetNan2Zero(inputArray):
@@ -78,7 +78,7 @@ def readLUT(node,filename, headerlines):
 
     gp = HDFGroup()
     gp.id = 'LUT'
-    node.groups.append(gp)
+    node.appendGroup(gp)
 
     LUTDataset = gp.addDataset("LUT")
     LUTDataset.columns = lut
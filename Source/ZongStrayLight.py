@@ -0,0 +1,45 @@
+import numpy as np
+
+from Source.Utilities import Utilities
+
+
+class ZongStrayLight:
+    ''' Zong et al. (2006) stray light correction matrix C of a line spread function (LSF)
+        characterization.
+
+        C only depends on the LSF matrix and the in-band width n_IB, so it is cached in memory by
+        LSF content, and files of the same instrument in one session reuse it instead of rebuilding
+        and inverting the matrix. (The Zong correction is currently disabled in the processing;
+        see ProcessL1b_FRMCal.processL1b_SeaBird.) '''
+
+    # Correction matrices of recently used characterizations, keyed by content hash
+    matrices = {}
+    CACHE_SIZE = 8
+
+    @staticmethod
+    def SDF(LSF, n_IB=3):
+        ''' Stray light distribution function matrix (Zong eq. 1): each row of the LSF divided by
+            its in-band sum (the columns i-n_IB to i+n_IB), with the in-band part set to zero '''
+        LSF = np.where(LSF <= 0, 0, np.asarray(LSF, dtype=np.float64))
+        i = np.arange(LSF.shape[0])[:, None]
+        j = np.arange(LSF.shape[1])[None, :]
+        inBand = (j >= i - n_IB) & (j <= i + n_IB)
+        IBsum = np.sum(np.where(inBand, LSF, 0.0), axis=1)
+        IBsum[IBsum == 0] = 1.0
+        return np.where(inBand, 0.0, LSF/IBsum[:, None])
+
+    @staticmethod
+    def computeMatrix(LSF, n_IB=3):
+        A = np.identity(len(LSF)) + ZongStrayLight.SDF(LSF, n_IB)  # Matrix A from eq. 8
+        # Matrix C from eq. 9, solving A C = I rather than inverting A
+        return np.linalg.solve(A, np.identity(len(LSF)))
+
+    @staticmethod
+    def correctionMatrix(LSF, n_IB=3):
+        ''' The correction matrix C of an LSF matrix, from memory or computed (and then kept) '''
+        def build():
+            C = ZongStrayLight.computeMatrix(LSF, n_IB)
+            C.setflags(write=False)
+            return C
+        key = Utilities.arrayDigest(np.asarray(LSF, dtype=np.float64), prefix=f'n_IB={n_IB}')
+        return Utilities.cached(ZongStrayLight.matrices, ZongStrayLight.CACHE_SIZE, key, build)
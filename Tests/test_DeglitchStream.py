@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from Source.ConfigFile import ConfigFile
+from Source.DeglitchStream import DeglitchStream
+from Source.Utilities import Utilities
+
+BANDS = [400.0 + 5*j for j in range(12)]
+
+
+def radiometry(n=300, seed=0):
+    ''' Noisy (time x band) counts with occasional spikes '''
+    rng = np.random.default_rng(seed)
+    data = rng.normal(1000, 5, (n, len(BANDS))).round()
+    data[rng.random(data.shape) < 0.02] += 300
+    return data
+
+
+def streamed(data, chunk, windowSize, lightDark, stats=None):
+    stream = DeglitchStream(BANDS, windowSize, 3.0, lightDark, stats=stats)
+    badIndex = [stream.update(data[i:i+chunk]) for i in range(0, len(data), chunk)]
+    badIndex.append(stream.finish())
+    return np.concatenate(badIndex)
+
+
+@pytest.fixture(autouse=True)
+def noThreshold():
+    ConfigFile.settings['bL1aqcThreshold'] = 0
+
+
+@pytest.mark.parametrize('lightDark, windowSize', [('Dark', 11), ('Light', 5)])
+def test_chunking(lightDark, windowSize):
+    data = radiometry()
+    single = streamed(data, 1, windowSize, lightDark)
+    assert len(single) == len(data)
+    for chunk in (7, 64, len(data)):
+        assert np.array_equal(streamed(data, chunk, windowSize, lightDark), single)
+
+
+@pytest.mark.parametrize('lightDark, windowSize', [('Dark', 11), ('Light', 5)])
+def test_referenceStats(lightDark, windowSize):
+    data = radiometry(seed=1)
+    stats = DeglitchStream.referenceStats(data, windowSize, 3.0, lightDark)
+    batch = Utilities.deglitchBands(BANDS, data, windowSize, 3.0, lightDark, None, None, None)
+    assert np.array_equal(streamed(data, 5, windowSize, lightDark, stats), np.any(batch[0] | batch[1] | batch[2], axis=1))
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from Source.HDFRoot import HDFRoot
+
+'''
+Benchmarks HDF5 output compression (see README_configuration.md, HDF5 Compression).
+Reads an existing HyperCP HDF file (any level), rewrites it with each set of writer options,
+and reports write time, file size, and read time, checking that the data read back unchanged.
+
+Usage: python benchmark_hdf_compression.py path/to/file_L1B.hdf [repeats]
+'''
+
+OPTIONS = [
+    ('none', None),
+    ('lzf', {'compression': 'lzf', 'shuffle': False, 'chunkRows': 0, 'compressionLevel': None}),
+    ('lzf+shuffle', {'compression': 'lzf', 'shuffle': True, 'chunkRows': 0, 'compressionLevel': None}),
+    ('gzip1+shuffle', {'compression': 'gzip', 'shuffle': True, 'chunkRows': 0, 'compressionLevel': 1}),
+    ('gzip4', {'compression': 'gzip', 'shuffle': False, 'chunkRows': 0, 'compressionLevel': 4}),
+    ('gzip4+shuffle', {'compression': 'gzip', 'shuffle': True, 'chunkRows': 0, 'compressionLevel': 4}),
+    ('gzip9+shuffle', {'compression': 'gzip', 'shuffle': True, 'chunkRows': 0, 'compressionLevel': 9}),
+]
+
+
+def sameData(a, b):
+    for gpA, gpB in zip(a.groups, b.groups):
+        for name, ds in gpA.datasets.items():
+            if ds.data.tobytes() != gpB.datasets[name].data.tobytes():
+                return False
+    return True
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python benchmark_hdf_compression.py path/to/file.hdf [repeats]')
+        sys.exit(1)
+    inFilePath = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    root = HDFRoot.readHDF5(inFilePath)
+    print(f'{os.path.basename(inFilePath)}: {os.path.getsize(inFilePath)/1e6:.2f} MB on disk')
+    print(f'{"options":<16}{"write (s)":>11}{"size (MB)":>11}{"ratio":>8}{"read (s)":>10}')
+
+    baseSize = None
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for label, options in OPTIONS:
+            outFilePath = os.path.join(tmpDir, f'{label}.hdf')
+            writeTimes = []
+            readTimes = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                root.writeHDF5(outFilePath, options if options is not None else {})
+                writeTimes.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                check = HDFRoot.readHDF5(outFilePath)
+                readTimes.append(time.perf_counter() - t0)
+            size = os.path.getsize(outFilePath)
+            if baseSize is None:
+                baseSize = size
+            status = '' if sameData(root, check) else '  DATA MISMATCH'
+            print(f'{label:<16}{np.median(writeTimes):>11.3f}{size/1e6:>11.2f}'
+                  f'{baseSize/size:>8.2f}{np.median(readTimes):>10.3f}{status}')
+
+
+if __name__ == '__main__':
+    main()